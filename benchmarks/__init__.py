@@ -0,0 +1,6 @@
+"""
+Benchmarks of TreeTracer ingestion, plotting and interaction latency.
+
+    python -m benchmarks.run --sizes 10k,100k,1M --groups 1,10,200 -o results.json
+    python -m benchmarks.compare baseline.json results.json
+"""
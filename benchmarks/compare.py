@@ -0,0 +1,55 @@
+import argparse
+import json
+import sys
+
+
+# Slowdowns above this ratio are reported as regressions
+DEFAULT_THRESHOLD = 1.2
+
+METRICS = ["seconds", "peak_bytes", "payload_bytes"]
+
+
+def load_cases(path):
+    with open(path) as f:
+        results = json.load(f)
+    return {(c["rows"], c["groups"], c["stage"]): c for c in results["cases"]}
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """
+    Ratios current / baseline of every metric of the cases found in both.
+    Returns rows of (rows, groups, stage, ratios, regressed).
+    """
+    rows = []
+    for key in sorted(set(baseline) & set(current)):
+        ratios = {}
+        for metric in METRICS:
+            old, new = baseline[key].get(metric), current[key].get(metric)
+            ratios[metric] = new / old if old and new is not None else None
+        regressed = any(r is not None and r > threshold for r in ratios.values())
+        rows.append((*key, ratios, regressed))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.compare",
+        description="Compare two benchmark result files",
+    )
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    rows = compare(load_cases(args.baseline), load_cases(args.current), args.threshold)
+    print(f"{'rows':>10} {'groups':>6} {'stage':<22}" + "".join(f"{m:>15}" for m in METRICS))
+    for n, groups, stage, ratios, regressed in rows:
+        cells = "".join(
+            f"{'-' if r is None else f'{r:.2f}x':>15}" for r in ratios.values()
+        )
+        print(f"{n:>10,} {groups:>6} {stage:<22}{cells}" + ("  REGRESSION" if regressed else ""))
+    return 1 if any(row[-1] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+import argparse
+import bz2
+import gzip
+import json
+import os
+import shutil
+import tempfile
+
+from treetracer.loader import load_path
+
+from .run import environment, measure, parse_count
+from .synthetic import write_trace
+
+
+DEFAULT_SIZES = "100k,1M"
+DEFAULT_GROUPS = 10
+
+
+def _open_zstd(path):
+    import zstandard
+
+    return zstandard.ZstdCompressor().stream_writer(open(path, "wb"), closefd=True)
+
+
+# Compressed formats by extension, as written by open(path) in binary mode
+FORMATS = {
+    ".gz": lambda path: gzip.open(path, "wb", compresslevel=6),
+    ".bz2": lambda path: bz2.open(path, "wb"),
+    ".zst": _open_zstd,
+}
+
+
+def compressed_copy(path, extension):
+    """
+    Compress the trace at path once and return the compressed file's path,
+    or None if the format's package is not installed.
+    """
+    target = path + extension
+    if os.path.exists(target):
+        return target
+    tmp = f"{target}.{os.getpid()}.tmp"
+    try:
+        out = FORMATS[extension](tmp)
+    except ImportError:
+        return None
+    with open(path, "rb") as src, out:
+        shutil.copyfileobj(src, out, 1 << 20)
+    os.replace(tmp, target)
+    return target
+
+
+def run(sizes, groups, data_dir, repeat=3, memory=True, seed=0):
+    results = {"environment": environment(), "cases": []}
+    for rows in sizes:
+        path = write_trace(data_dir, rows, groups, seed=seed)
+        raw_bytes = os.path.getsize(path)
+        print(f"{rows:>10,} rows {groups:>4} groups, {raw_bytes / 1e6:.1f} MB raw", flush=True)
+        files = {"tsv": path}
+        for extension in FORMATS:
+            compressed = compressed_copy(path, extension)
+            if compressed is None:
+                print(f"    skipping {extension}: compression package not installed")
+                continue
+            files["tsv" + extension] = compressed
+
+        for name, file in files.items():
+            # Parsed without the trace cache, which would skip the work
+            seconds, peak, _ = measure(lambda: load_path(file), repeat, memory)
+            rec = {
+                "stage": f"load {name}",
+                "rows": rows,
+                "groups": groups,
+                "seconds": seconds,
+                "peak_bytes": peak,
+                "file_bytes": os.path.getsize(file),
+                "raw_mb_per_second": raw_bytes / seconds / 1e6,
+            }
+            results["cases"].append(rec)
+            print(
+                f"    {rec['stage']:<16}{seconds:>9.3f} s"
+                f"{rec['file_bytes'] / 1e6:>9.1f} MB"
+                f"{rec['raw_mb_per_second']:>9.1f} MB/s"
+                + (f"{peak / 1e6:>10.1f} MB peak" if peak else ""),
+                flush=True,
+            )
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.ingest",
+        description="Compare loading raw and gzip, bz2 or zstd compressed traces",
+    )
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="row counts, e.g. 100k,1M")
+    parser.add_argument("--groups", type=int, default=DEFAULT_GROUPS)
+    parser.add_argument("--repeat", type=int, default=3, help="timed loads per file")
+    parser.add_argument(
+        "--no-memory", action="store_true", help="skip the traced peak-memory call"
+    )
+    parser.add_argument(
+        "--data-dir",
+        default=os.path.join(tempfile.gettempdir(), "treetracer-bench"),
+        help="where synthetic traces are written and reused",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", default="ingest-results.json")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run(
+        [parse_count(s) for s in args.sizes.split(",")],
+        args.groups,
+        args.data_dir,
+        args.repeat,
+        not args.no_memory,
+        args.seed,
+    )
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=1)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
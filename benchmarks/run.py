@@ -0,0 +1,249 @@
+import argparse
+import base64
+import datetime
+import importlib.metadata
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import dash._callback
+import dash._utils
+
+from treetracer.app import create_dash_app
+from treetracer.cache import FigureCache
+from treetracer.callbacks import register_callbacks
+from treetracer.plot_utils import add_trace_multiplot, make_plot_grid
+from treetracer.store import SessionStore
+
+from .synthetic import write_trace
+
+
+DEFAULT_SIZES = "10k,100k,1M"
+DEFAULT_GROUPS = "1,10,200"
+STAGES = ["upload", "display_plots", "update_graph", "add_trace_multiplot"]
+
+_SUFFIXES = {"k": 10**3, "m": 10**6}
+
+
+def parse_count(text):
+    """
+    Parse a row count such as 500, 10k or 10M.
+    """
+    text = text.strip().lower()
+    if text[-1] in _SUFFIXES:
+        return int(float(text[:-1]) * _SUFFIXES[text[-1]])
+    return int(text)
+
+
+def payload_size(value):
+    """
+    Bytes of a callback result or figure serialized as Dash sends it.
+    """
+    return len(dash._utils.to_json(value))
+
+
+def measure(func, repeat=3, memory=True):
+    """
+    Best wall time of repeat calls of func and the peak memory traced
+    during one more call. Returns (seconds, peak_bytes, last_result).
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    peak = None
+    if memory:
+        tracemalloc.start()
+        result = func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return min(times), peak, result
+
+
+def app_callbacks(store):
+    """
+    Callback functions of a fresh app without background jobs, by name.
+    """
+    dash._callback.GLOBAL_CALLBACK_MAP.clear()
+    dash._callback.GLOBAL_CALLBACK_LIST.clear()
+    # Without the figure cache, so that repeated calls redo the work
+    register_callbacks(create_dash_app(), store, figures=FigureCache(0))
+    callbacks = {}
+    for entry in dash._callback.GLOBAL_CALLBACK_MAP.values():
+        func = entry["callback"]
+        func = getattr(func, "__wrapped__", func)
+        callbacks[func.__name__] = func
+    return callbacks
+
+
+def bench_case(path, repeat=3, memory=True):
+    """
+    Time every stage on one trace file; returns one record per stage.
+    """
+    filename = os.path.basename(path)
+    with open(path, "rb") as f:
+        content = "data:text/tab-separated-values;base64," + base64.b64encode(
+            f.read()
+        ).decode()
+
+    store = SessionStore()
+    callbacks = app_callbacks(store)
+    sessions = iter(range(10**9))
+    records = []
+
+    def record(stage, seconds, peak, payload=None):
+        records.append(
+            {
+                "stage": stage,
+                "seconds": seconds,
+                "peak_bytes": peak,
+                "payload_bytes": payload,
+            }
+        )
+
+    # Parsing of update_uploaded_files, in a new session every call
+    def upload():
+        session_id = f"upload-{next(sessions)}"
+        return callbacks["update_uploaded_files"](
+            [content], [filename], [0], None, session_id
+        )[0]
+
+    seconds, peak, stored_data = measure(upload, repeat, memory)
+    record("upload", seconds, peak)
+
+    session_id = "bench"
+    stored_data = callbacks["update_uploaded_files"](
+        [content], [filename], [0], None, session_id
+    )[0]
+    item = json.loads(stored_data)[0]
+    selected = [filename]
+    dims = item["dimensions"][:3]
+
+    seconds, peak, result = measure(
+        lambda: callbacks["display_plots"](selected, stored_data, session_id),
+        repeat,
+        memory,
+    )
+    record("display_plots", seconds, peak, payload_size(result[0]))
+
+    plot = store.session(session_id).plot
+    treenum_range = [item["MIN_TREENUM"], item["MAX_TREENUM"] // 2]
+    seconds, peak, result = measure(
+        lambda: callbacks["update_graph"](
+            {"dimensions": dims, "treenum_range": treenum_range},
+            "webgl",
+            "stratified",
+            200_000,
+            [],
+            selected,
+            stored_data,
+            [],
+            plot["id"],
+            session_id,
+        ),
+        repeat,
+        memory,
+    )
+    record("update_graph", seconds, peak, payload_size(result))
+
+    def build_figure():
+        fig = make_plot_grid()
+        add_trace_multiplot(
+            fig, plot["df"], *dims, plot["GROUPS"], plot["COLOR_DICT"], index=plot["index"]
+        )
+        return fig
+
+    seconds, peak, fig = measure(build_figure, repeat, memory)
+    record("add_trace_multiplot", seconds, peak, payload_size(fig))
+    return records
+
+
+def environment():
+    try:
+        version = importlib.metadata.version("treetracer")
+    except importlib.metadata.PackageNotFoundError:
+        version = None
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "treetracer": version,
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }
+
+
+def run(sizes, groups, data_dir, repeat=3, memory=True, dimensions=4, seed=0):
+    results = {"environment": environment(), "cases": []}
+    for rows in sizes:
+        for n_groups in groups:
+            if n_groups > rows:
+                continue
+            path = write_trace(data_dir, rows, n_groups, dimensions, seed)
+            print(f"{rows:>10,} rows {n_groups:>4} groups", flush=True)
+            for rec in bench_case(path, repeat, memory):
+                rec.update(rows=rows, groups=n_groups, dimensions=dimensions)
+                results["cases"].append(rec)
+                print(
+                    f"    {rec['stage']:<22}{rec['seconds']:>9.3f} s"
+                    + (f"{rec['peak_bytes'] / 1e6:>10.1f} MB" if rec["peak_bytes"] else ""),
+                    flush=True,
+                )
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.run",
+        description="Time TreeTracer ingestion, plotting and interaction on synthetic traces",
+    )
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="row counts, e.g. 10k,1M,10M")
+    parser.add_argument("--groups", default=DEFAULT_GROUPS, help="group counts, e.g. 1,10,200")
+    parser.add_argument("--dimensions", type=int, default=4, help="MDS columns per trace")
+    parser.add_argument("--repeat", type=int, default=3, help="timed calls per stage")
+    parser.add_argument(
+        "--no-memory", action="store_true", help="skip the traced peak-memory call"
+    )
+    parser.add_argument(
+        "--data-dir",
+        default=os.path.join(tempfile.gettempdir(), "treetracer-bench"),
+        help="where synthetic traces are written and reused",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", default="benchmark-results.json")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run(
+        [parse_count(s) for s in args.sizes.split(",")],
+        [parse_count(g) for g in args.groups.split(",")],
+        args.data_dir,
+        args.repeat,
+        not args.no_memory,
+        args.dimensions,
+        args.seed,
+    )
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=1)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
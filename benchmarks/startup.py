@@ -0,0 +1,134 @@
+import argparse
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+
+from .run import environment
+
+
+# Commands timed in a fresh interpreter; each must exit by itself
+COMMANDS = {
+    "import treetracer": [sys.executable, "-c", "import treetracer"],
+    "treetracer --help": [sys.executable, "-m", "treetracer", "--help"],
+    "import treetracer.app": [sys.executable, "-c", "import treetracer.app"],
+}
+
+# Seconds to wait for the server to accept connections
+SERVER_TIMEOUT = 120
+
+_IMPORTTIME = re.compile(r"import time:\s+\d+ \|\s+(\d+) \|\s*(\S+)")
+
+
+def time_command(command, repeat=5):
+    """
+    Best wall time of repeat runs of command in a new process.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def time_server_start(paths=(), repeat=3):
+    """
+    Best time from launching `treetracer` until its server accepts
+    connections, with paths preloaded.
+    """
+    times = []
+    for _ in range(repeat):
+        port = _free_port()
+        command = [sys.executable, "-m", "treetracer", "--no-browser", "--port", str(port)]
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            command + list(paths), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            while True:
+                if process.poll() is not None:
+                    raise RuntimeError(f"treetracer exited with status {process.returncode}")
+                if time.perf_counter() - start > SERVER_TIMEOUT:
+                    raise RuntimeError("treetracer did not start in time")
+                try:
+                    with socket.create_connection(("127.0.0.1", port), timeout=1):
+                        break
+                except OSError:
+                    time.sleep(0.01)
+            times.append(time.perf_counter() - start)
+        finally:
+            process.terminate()
+            process.wait()
+    return min(times)
+
+
+def slowest_imports(module, top=15):
+    """
+    Top-level packages with the largest cumulative import time when
+    importing module, from python -X importtime.
+    """
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stderr
+    totals = {}
+    for match in _IMPORTTIME.finditer(stderr):
+        # A package's own entry includes the time of its submodules
+        package = match.group(2).split(".")[0]
+        totals[package] = max(totals.get(package, 0), int(match.group(1)))
+    ranked = sorted(totals.items(), key=lambda item: -item[1])[:top]
+    return [{"module": name, "seconds": us / 1e6} for name, us in ranked]
+
+
+def run(paths=(), repeat=5):
+    results = {"environment": environment(), "cases": []}
+
+    def record(stage, seconds):
+        # rows and groups are 0 so that benchmarks.compare can match the cases
+        results["cases"].append({"stage": stage, "seconds": seconds, "rows": 0, "groups": 0})
+        print(f"    {stage:<26}{seconds:>9.3f} s", flush=True)
+
+    for stage, command in COMMANDS.items():
+        record(stage, time_command(command, repeat))
+    record("server start", time_server_start(paths, max(1, repeat // 2)))
+
+    results["imports"] = slowest_imports("treetracer.app")
+    print("Slowest imports of treetracer.app:")
+    for item in results["imports"]:
+        print(f"    {item['module']:<26}{item['seconds']:>9.3f} s")
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.startup",
+        description="Time TreeTracer imports and server cold start in fresh processes",
+    )
+    parser.add_argument("paths", nargs="*", help="traces preloaded by the server start case")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per command")
+    parser.add_argument("-o", "--output", default="startup-results.json")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run([os.path.abspath(p) for p in args.paths], args.repeat)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=1)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
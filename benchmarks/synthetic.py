@@ -0,0 +1,69 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+
+def make_trace(rows, groups=1, dimensions=4, topologies=None, seed=0):
+    """
+    Synthetic trace with the columns of an uploaded TSV: tree, group and
+    V1..Vn.
+
+    Every group is a chain of about rows / groups samples that random-walks
+    between topologies placed at fixed MDS coordinates, so traces are
+    autocorrelated like real posterior samples. Chains start apart and
+    converge onto the same region. The same arguments always give the
+    same trace.
+    """
+    rng = np.random.default_rng(seed)
+    topologies = topologies or max(1, rows // 10)
+    centers = rng.normal(size=(topologies, dimensions))
+
+    sizes = np.diff(np.linspace(0, rows, groups + 1).astype(np.int64))
+    group = np.repeat(np.arange(groups), sizes)
+    step = np.arange(rows) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+
+    # Random walk over topology ids, restarted for every chain
+    walk = np.cumsum(rng.integers(-3, 4, size=rows))
+    walk -= np.repeat(walk[np.cumsum(sizes) - sizes], sizes)
+    start = rng.integers(0, topologies, size=groups)
+    tree = (np.repeat(start, sizes) + walk) % topologies
+
+    # Offsets that shrink as every chain burns in
+    offset = rng.normal(scale=2, size=(groups, dimensions))
+    burn_in = np.exp(-5 * step / np.repeat(np.maximum(sizes, 1), sizes))
+    coords = centers[tree] + offset[group] * burn_in[:, None]
+    coords += rng.normal(scale=0.05, size=coords.shape)
+
+    labels = [f"run{g + 1}" for g in range(groups)]
+    df = pd.DataFrame(
+        {"tree": tree + 1, "group": pd.Categorical.from_codes(group, labels)}
+    )
+    for k in range(dimensions):
+        df[f"V{k + 1}"] = coords[:, k]
+    return df
+
+
+def trace_bytes(df):
+    """
+    TSV content of a synthetic trace, as uploaded.
+    """
+    return df.to_csv(sep="\t", index=False, float_format="%.6g").encode()
+
+
+def write_trace(directory, rows, groups=1, dimensions=4, seed=0):
+    """
+    Write a synthetic trace TSV once and return its path. Files are named
+    after their parameters, so later runs reuse them.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(
+        directory, f"trace-{rows}r-{groups}g-{dimensions}d-s{seed}.tsv"
+    )
+    if not os.path.exists(path):
+        data = trace_bytes(make_trace(rows, groups, dimensions, seed=seed))
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    return path
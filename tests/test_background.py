@@ -0,0 +1,130 @@
+import json
+import time
+
+import dash
+import pytest
+from dash import _callback_signing as signing
+
+from benchmarks.synthetic import write_trace
+from treetracer import callbacks
+from treetracer.app import create_dash_app
+from treetracer.cache import FigureCache, TraceCache
+from treetracer.jobs import job_manager
+from treetracer.store import SessionStore
+
+
+# Seconds a background job may take before the test gives up on it
+JOB_TIMEOUT = 60
+
+
+def background_app(tmp_path):
+    dash._callback.GLOBAL_CALLBACK_MAP.clear()
+    dash._callback.GLOBAL_CALLBACK_LIST.clear()
+    store = SessionStore()
+    cache = TraceCache(str(tmp_path / "cache"))
+    app = create_dash_app(None, job_manager(str(tmp_path / "jobs")))
+    callbacks.register_callbacks(app, store, cache, figures=FigureCache())
+    return app, store, cache
+
+
+def callback_output(name):
+    # Registered callbacks move to the app on its first request
+    return next(
+        key
+        for key, entry in dash._callback.GLOBAL_CALLBACK_MAP.items()
+        if entry["callback"].__name__ == name
+    )
+
+
+def run_job(app, output, inputs, state):
+    """
+    Run the callback of output as the browser does: start its background
+    job, then poll until the job's response is ready.
+    """
+    body = {
+        "output": output,
+        "outputs": [
+            dict(zip(["id", "property"], out.split(".", 1)))
+            for out in output.strip(".").split("...")
+        ],
+        "inputs": inputs,
+        "state": state,
+        "changedPropIds": [f"{inputs[0]['id']}.{inputs[0]['property']}"],
+    }
+    client = app.server.test_client()
+
+    def post(query):
+        return client.post("/_dash-update-component", json=body, query_string=query)
+
+    # The renderer gets this token with the page; job handles are bound to it
+    secret = app._get_signing_secret()
+    query = {"endId": signing.sign(secret, signing.END_SCOPE, "test")}
+    query.update(post(query).get_json())
+
+    deadline = time.monotonic() + JOB_TIMEOUT
+    while time.monotonic() < deadline:
+        response = post(query)
+        if response.status_code not in (200, 204):
+            pytest.fail(response.get_data(as_text=True))
+        if response.status_code == 200 and "response" in response.get_json():
+            return response.get_json()["response"]
+        time.sleep(0.1)
+    pytest.fail(f"{output} did not finish in {JOB_TIMEOUT} s")
+
+
+def graph_figure(component):
+    """
+    Figure of the component with id "graph" in a serialized layout.
+    """
+    if isinstance(component, list):
+        for child in component:
+            figure = graph_figure(child)
+            if figure is not None:
+                return figure
+    elif isinstance(component, dict):
+        props = component.get("props", component)
+        if props.get("id") == "graph":
+            return props["figure"]
+        return graph_figure(props.get("children"))
+    return None
+
+
+def test_display_plots_job_reuses_figure(tmp_path, monkeypatch):
+    app, store, cache = background_app(tmp_path)
+    output = callback_output("display_plots")
+    path = write_trace(tmp_path, 2_000, groups=2, seed=0)
+    for session_id in ["first", "second"]:
+        file_data = []
+        callbacks.load_trace_paths([path], store.session(session_id), file_data, cache)
+
+    def display(session_id):
+        return run_job(
+            app,
+            output,
+            [
+                {
+                    "id": "files-multiselect",
+                    "property": "value",
+                    "value": [file_data[0]["filename"]],
+                }
+            ],
+            [
+                {
+                    "id": "uploaded-files-storage",
+                    "property": "children",
+                    "value": json.dumps(file_data),
+                },
+                {"id": "session-id", "property": "data", "value": session_id},
+            ],
+        )
+
+    first = graph_figure(display("first")["plot-display"])
+    assert len(first["data"]) > 0
+
+    # Jobs are forked from this process, so the next one cannot draw: it
+    # has to find the figure the first job left in the shared disk cache
+    def draw(*args, **kwargs):
+        raise AssertionError("figure drawn again")
+
+    monkeypatch.setattr(callbacks, "add_trace_multiplot", draw)
+    assert graph_figure(display("second")["plot-display"]) == first
@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+
+from treetracer.index import GroupIndex
+from treetracer.loader import concat_traces
+
+
+def trace(rng, groups, rows, max_treenum):
+    return pd.DataFrame(
+        {
+            "group": pd.Categorical(rng.choice(groups, rows)),
+            "treenum": rng.integers(1, max_treenum, rows).astype(np.int32),
+            "MDS1": rng.random(rows).astype(np.float32),
+        }
+    )
+
+
+def test_extend_matches_rebuild():
+    rng = np.random.default_rng(0)
+    df = trace(rng, ["a", "b", "c"], 1_000, 500)
+    # Tailed rows mostly follow their group, some fall inside it, and "d" is new
+    new = trace(rng, ["a", "b", "c", "d"], 200, 700)
+
+    extended = GroupIndex(df).extend(new)
+    rebuilt = GroupIndex(concat_traces([df, new]))
+    assert list(extended.groups) == list(rebuilt.groups)
+    np.testing.assert_array_equal(extended.offsets, rebuilt.offsets)
+    np.testing.assert_array_equal(extended.treenum, rebuilt.treenum)
+    # Rows of equal treenum may be in another order, so compare them as sets
+    for gr in rebuilt.groups:
+        assert sorted(extended.group_frame(gr, (100, 600))["MDS1"]) == sorted(
+            rebuilt.group_frame(gr, (100, 600))["MDS1"]
+        )
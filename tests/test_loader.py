@@ -0,0 +1,55 @@
+import base64
+import os
+import tracemalloc
+
+import numpy as np
+
+from benchmarks.synthetic import make_trace, write_trace
+from treetracer.loader import decode_upload, load_buffer, load_path
+
+
+# Peak memory of parsing a trace, as a multiple of its size on disk
+MAX_PEAK_RATIO = 2.5
+
+# An upload also holds its decoded bytes, one file size, while they are parsed
+MAX_UPLOAD_PEAK_RATIO = MAX_PEAK_RATIO + 1
+
+
+def traced_peak(func):
+    tracemalloc.start()
+    try:
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak
+
+
+def test_load_path_peak_memory(tmp_path):
+    path = write_trace(tmp_path, 200_000, groups=4, seed=0)
+    (df, _, _), peak = traced_peak(lambda: load_path(path))
+    assert len(df) == 200_000
+    assert peak < MAX_PEAK_RATIO * os.path.getsize(path)
+
+
+def test_upload_peak_memory(tmp_path):
+    path = write_trace(tmp_path, 200_000, groups=4, seed=0)
+    with open(path, "rb") as f:
+        content = "data:text/tab-separated-values;base64," + base64.b64encode(
+            f.read()
+        ).decode()
+    (df, _), peak = traced_peak(lambda: load_buffer(decode_upload(content)))
+    assert len(df) == 200_000
+    assert peak < MAX_UPLOAD_PEAK_RATIO * os.path.getsize(path)
+
+
+def test_load_path_matches_trace(tmp_path):
+    path = write_trace(tmp_path, 1_000, groups=3, dimensions=2, seed=1)
+    expected = make_trace(1_000, groups=3, dimensions=2, seed=1)
+    df, _, offset = load_path(path)
+    assert offset == os.path.getsize(path)
+    assert df["group"].astype(str).tolist() == expected["group"].astype(str).tolist()
+    assert df["MDS1"].dtype == np.float32
+    np.testing.assert_allclose(df["MDS2"], expected["V2"], rtol=1e-5)
+    # treenum counts the trees of every group from 1
+    assert (df.groupby("group", observed=True)["treenum"].min() == 1).all()
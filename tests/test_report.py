@@ -0,0 +1,25 @@
+import os
+
+from treetracer.report import report_names
+
+
+def test_report_names_unique(tmp_path):
+    paths = [
+        os.path.join(tmp_path, "a", "run.tsv"),
+        os.path.join(tmp_path, "a", "run.trees"),
+        os.path.join(tmp_path, "b", "x.tsv.gz"),
+        os.path.join(tmp_path, "b", "x.tsv.bz2"),
+        os.path.join(tmp_path, "b", "run.tsv"),
+        os.path.join(tmp_path, "a_run.tsv"),
+        os.path.join(tmp_path, "b", "only.tsv"),
+    ]
+    names = report_names(paths)
+    assert len(set(names)) == len(paths)
+    assert names[:5] == [
+        "a_run.tsv.html",
+        "a_run.trees.html",
+        "b_x.tsv.gz.html",
+        "b_x.tsv.bz2.html",
+        "b_run.html",
+    ]
+    assert names[-1] == "b_only.html"
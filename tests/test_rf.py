@@ -0,0 +1,111 @@
+import random
+
+import numpy as np
+
+from treetracer import rf
+from treetracer.rf import rf_distance_matrix, rf_to_landmarks
+from treetracer.trees import iter_trees, newick_splits, taxon_order
+
+
+TAXA = [f"t{i}" for i in range(12)]
+
+
+def random_tree(rng):
+    """
+    Random binary tree as nested tuples, its children in random order.
+    """
+    clades = list(TAXA)
+    while len(clades) > 1:
+        a, b = rng.sample(range(len(clades)), 2)
+        joined = (clades[a], clades[b])
+        clades = [c for i, c in enumerate(clades) if i not in (a, b)] + [joined]
+    return clades[0]
+
+
+def to_newick(tree, labels=None):
+    if isinstance(tree, str):
+        return labels[tree] if labels else tree
+    return "(" + ",".join(to_newick(c, labels) for c in tree) + ")"
+
+
+def relabel(tree, names):
+    if isinstance(tree, str):
+        return names.get(tree, tree)
+    return tuple(relabel(c, names) for c in tree)
+
+
+def leaves(node):
+    if isinstance(node, str):
+        return frozenset([node])
+    return frozenset().union(*(leaves(c) for c in node))
+
+
+def reference_splits(tree):
+    """
+    Non-trivial splits as sets of taxon names, from the side without the
+    first taxon, found without newick_splits.
+    """
+    everything = frozenset(TAXA)
+    splits = set()
+    stack = list(tree)
+    while stack:
+        node = stack.pop()
+        if isinstance(node, str):
+            continue
+        stack.extend(node)
+        clade = leaves(node)
+        if min(TAXA) in clade:
+            clade = everything - clade
+        if 1 < len(clade) < len(TAXA) - 1:
+            splits.add(clade)
+    return splits
+
+
+def nexus(trees):
+    # Numbered translate table in a shuffled order, tab separated
+    order = list(TAXA)
+    random.Random(1).shuffle(order)
+    numbers = {taxon: str(i + 1) for i, taxon in enumerate(order)}
+    lines = ["#NEXUS", "begin trees;", "\ttranslate"]
+    lines += [f"\t\t{numbers[t]}\t{t}," for t in order[:-1]]
+    lines += [f"\t\t{numbers[order[-1]]}\t{order[-1]}", "\t\t;"]
+    lines += [f"tree STATE_{i} = {to_newick(t, numbers)};" for i, t in enumerate(trees)]
+    lines.append("end;")
+    return [line + "\n" for line in lines]
+
+
+def test_rf_matches_split_sets(monkeypatch):
+    rng = random.Random(0)
+    trees = [random_tree(rng) for _ in range(30)]
+    # Close trees too: a repeat, and two taxa swapped
+    swap = {"t1": "t2", "t2": "t1"}
+    trees += [trees[3], relabel(trees[0], swap), relabel(trees[1], swap)]
+    expected = [reference_splits(t) for t in trees]
+    reference = np.array([[len(a ^ b) for b in expected] for a in expected])
+
+    newicks = [newick for _, newick in iter_trees(nexus(trees))]
+    taxa = taxon_order(newicks[0])
+    split_sets = [newick_splits(n, taxa) for n in newicks]
+
+    np.testing.assert_array_equal(rf_distance_matrix(split_sets, len(taxa), workers=1), reference)
+    # Blocks of rows computed in worker processes give the same matrix
+    monkeypatch.setattr(rf, "MIN_PARALLEL_TREES", 0)
+    np.testing.assert_array_equal(rf_distance_matrix(split_sets, len(taxa), workers=2), reference)
+    np.testing.assert_array_equal(
+        rf_to_landmarks(split_sets, split_sets[:5]), reference[:, :5]
+    )
+
+
+def test_splits_ignore_taxon_order():
+    rng = random.Random(2)
+    tree = random_tree(rng)
+    newick = to_newick(tree) + ";"
+
+    # The same tree written with the children of every node reversed
+    def reverse(node):
+        return node if isinstance(node, str) else tuple(reverse(c) for c in node[::-1])
+
+    reversed_newick = to_newick(reverse(tree)) + ";"
+    taxa = taxon_order(newick)
+    assert taxon_order(reversed_newick) == taxa
+    assert newick_splits(newick, taxa) == newick_splits(reversed_newick, taxa)
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+
+from treetracer.cache import FigureCache
+from treetracer.index import GroupIndex
+from treetracer.store import SessionStore
+
+
+def index(rows):
+    return GroupIndex(
+        pd.DataFrame(
+            {
+                "group": pd.Categorical(np.repeat(["a", "b"], rows // 2)),
+                "treenum": np.tile(np.arange(1, rows // 2 + 1), 2).astype(np.int32),
+                "MDS1": np.zeros(rows, dtype=np.float32),
+            }
+        )
+    )
+
+
+def test_evict_counts_shared_index_once():
+    shared, own = index(10_000), index(10_000)
+    store = SessionStore(max_bytes=shared.memory_usage() + own.memory_usage())
+    for session_id, idx in [("a", shared), ("b", shared), ("c", own)]:
+        store.session(session_id).plot = {"index": idx, "pending": []}
+
+    # Both plots fit, as the index of "a" and "b" is only counted once
+    store.evict(active="c")
+    assert all("index" in store.session(s).plot for s in "abc")
+
+    # An index held by the figure cache is charged there instead
+    store.figures = FigureCache()
+    store.figures.put("own", own, own.memory_usage())
+    store.max_bytes = shared.memory_usage()
+    store.evict(active="c")
+    assert all("index" in store.session(s).plot for s in "abc")
+
+
+def test_evict_leaves_plot_in_use_intact():
+    store = SessionStore(max_bytes=0)
+    old, new = store.session("old"), store.session("new")
+    old.plot = {"id": "p", "index": index(1_000), "pending": []}
+    # A callback of "old" still holding its plot state
+    plot = old.plot
+
+    store.evict(active="new")
+    assert old.plot == {}
+    assert plot["id"] == "p" and len(plot["index"]) == 1_000
@@ -0,0 +1,17 @@
+from treetracer.trees import iter_trees
+
+
+def test_translate_separated_by_tabs():
+    text = (
+        "#NEXUS\n"
+        "begin trees;\n"
+        "\ttranslate\n"
+        "\t\t1\tHomo_sapiens,\n"
+        "\t\t2\t'Pan troglodytes',\n"
+        "\t\t3 Gorilla\n"
+        "\t\t;\n"
+        "tree STATE_0 = ((1,2),3);\n"
+        "end;\n"
+    )
+    trees = list(iter_trees(text.splitlines(keepends=True)))
+    assert trees == [("STATE_0", "((Homo_sapiens,'Pan troglodytes'),Gorilla);")]
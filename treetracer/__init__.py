@@ -1,4 +1,4 @@
-from .app import main
+from .cli import main
 
 # This allows the package to be run as a module
 if __name__ == "__main__":
@@ -0,0 +1,5 @@
+from .cli import main
+
+# Guarded so that worker processes started by `treetracer report` can import it
+if __name__ == "__main__":
+    main()
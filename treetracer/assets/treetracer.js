@@ -0,0 +1,322 @@
+// Client-side treenum filtering and playback of the trace plots.
+//
+// With "Filter in browser" on, the server sends the rows of every group
+// once (client_trace_data in plot_utils.py), sorted by treenum. Moving the
+// treenum slider or switching dimensions then only slices those arrays and
+// redraws the figure here, without a round trip to the server. Play slides
+// a treenum window through the chain, drawing frames straight into the
+// plotly graph; the slider is only moved when playback stops.
+
+(function () {
+    "use strict";
+
+    // Typed array specs as produced by typed_array in plot_utils.py
+    const DTYPES = {
+        f8: Float64Array,
+        f4: Float32Array,
+        i4: Int32Array,
+        u4: Uint32Array,
+        i2: Int16Array,
+        u2: Uint16Array,
+        i1: Int8Array,
+        u1: Uint8Array,
+    };
+
+    // Same order as panel_columns and PANEL_AXES in plot_utils.py
+    const PANEL_AXES = [
+        ["xaxis", "yaxis"],
+        ["xaxis2", "yaxis2"],
+        ["xaxis3", "yaxis3"],
+    ];
+
+    // Decoded arrays of every client-trace-data value received
+    const decoded = new WeakMap();
+
+    // State of the playback loop
+    const player = {
+        running: false,
+        frame: null,
+        groups: null,
+        figure: null,
+        dims: null,
+        renderMode: "webgl",
+        range: null,
+    };
+
+    function decodeArray(spec) {
+        if (Array.isArray(spec)) {
+            return spec;
+        }
+        const bytes = atob(spec.bdata);
+        const buffer = new Uint8Array(bytes.length);
+        for (let i = 0; i < bytes.length; i++) {
+            buffer[i] = bytes.charCodeAt(i);
+        }
+        return new DTYPES[spec.dtype](buffer.buffer);
+    }
+
+    // Point arrays of a trace update, as arrays a trace can be extended
+    // with: plotly only extends arrays of the same type, and keeps typed
+    // array specs of a figure undecoded in the graph's data
+    function extendable(gd, part) {
+        const update = {};
+        Object.keys(part.update).forEach(function (key) {
+            update[key] = part.update[key].map(function (spec, i) {
+                const trace = gd.data[part.indices[i]];
+                let target = trace[key];
+                if (target && !Array.isArray(target) && !ArrayBuffer.isView(target)) {
+                    target = trace[key] = target._inputArray || decodeArray(target);
+                }
+                const values = decodeArray(spec);
+                if (Array.isArray(target)) {
+                    return Array.from(values);
+                }
+                return values.constructor === target.constructor
+                    ? values
+                    : new target.constructor(values);
+            });
+        });
+        return update;
+    }
+
+    function decodeGroups(data) {
+        let groups = decoded.get(data);
+        if (!groups) {
+            groups = data.groups.map(function (g) {
+                const columns = {};
+                Object.keys(g.columns).forEach(function (c) {
+                    columns[c] = decodeArray(g.columns[c]);
+                });
+                return {
+                    group: g.group,
+                    name: g.name,
+                    color: g.color,
+                    treenum: decodeArray(g.treenum),
+                    tree: decodeArray(g.tree),
+                    columns: columns,
+                };
+            });
+            decoded.set(data, groups);
+        }
+        return groups;
+    }
+
+    // First position whose value is >= target, or > target if right is set
+    function bisect(values, target, right) {
+        let lo = 0;
+        let hi = values.length;
+        while (lo < hi) {
+            const mid = (lo + hi) >>> 1;
+            if (values[mid] < target || (right && values[mid] === target)) {
+                lo = mid + 1;
+            } else {
+                hi = mid;
+            }
+        }
+        return lo;
+    }
+
+    function slice(values, start, end) {
+        // Typed arrays are sliced without copying
+        return values.subarray ? values.subarray(start, end) : values.slice(start, end);
+    }
+
+    function withTitle(axis, text) {
+        return Object.assign({}, axis, {title: Object.assign({}, (axis || {}).title, {text: text})});
+    }
+
+    // Figure of the rows of every group within range, in the trace layout of
+    // add_trace_multiplot: four traces per group, 3D then x/y, x/z and y/z
+    function buildFigure(figure, groups, dims, range, renderMode) {
+        const x = dims[0];
+        const y = dims[1];
+        const z = dims[2];
+        const panels = [[x, y, z], [x, y], [x, z], [y, z]];
+        const type2d = renderMode === "svg" ? "scatter" : "scattergl";
+        const data = figure.data.slice();
+
+        groups.forEach(function (g, i) {
+            const start = bisect(g.treenum, range[0], false);
+            const end = bisect(g.treenum, range[1], true);
+            const tree = slice(g.tree, start, end);
+            panels.forEach(function (cols, k) {
+                const old = data[i * 4 + k];
+                if (!old) {
+                    return;
+                }
+                const trace = {
+                    type: k === 0 ? "scatter3d" : type2d,
+                    mode: "markers",
+                    name: g.name,
+                    showlegend: k === 0,
+                    legendgroup: g.group,
+                    marker: k === 0 ? {color: g.color, size: 4} : {color: g.color},
+                    customdata: tree,
+                    hovertemplate: g.group + "<br>Tree: %{customdata}<extra></extra>",
+                };
+                ["scene", "xaxis", "yaxis"].forEach(function (key) {
+                    if (old[key] !== undefined) {
+                        trace[key] = old[key];
+                    }
+                });
+                ["x", "y", "z"].forEach(function (axis, a) {
+                    if (cols[a] !== undefined) {
+                        trace[axis] = slice(g.columns[cols[a]], start, end);
+                    }
+                });
+                data[i * 4 + k] = trace;
+            });
+        });
+
+        const layout = Object.assign({}, figure.layout);
+        const scene = Object.assign({}, layout.scene);
+        ["xaxis", "yaxis", "zaxis"].forEach(function (axis, a) {
+            scene[axis] = withTitle(scene[axis], dims[a]);
+        });
+        layout.scene = scene;
+        PANEL_AXES.forEach(function (axes, p) {
+            layout[axes[0]] = withTitle(layout[axes[0]], panels[p + 1][0]);
+            layout[axes[1]] = withTitle(layout[axes[1]], panels[p + 1][1]);
+        });
+        return {data: data, layout: layout};
+    }
+
+    function graphDiv() {
+        const graph = document.getElementById("graph");
+        return graph && graph.querySelector(".js-plotly-plot");
+    }
+
+    function showWindow(range) {
+        const label = document.getElementById("play-window");
+        if (label) {
+            label.textContent = range ? "Trees " + range[0] + "-" + range[1] : "";
+        }
+    }
+
+    function stopPlayback(commit) {
+        if (player.frame !== null) {
+            cancelAnimationFrame(player.frame);
+        }
+        const wasRunning = player.running;
+        player.running = false;
+        player.frame = null;
+        showWindow(null);
+        if (wasRunning && commit && player.range) {
+            // Hand the last window to Dash so the slider, figure and
+            // diagnostics match what is on screen
+            window.dash_clientside.set_props("treenum-slider", {value: player.range});
+        }
+    }
+
+    function startPlayback(bounds, range, seconds) {
+        const span = bounds[1] - bounds[0];
+        let width = range[1] - range[0];
+        if (width >= span) {
+            // Sliding the whole chain would show nothing moving
+            width = Math.max(1, Math.round(span / 10));
+        }
+        const last = bounds[1] - width;
+        const first = range[0] < last ? range[0] : bounds[0];
+        // Keep the speed of a full pass whatever the starting point
+        const duration = (Math.max(1, seconds) * (last - first)) / Math.max(1, last - bounds[0]);
+        const start = performance.now();
+
+        player.running = true;
+        function step(now) {
+            if (!player.running) {
+                return;
+            }
+            const t = duration > 0 ? Math.min(1, (now - start) / 1000 / duration) : 1;
+            const lo = Math.round(first + (last - first) * t);
+            player.range = [lo, lo + width];
+            const gd = graphDiv();
+            if (gd && window.Plotly) {
+                const fig = buildFigure(
+                    player.figure, player.groups, player.dims, player.range, player.renderMode
+                );
+                window.Plotly.react(gd, fig.data, fig.layout);
+            }
+            showWindow(player.range);
+            if (t >= 1) {
+                stopPlayback(true);
+                window.dash_clientside.set_props("play-button", {children: "Play"});
+            } else {
+                player.frame = requestAnimationFrame(step);
+            }
+        }
+        player.frame = requestAnimationFrame(step);
+    }
+
+    function clientOn(clientFilter) {
+        return Boolean(clientFilter && clientFilter.length);
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        treetracer: {
+            // View the server draws; unchanged while the browser filters
+            route_view: function (dims, range, clientFilter) {
+                if (clientOn(clientFilter)) {
+                    return window.dash_clientside.no_update;
+                }
+                return {dimensions: dims, treenum_range: range};
+            },
+
+            render: function (data, dims, dragValue, value, renderMode, clientFilter, figure) {
+                const no_update = window.dash_clientside.no_update;
+                if (!clientOn(clientFilter) || !data) {
+                    stopPlayback(false);
+                    return no_update;
+                }
+                if (!figure || !dims || dims.length !== 3) {
+                    return no_update;
+                }
+                const triggered = window.dash_clientside.callback_context.triggered || [];
+                const dragged = triggered.some(function (t) {
+                    return t.prop_id === "treenum-slider.drag_value";
+                });
+                const range = dragged && dragValue ? dragValue : value;
+
+                player.groups = decodeGroups(data);
+                player.figure = figure;
+                player.dims = dims;
+                player.renderMode = renderMode;
+                if (player.running) {
+                    // The playback loop draws the next frame
+                    return no_update;
+                }
+                return buildFigure(figure, player.groups, dims, range, renderMode);
+            },
+
+            // Rows read by the file watcher (extend_traces in callbacks.py).
+            // The 2D traces are extended here, the 3D ones by the graph.
+            extend: function (points) {
+                const gd = graphDiv();
+                if (!points || !gd || !gd.data || !window.Plotly) {
+                    return window.dash_clientside.no_update;
+                }
+                if (points["2d"].indices.length) {
+                    window.Plotly.extendTraces(
+                        gd, extendable(gd, points["2d"]), points["2d"].indices
+                    );
+                }
+                return [extendable(gd, points["3d"]), points["3d"].indices];
+            },
+
+            toggle_play: function (nClicks, data, dims, value, min, max, seconds, renderMode, figure) {
+                if (player.running) {
+                    stopPlayback(true);
+                    return "Play";
+                }
+                if (!data || !figure || !dims || dims.length !== 3) {
+                    return window.dash_clientside.no_update;
+                }
+                player.groups = decodeGroups(data);
+                player.figure = figure;
+                player.dims = dims;
+                player.renderMode = renderMode;
+                startPlayback([min, max], value, seconds || 20);
+                return "Pause";
+            },
+        },
+    });
+})();
@@ -0,0 +1,224 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+# Default location and size cap of the parsed trace cache
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "treetracer"
+)
+DEFAULT_CACHE_SIZE = 4 * 1024**3
+
+# Memory kept by the in-memory cache of combined frames and figures
+DEFAULT_FIGURE_CACHE_SIZE = 512 * 1024**2
+
+META_FILE = "meta.json"
+
+
+def content_key(data):
+    """
+    Hash of the raw file content used as the cache key.
+    """
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class TraceCache:
+    """
+    On-disk cache of normalized trace DataFrames keyed by content hash.
+
+    Every entry is a directory holding one .npy file per column, so that
+    columns can be memory-mapped back without parsing. Text columns are
+    stored as categorical codes with their categories in meta.json.
+    The least recently used entries are evicted once max_bytes is exceeded.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_SIZE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _entry(self, key):
+        return os.path.join(self.directory, key)
+
+    def __contains__(self, key):
+        return os.path.exists(os.path.join(self._entry(key), META_FILE))
+
+    def get(self, key):
+        """
+        Return the cached DataFrame for key (memory-mapped) or None.
+        """
+        entry = self._entry(key)
+        meta_path = os.path.join(entry, META_FILE)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        columns = {}
+        for i, col in enumerate(meta["columns"]):
+            values = np.load(os.path.join(entry, f"{i}.npy"), mmap_mode="r")
+            if col["categories"] is not None:
+                values = pd.Categorical.from_codes(values, col["categories"])
+            columns[col["name"]] = values
+
+        # Mark entry as recently used
+        os.utime(meta_path)
+        return pd.DataFrame(columns, copy=False)
+
+    def put(self, key, df):
+        """
+        Store df under key and evict old entries if over the size cap.
+        """
+        if key in self:
+            return
+
+        tmp = tempfile.mkdtemp(dir=self.directory, prefix=".tmp-")
+        try:
+            columns = []
+            for i, name in enumerate(df.columns):
+                series = df[name]
+                categories = None
+                if isinstance(series.dtype, pd.CategoricalDtype):
+                    values = series.cat.codes.to_numpy()
+                    categories = series.cat.categories.tolist()
+                elif pd.api.types.is_numeric_dtype(series.dtype):
+                    values = series.to_numpy()
+                else:
+                    codes, uniques = pd.factorize(series)
+                    values = codes.astype(np.int32)
+                    categories = uniques.tolist()
+                np.save(os.path.join(tmp, f"{i}.npy"), values)
+                columns.append({"name": name, "categories": categories})
+
+            with open(os.path.join(tmp, META_FILE), "w") as f:
+                json.dump({"columns": columns, "rows": len(df)}, f)
+            os.replace(tmp, self._entry(key))
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+            # Another writer may have stored the same content meanwhile
+            if key in self:
+                return
+            raise
+
+        self.evict()
+
+    def remove(self, key):
+        shutil.rmtree(self._entry(key), ignore_errors=True)
+
+    def entries(self):
+        """
+        List (last_used, size_in_bytes, key) for every cache entry.
+        """
+        result = []
+        for key in os.listdir(self.directory):
+            entry = self._entry(key)
+            meta_path = os.path.join(entry, META_FILE)
+            if key.startswith(".") or not os.path.exists(meta_path):
+                continue
+            size = sum(e.stat().st_size for e in os.scandir(entry))
+            result.append((os.stat(meta_path).st_mtime, size, key))
+        return result
+
+    def evict(self):
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(self._entry(key), ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        for _, _, key in self.entries():
+            shutil.rmtree(self._entry(key), ignore_errors=True)
+
+
+class FigureCache:
+    """
+    In-memory cache of combined plot frames and built figures.
+
+    Keys are built from the content hashes of the files an entry was made
+    from, so switching back to a file selection or view that was drawn
+    before, in any session, reuses the result. Entries are evicted in
+    least-recently-used order once their total size exceeds max_bytes, and
+    dropped when one of their files is cleared. Hits and misses are counted.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_FIGURE_CACHE_SIZE):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # key -> (value, size in bytes, content hashes of its files)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Value stored under key, or None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size, hashes=()):
+        """
+        Store value, which takes size bytes and was built from the files
+        with the given content hashes. Values larger than the whole cache
+        are not stored.
+        """
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (value, size, frozenset(hashes))
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def value_ids(self):
+        """
+        Ids of the values stored, to tell which objects the cache holds.
+        """
+        with self._lock:
+            return {id(value) for value, _, _ in self._entries.values()}
+
+    def invalidate(self, hashes):
+        """
+        Drop every entry built from any of the files with these hashes.
+        """
+        hashes = set(hashes)
+        with self._lock:
+            for key, (_, _, used) in list(self._entries.items()):
+                if used & hashes:
+                    self._remove(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
@@ -1,14 +1,285 @@
-from dash import dcc, html, callback, Input, Output, State, no_update
+from dash import dcc, html, Input, Output, State, Patch, ClientsideFunction, no_update
+import dash
 from .plot_utils import *
+from .loader import (
+    TRACE_EXTENSIONS,
+    concat_traces,
+    decode_upload,
+    is_compressed_file,
+    is_trace_file,
+    list_trace_files,
+    load_buffer,
+    load_path,
+    set_file,
+    trace_metadata,
+)
+from .tail import TraceTail, flush_tails
+from .diagnostics import PSRF_THRESHOLD, TraceDiagnostics
+from .ui import add_diagnostics_panel, add_selection_panel
+from .spatial import selection_frame
+from .store import SessionStore, frame_bytes
+from .cache import FigureCache, content_key
+from .trees import TREE_EXTENSIONS, embedded_filename, is_tree_file, load_tree_buffers
 import dash_mantine_components as dmc
-import plotly.express as px
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import contextlib
+import functools
 import json
-import base64
-import io
-import pandas as pd
+import mmap
+import os
+import uuid
 
+# How often watched files are checked for new rows
+TAIL_INTERVAL_MS = 2000
+
+# Seconds one playback pass through the chain takes by default
+PLAY_SECONDS = 20
+
+
+def format_bytes(n):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if n < 1024:
+            return f"{n:.0f} {unit}"
+        n /= 1024
+    return f"{n:.1f} TB"
+
+
+def load_trace_paths(paths, dataframes, file_data, cache=None, tails=None):
+    """
+    Load TSV files from local paths into dataframes and append their
+    metadata to file_data. Files already present are skipped. If tails is
+    given, a TraceTail is registered for every loaded file.
+    Returns the names of the newly loaded files.
+    """
+    existing_filenames = [item["filename"] for item in file_data]
+    loaded = []
+    tree_paths = []
+    for path in paths:
+        filename = os.path.basename(path)
+        if is_tree_file(filename):
+            tree_paths.append(path)
+            continue
+        if not is_trace_file(filename):
+            raise ValueError(
+                f"Only TSV (.tsv, .tsv.gz, .tsv.bz2, .tsv.zst) or tree files "
+                f"are allowed. '{filename}' was rejected."
+            )
+        if filename in existing_filenames:
+            continue
+
+        df, key, offset = load_path(path, cache)
+        set_file(df, filename)
+        dataframes[filename] = df
+        # Compressed files cannot be followed while they are written
+        if tails is not None and not is_compressed_file(filename):
+            tails[filename] = TraceTail(path, df, offset)
+        file_data.append(
+            trace_metadata(df, filename, os.path.getmtime(path), key)
+        )
+        existing_filenames.append(filename)
+        loaded.append(filename)
+
+    # Tree files are embedded together so that their coordinates are comparable
+    if tree_paths:
+        tree_names = [os.path.basename(p) for p in tree_paths]
+        filename = embedded_filename(tree_names)
+        if filename not in existing_filenames:
+            with contextlib.ExitStack() as stack:
+                buffers = []
+                for path in tree_paths:
+                    f = stack.enter_context(open(path, "rb"))
+                    buffers.append(
+                        stack.enter_context(
+                            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                        )
+                    )
+                df, key = load_tree_buffers(buffers, tree_names, cache)
+                del buffers
+            set_file(df, filename)
+            dataframes[filename] = df
+            file_data.append(
+                trace_metadata(
+                    df, filename, max(map(os.path.getmtime, tree_paths)), key
+                )
+            )
+            loaded.append(filename)
+    return loaded
+
+
+def load_uploads(
+    contents, filenames, dates, dataframes, file_data, cache=None, progress=None
+):
+    """
+    Parse uploaded files into dataframes and append their metadata to
+    file_data. TSV files are parsed in parallel; tree files are embedded
+    together. progress, if given, is called with (done, total) as files
+    finish. Returns an error message, empty if every file was loaded.
+    """
+    existing_filenames = [item["filename"] for item in file_data]
+    error_message = ""
+    trace_files = []
+    tree_files = []
+
+    for content, filename, date in zip(contents, filenames, dates):
+        # Tree files are embedded together after the TSV files
+        if is_tree_file(filename):
+            tree_files.append((content, filename, date))
+        elif not is_trace_file(filename):
+            error_message = (
+                f"Only TSV (.tsv, .tsv.gz, .tsv.bz2, .tsv.zst) or tree files "
+                f"are allowed. '{filename}' was rejected."
+            )
+        elif filename not in existing_filenames:
+            existing_filenames.append(filename)
+            trace_files.append((content, filename, date))
+
+    total = len(trace_files) + bool(tree_files)
+    done = 0
+
+    def parse(content):
+        # Decode the file content and parse or fetch it from cache
+        return load_buffer(decode_upload(content), cache)
+
+    loaded = {}
+    workers = max(1, min(len(trace_files), os.cpu_count() or 1))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(parse, content): filename for content, filename, _ in trace_files
+        }
+        for future in as_completed(futures):
+            filename = futures[future]
+            try:
+                loaded[filename] = future.result()
+            except Exception as e:
+                error_message = f"Error processing {filename}: {str(e)}"
+            done += 1
+            if progress is not None:
+                progress(done, total)
+
+    # Keep the upload order in the file list
+    for _, filename, date in trace_files:
+        if filename in loaded:
+            df, key = loaded[filename]
+            set_file(df, filename)
+            dataframes[filename] = df
+            file_data.append(trace_metadata(df, filename, date, key))
+
+    # Embed uploaded tree files into a single MDS trace
+    if tree_files:
+        tree_names = [filename for _, filename, _ in tree_files]
+        filename = embedded_filename(tree_names)
+        if filename not in existing_filenames:
+            try:
+                buffers = [decode_upload(content) for content, _, _ in tree_files]
+                df, key = load_tree_buffers(buffers, tree_names, cache)
+                set_file(df, filename)
+                dataframes[filename] = df
+                date = max(date for _, _, date in tree_files)
+                file_data.append(trace_metadata(df, filename, date, key))
+            except Exception as e:
+                error_message = f"Error processing {filename}: {str(e)}"
+        if progress is not None:
+            progress(total, total)
+
+    return error_message
+
+
+def session_frame(dataframes, item, cache=None):
+    """
+    Frame of a listed file. Files loaded by a background job or evicted from
+    memory are mapped back from the trace cache; None if they are gone.
+    """
+    df = dataframes.get(item["filename"])
+    if df is None and cache is not None:
+        df = cache.get(item["hash"])
+        if df is not None:
+            set_file(df, item["filename"])
+            dataframes[item["filename"]] = df
+    return df
+
+
+def server_path(path, roots=None):
+    """
+    Resolve a path typed by a user, following symlinks. Raises ValueError
+    unless it lies inside one of roots; None allows any path.
+    """
+    resolved = os.path.realpath(os.path.expanduser(path))
+    if roots is None:
+        return resolved
+    for root in roots:
+        root = os.path.realpath(os.path.expanduser(root))
+        if os.path.commonpath([resolved, root]) == root:
+            return resolved
+    raise ValueError(f"'{path}' is outside the directories this server may open.")
+
+
+def prefix_groups(df):
+    """
+    Prefix group names with their file name when several files are combined.
+    """
+    return df.assign(group=df["file"].astype(str) + "/" + df["group"].astype(str))
+
+
+def register_callbacks(
+    app, store=None, cache=None, metrics=None, figures=None, path_roots=None
+):
+    # Frames and plot state are kept per browser session
+    if store is None:
+        store = SessionStore()
+
+    # Combined frames and figures of recently drawn views, for all sessions
+    if figures is None:
+        figures = FigureCache()
+    store.figures = figures
+
+    # Time every callback registered below and serve the results on /metrics
+    callback = dash.callback
+    if metrics is not None:
+        metrics.figure_cache = figures
+        metrics.install(app)
+        callback = metrics.instrument(callback)
+
+    # Heavy callbacks run as background jobs when the app has a job manager.
+    # Jobs run in another process, so loaded frames and the sorted rows of
+    # a plot reach this one through the trace cache, from which the plot
+    # state is rebuilt here when first needed.
+    background = app._background_manager is not None and cache is not None
+
+    # Every job runs in a new process, whose FigureCache is lost when it
+    # ends, so figures drawn by jobs are kept in the disk cache of the job
+    # manager instead, which the server and all jobs share
+    job_figures = app._background_manager.handle if background else None
+
+    def job_callback(progress_id, *args, **kwargs):
+        """
+        Register a callback that reports progress to the progress bar
+        progress_id and can be cancelled with the button next to it.
+        """
+
+        def decorator(func):
+            if background:
+                return callback(
+                    *args,
+                    background=True,
+                    progress=[
+                        Output(progress_id, "value"),
+                        Output(f"{progress_id}-label", "children"),
+                    ],
+                    running=[
+                        (Output(f"{progress_id}-box", "style"), {}, {"display": "none"}),
+                    ],
+                    cancel=[Input(f"{progress_id}-cancel", "n_clicks")],
+                    **kwargs,
+                )(func)
+
+            @functools.wraps(func)
+            def run(*inputs):
+                return func(lambda value: None, *inputs)
+
+            return callback(*args, **kwargs)(run)
+
+        return decorator
 
-def register_callbacks(app, dataframes):
     # Sidebar collapse callback
     @callback(
         Output("appshell", "navbar"),
@@ -20,7 +291,8 @@ def register_callbacks(app, dataframes):
         return navbar
 
     # Callback to handle file uploads
-    @callback(
+    @job_callback(
+        "upload-progress",
         [
             Output("uploaded-files-storage", "children"),
             Output("validation-alert", "title"),
@@ -30,11 +302,15 @@ def register_callbacks(app, dataframes):
         State("upload-data-button", "filename"),
         State("upload-data-button", "last_modified"),
         State("uploaded-files-storage", "children"),
+        State("session-id", "data"),
         prevent_initial_call=True,
     )
-    def update_uploaded_files(contents, filenames, dates, stored_data):
+    def update_uploaded_files(
+        set_progress, contents, filenames, dates, stored_data, session_id
+    ):
         if contents is None:
             return no_update, no_update, no_update
+        dataframes = store.session(session_id)
 
         # Initialize or get existing data from stored json in uploaded-files-storage Div
         if stored_data is None:
@@ -42,68 +318,63 @@ def register_callbacks(app, dataframes):
         else:
             file_data = json.loads(stored_data)
 
-        # Add new files if they don't already exist in the list
-        existing_filenames = [item["filename"] for item in file_data]
-        error_message = ""
-
-        for i, (content, filename, date) in enumerate(zip(contents, filenames, dates)):
-            # Check if file is a TSV
-            if not filename.endswith(".tsv"):
-                error_message = (
-                    f"Only TSV files are allowed. '{filename}' was rejected."
-                )
-                continue
+        def progress(done, total):
+            set_progress((100 * done / total, f"Loaded {done} of {total} files"))
 
-            if filename not in existing_filenames:
-                try:
-                    # Decode and parse the file content
-                    content_type, content_string = content.split(",")
-                    decoded = base64.b64decode(content_string)
-
-                    # Read the TSV into a pandas DataFrame
-                    df = pd.read_csv(io.StringIO(decoded.decode("utf-8")), sep="\t")
-                    df.columns = [x.replace("V", "MDS") for x in df.columns]
-                    mdscols = sorted([x for x in df.columns if "MDS" in x])
-                    group_mapping = {
-                        val: idx for idx, val in enumerate(df["group"].unique())
-                    }
-                    # categorical group
-                    df["group_col"] = df["group"].map(group_mapping)
-                    df["file"] = filename
-
-                    # Renumber trees
-                    df["treenum"] = df.groupby("group").cumcount() + 1
-                    df["size"] = 6
-
-                    # Store the DataFrame in our dictionary
-                    dataframes[filename] = df
-
-                    # Add file metadata to our storage
-                    file_data.append(
-                        {
-                            "filename": filename,
-                            "date": date,
-                            "rows": len(df),
-                            "dimensions": mdscols,
-                            "groups": df["group"].unique().tolist(),
-                            "MIN_TREENUM": int(df["treenum"].min()),
-                            "MAX_TREENUM": int(df["treenum"].max()),
-                        }
-                    )
-                except Exception as e:
-                    error_message = f"Error processing {filename}: {str(e)}"
-                    continue
+        set_progress((0, f"Loading {len(contents)} files..."))
+        error_message = load_uploads(
+            contents, filenames, dates, dataframes, file_data, cache, progress
+        )
 
         # Configure alert display based on error state
         alert_style = {"display": "block"} if error_message else {"display": "none"}
 
         return json.dumps(file_data), error_message, alert_style
 
+    # Callback to load TSV files from a path on the server
+    @callback(
+        [
+            Output("uploaded-files-storage", "children", allow_duplicate=True),
+            Output("validation-alert", "title", allow_duplicate=True),
+            Output("validation-alert", "style", allow_duplicate=True),
+        ],
+        Input("open-path-button", "n_clicks"),
+        State("server-path-input", "value"),
+        State("uploaded-files-storage", "children"),
+        State("session-id", "data"),
+        prevent_initial_call=True,
+    )
+    def open_server_path(n_clicks, path, stored_data, session_id):
+        if not n_clicks or not path:
+            return no_update, no_update, no_update
+        session = store.session(session_id)
+
+        file_data = json.loads(stored_data) if stored_data else []
+        error_message = ""
+        try:
+            paths = []
+            for file in list_trace_files(
+                server_path(path, path_roots), TRACE_EXTENSIONS + TREE_EXTENSIONS
+            ):
+                # Files of a directory may be symlinks leading out of it
+                with contextlib.suppress(ValueError):
+                    paths.append(server_path(file, path_roots))
+            new_files = load_trace_paths(
+                paths, session, file_data, cache, session.tails
+            )
+            if not new_files:
+                error_message = f"No new TSV or tree files found at '{path}'."
+        except Exception as e:
+            error_message = f"Error opening {path}: {str(e)}"
+
+        alert_style = {"display": "block"} if error_message else {"display": "none"}
+
+        return json.dumps(file_data), error_message, alert_style
+
     # Callback to update the MultiSelect with uploaded filenames
     @callback(
         Output("upload-placeholder", "children"),
         Input("uploaded-files-storage", "children"),
-        prevent_initial_call=True,
     )
     def update_multiselect(stored_data):
         if not stored_data:
@@ -135,18 +406,20 @@ def register_callbacks(app, dataframes):
         Output("data-info-display", "children", allow_duplicate=True),
         Input("files-multiselect", "value"),
         State("uploaded-files-storage", "children"),
+        State("session-id", "data"),
         prevent_initial_call=True,
     )
-    def display_file_info(selected_files, stored_data):
+    def display_file_info(selected_files, stored_data, session_id):
         if not selected_files or not stored_data:
             return html.Div("No files selected.")
+        dataframes = store.session(session_id)
 
         file_data = json.loads(stored_data)
         file_info = []
 
         for item in file_data:
             if item["filename"] in selected_files:
-                df = dataframes.get(item["filename"])
+                df = session_frame(dataframes, item, cache)
                 if df is not None:
                     file_info.append(
                         dmc.Paper(
@@ -183,12 +456,16 @@ def register_callbacks(app, dataframes):
             Output("plot-display", "children", allow_duplicate=True),
         ],
         Input("clear-data-button", "n_clicks"),
+        State("uploaded-files-storage", "children"),
+        State("session-id", "data"),
         prevent_initial_call=True,
     )
-    def clear_uploads(n_clicks):
+    def clear_uploads(n_clicks, stored_data, session_id):
         if n_clicks:
-            # Clear the dataframes dictionary
-            dataframes.clear()
+            # Free the frames, plot state and watchers of this session
+            store.session(session_id).clear()
+            if stored_data:
+                figures.invalidate(item["hash"] for item in json.loads(stored_data))
             return (
                 json.dumps([]),
                 html.Div("Files cleared."),
@@ -196,55 +473,203 @@ def register_callbacks(app, dataframes):
             )
         return no_update, no_update
 
+    # Show how much memory the frames of this session are using
+    @callback(
+        Output("session-memory", "children"),
+        Input("memory-interval", "n_intervals"),
+        Input("uploaded-files-storage", "children"),
+        State("session-id", "data"),
+    )
+    def display_session_memory(n_intervals, stored_data, session_id):
+        if session_id is None:
+            return no_update
+        usage = store.session(session_id).memory_usage()
+        stats = figures.stats()
+        return (
+            f"Session memory: {format_bytes(usage)}. Figure cache: "
+            f"{stats['hits']} hits, {stats['misses']} misses, {format_bytes(stats['bytes'])}"
+        )
+
     # ------- PLOT CALLBACK
 
-    DF_TO_PLOT = {}
+    def build_plot_state(session, selected_files, file_data, plot_id=None):
+        """
+        Combine and index the selected frames of a session for plotting and
+        return the new plot state and its MDS columns. Raises KeyError for
+        an evicted frame.
+
+        The new state is built apart and swapped in with one assignment,
+        its id set last, under the session lock that merge_pending and the
+        file watcher take too.
+        """
+        with session.lock:
+            # Merge rows appended to watched files since the last rebuild
+            flush_tails(session, session.tails)
+
+            names = []
+            frames = []
+            # Identifies the combined rows: names, content and rows after tailing
+            plot_key = []
+            for item in file_data:
+                if item["filename"] in selected_files:
+                    df = session_frame(session, item, cache)
+                    if df is None:
+                        raise KeyError(item["filename"])
+                    names.append(item["filename"])
+                    frames.append(df)
+                    plot_key.append((item["filename"], item["hash"], len(df)))
+                    mdscols = item["dimensions"]
+
+            def combine():
+                combined_df = concat_traces(frames)
+                if len(selected_files) > 1:
+                    combined_df = prefix_groups(combined_df)
+                return combined_df
+
+            DF_TO_PLOT = {}
+            DF_TO_PLOT["key"] = tuple(plot_key)
+            DF_TO_PLOT["hashes"] = [h for _, h, _ in plot_key]
+            # The index keeps its own sorted copy of the rows
+            if background:
+                # A background job keeps the sorted rows in the trace cache, where
+                # the server and later jobs map them back instead of sorting them
+                index = store.group_index(
+                    session.id,
+                    names,
+                    combine,
+                    cache,
+                    content_key(("index/" + json.dumps(plot_key)).encode()),
+                )
+            else:
+                index = figures.get(("index", DF_TO_PLOT["key"]))
+                if index is None:
+                    index = store.group_index(session.id, names, combine)
+                    figures.put(
+                        ("index", DF_TO_PLOT["key"]),
+                        index,
+                        frame_bytes(index.df),
+                        DF_TO_PLOT["hashes"],
+                    )
+            DF_TO_PLOT["index"] = index
+            DF_TO_PLOT["df"] = DF_TO_PLOT["index"].df
+            DF_TO_PLOT["pending"] = []
+            DF_TO_PLOT["tail_range"] = None
+            DF_TO_PLOT["zoom"] = {}
+            DF_TO_PLOT["GROUPS"] = DF_TO_PLOT["index"].groups
+            # Colors repeat when there are more groups than colors
+            DF_TO_PLOT["GROUP_COLORS"] = [
+                GROUP_PALETTE[i % len(GROUP_PALETTE)]
+                for i in range(len(DF_TO_PLOT["GROUPS"]))
+            ]
+            DF_TO_PLOT["COLOR_DICT"] = {
+                g: c for g, c in zip(DF_TO_PLOT["GROUPS"], DF_TO_PLOT["GROUP_COLORS"])
+            }
+            DF_TO_PLOT["id"] = plot_id
+            session.plot = DF_TO_PLOT
+        # The plot state counts toward the memory budget of all sessions
+        store.evict(active=session.id)
+        return DF_TO_PLOT, mdscols
+
+    def merge_pending(session, DF_TO_PLOT):
+        """
+        Include rows read by the file watcher since the last rebuild,
+        inserted into the sorted group blocks instead of sorting again.
+        Returns the merged plot state, which replaces that of the session
+        unless it was rebuilt or evicted meanwhile.
+        """
+        with session.lock:
+            if DF_TO_PLOT["pending"]:
+                index = DF_TO_PLOT["index"].extend(concat_traces(DF_TO_PLOT["pending"]))
+                merged = dict(DF_TO_PLOT, index=index, df=index.df, pending=[])
+                if session.plot is DF_TO_PLOT:
+                    session.plot = merged
+                DF_TO_PLOT = merged
+            return DF_TO_PLOT
+
+    def view_key(DF_TO_PLOT, *view):
+        # Cache key of a figure of the plot rows, tailed rows included
+        return (DF_TO_PLOT["key"], len(DF_TO_PLOT["df"]), *view)
+
+    def ensure_plot_state(session, selected_files, stored_data, plot_id):
+        """
+        Plot state of the session, rebuilt if it belongs to a plot drawn by
+        a background job or by another worker process, or was evicted.
+        Returns None if there is nothing to rebuild it from.
+        """
+        with session.lock:
+            if "index" in session.plot and session.plot.get("id") == plot_id:
+                return session.plot
+            if not selected_files or not stored_data:
+                return None
+            try:
+                DF_TO_PLOT, _ = build_plot_state(
+                    session, selected_files, json.loads(stored_data), plot_id
+                )
+            except KeyError:
+                return None
+            return DF_TO_PLOT
 
     # Callback to display information about selected files
-    @callback(
-        Output("plot-display", "children", allow_duplicate=True),
+    @job_callback(
+        "plot-progress",
+        [
+            Output("plot-display", "children", allow_duplicate=True),
+            Output("validation-alert", "title", allow_duplicate=True),
+            Output("validation-alert", "style", allow_duplicate=True),
+        ],
         Input("files-multiselect", "value"),
         State("uploaded-files-storage", "children"),
+        State("session-id", "data"),
         prevent_initial_call=True,
     )
-    def display_plots(selected_files, stored_data):
+    def display_plots(set_progress, selected_files, stored_data, session_id):
         if not selected_files or not stored_data:
-            return html.Div("No files selected.")
+            return html.Div("No files selected."), no_update, no_update
 
-        file_data = json.loads(stored_data)
-        plot_div = []
-        combined_df = []
-        for item in file_data:
-            if item["filename"] in selected_files:
-                combined_df.append(dataframes.get(item["filename"]))
-                mdscols = item["dimensions"]
-                MIN_TREENUM = item["MIN_TREENUM"]
-                MAX_TREENUM = item["MAX_TREENUM"]
+        session = store.session(session_id)
 
-        combined_df = pd.concat(combined_df)
-        if len(selected_files) > 1:
-            combined_df["group"] = combined_df["file"] + "/" + combined_df["group"]
+        plot_div = []
+        plot_id = uuid.uuid4().hex
+        set_progress((0, "Combining files..."))
+        try:
+            DF_TO_PLOT, mdscols = build_plot_state(
+                session, selected_files, json.loads(stored_data), plot_id
+            )
+        except KeyError as e:
+            error_message = f"'{e.args[0]}' was evicted from memory. Please load it again."
+            return html.Div(error_message), error_message, {"display": "block"}
+        except Exception as e:
+            error_message = f"Error building plot: {str(e)}"
+            return html.Div(error_message), error_message, {"display": "block"}
+        MIN_TREENUM = int(DF_TO_PLOT["index"].treenum.min())
+        MAX_TREENUM = int(DF_TO_PLOT["index"].treenum.max())
 
-        default_fig = make_plot_grid()
+        set_progress((50, "Building figure..."))
         x, y, z = mdscols[0], mdscols[1], mdscols[2]
-        DF_TO_PLOT["df"] = combined_df
-        DF_TO_PLOT["GROUPS"] = combined_df["group"].unique()
-        DF_TO_PLOT["GROUP_COLORS"] = px.colors.qualitative.Dark24[
-            : len(DF_TO_PLOT["GROUPS"])
-        ]
-        DF_TO_PLOT["COLOR_DICT"] = {
-            g: c for g, c in zip(DF_TO_PLOT["GROUPS"], DF_TO_PLOT["GROUP_COLORS"])
-        }
-
-        add_trace_multiplot(
-            default_fig,
-            DF_TO_PLOT["df"],
-            x,
-            y,
-            z,
-            DF_TO_PLOT["GROUPS"],
-            DF_TO_PLOT["COLOR_DICT"],
-        )
+        key = view_key(DF_TO_PLOT, "figure", (x, y, z))
+        if background:
+            job_key = content_key(("figure/" + json.dumps(key)).encode())
+            default_fig = job_figures.get(job_key)
+        else:
+            default_fig = figures.get(key)
+        if default_fig is None:
+            default_fig = make_plot_grid()
+            add_trace_multiplot(
+                default_fig,
+                DF_TO_PLOT["df"],
+                x,
+                y,
+                z,
+                DF_TO_PLOT["GROUPS"],
+                DF_TO_PLOT["COLOR_DICT"],
+                index=DF_TO_PLOT["index"],
+            )
+            if background:
+                job_figures.set(job_key, default_fig.to_plotly_json())
+            else:
+                figures.put(
+                    key, default_fig, serialized_bytes(default_fig), DF_TO_PLOT["hashes"]
+                )
 
         # Controls row with slider and checkbox
         controls = html.Div(
@@ -286,57 +711,642 @@ def register_callbacks(app, dataframes):
             style={"display": "flex", "align-items": "center", "padding": "5px 0"},
         )
 
+        # Rendering controls row
+        render_controls = html.Div(
+            [
+                html.Div(
+                    [
+                        html.Label("Render:", style={"margin-right": "5px"}),
+                        dcc.RadioItems(
+                            options=RENDER_MODES,
+                            value="webgl",
+                            id="render-mode",
+                            inline=True,
+                        ),
+                    ],
+                    style={"display": "flex", "padding": "5px"},
+                ),
+                html.Div(
+                    [
+                        html.Label("Sampling:", style={"margin-right": "5px"}),
+                        dcc.RadioItems(
+                            options=SAMPLING_METHODS,
+                            value="stratified",
+                            id="sampling-method",
+                            inline=True,
+                        ),
+                    ],
+                    style={"display": "flex", "padding": "5px"},
+                ),
+                html.Div(
+                    [
+                        dcc.Checklist(
+                            options=["Merge identical trees"],
+                            value=[],
+                            id="aggregate-trees",
+                            inline=True,
+                        ),
+                    ],
+                    style={"display": "flex", "padding": "5px"},
+                ),
+                html.Div(
+                    [
+                        dcc.Checklist(
+                            options=["Watch files"],
+                            value=[],
+                            id="watch-files",
+                            inline=True,
+                        ),
+                        dcc.Interval(
+                            id="tail-interval",
+                            interval=TAIL_INTERVAL_MS,
+                            disabled=True,
+                        ),
+                    ],
+                    style={"display": "flex", "padding": "5px"},
+                ),
+                html.Div(
+                    [
+                        dcc.Checklist(
+                            options=["Filter in browser"],
+                            value=[],
+                            id="client-filter",
+                            inline=True,
+                        ),
+                        html.Button(
+                            "Play",
+                            id="play-button",
+                            disabled=True,
+                            style={"margin-left": "10px"},
+                        ),
+                        html.Label("Pass (s):", style={"margin": "0 5px"}),
+                        dcc.Input(
+                            id="play-seconds",
+                            type="number",
+                            min=1,
+                            value=PLAY_SECONDS,
+                            style={"width": "60px"},
+                        ),
+                        html.Span(id="play-window", style={"margin-left": "5px"}),
+                    ],
+                    style={"display": "flex", "align-items": "center", "padding": "5px"},
+                ),
+                html.Div(
+                    [
+                        html.Label("Point budget:", style={"margin-right": "5px"}),
+                        dcc.Input(
+                            id="point-budget",
+                            type="number",
+                            min=1000,
+                            step=1000,
+                            value=DEFAULT_MAX_POINTS,
+                            debounce=True,
+                        ),
+                    ],
+                    style={"display": "flex", "padding": "5px"},
+                ),
+            ],
+            style={"display": "flex", "align-items": "center", "padding": "5px 0"},
+        )
+
         plot_div.append(controls)
+        plot_div.append(render_controls)
+        # Identifies the plot state this figure was built from
+        plot_div.append(dcc.Store(id="plot-id", data=plot_id))
+        # Dimensions and treenum range drawn by the server (see update_graph)
         plot_div.append(
-            html.Div(
-                # 3D plot
-                dcc.Graph(figure=default_fig, id="graph", style={"height": "75vh"}),
-                style={
-                    "width": "95%",
-                    "display": "inline-block",
-                    "vertical-align": "top",
+            dcc.Store(
+                id="graph-view",
+                data={
+                    "dimensions": mdscols[:3],
+                    "treenum_range": [MIN_TREENUM, MAX_TREENUM],
                 },
             )
         )
+        # Rows sent to the browser while it filters by itself
+        plot_div.append(dcc.Store(id="client-trace-data"))
+        # Rows read by the file watcher, appended in the browser (see extend)
+        plot_div.append(dcc.Store(id="tail-points"))
+        # Last box, lasso or click on the graph (see selection_query)
+        plot_div.append(dcc.Store(id="selection-query"))
+        plot_div.append(
+            html.Div(
+                [
+                    # 3D plot
+                    html.Div(
+                        dcc.Graph(
+                            figure=default_fig, id="graph", style={"height": "75vh"}
+                        ),
+                        style={"width": "75%"},
+                    ),
+                    html.Div(
+                        [
+                            # Convergence diagnostics of the selected window
+                            html.Div(id="diagnostics-panel"),
+                            # Trees selected or clicked on the graph
+                            html.Div(id="selection-panel"),
+                            html.Button(
+                                "Download selection (TSV)",
+                                id="selection-download-button",
+                                disabled=True,
+                            ),
+                            dcc.Download(id="selection-download"),
+                        ],
+                        style={"width": "25%", "padding": "5px", "overflow-y": "auto"},
+                    ),
+                ],
+                style={"display": "flex", "width": "95%", "vertical-align": "top"},
+            )
+        )
+
+        set_progress((100, "Done"))
+        # Leave the alert to the validation of uploads and paths
+        return html.Div(plot_div), no_update, no_update
 
-        return html.Div(plot_div)
+    # The dimensions and treenum slider reach the server through graph-view,
+    # which is left alone while the browser filters by itself
+    app.clientside_callback(
+        ClientsideFunction(namespace="treetracer", function_name="route_view"),
+        Output("graph-view", "data"),
+        Input("dimensions-box", "value"),
+        Input("treenum-slider", "value"),
+        Input("client-filter", "value"),
+        prevent_initial_call=True,
+    )
 
     # Add controls to build the interaction
     @callback(
         Output(component_id="graph", component_property="figure", allow_duplicate=True),
         [
-            Input(component_id="dimensions-box", component_property="value"),
-            Input(component_id="treenum-slider", component_property="value"),
+            Input(component_id="graph-view", component_property="data"),
+            Input(component_id="render-mode", component_property="value"),
+            Input(component_id="sampling-method", component_property="value"),
+            Input(component_id="point-budget", component_property="value"),
+            Input(component_id="aggregate-trees", component_property="value"),
         ],
-        [Input(component_id="graph", component_property="figure")],
+        State("files-multiselect", "value"),
+        State("uploaded-files-storage", "children"),
+        State("client-filter", "value"),
+        State("plot-id", "data"),
+        State("session-id", "data"),
         prevent_initial_call=True,
     )
-    def update_graph(mds_selected, treenum_range, current_figure):
-        # Only update the graph if exactly 3 options are selected
-        if len(mds_selected) != 3:
-            return current_figure
+    def update_graph(
+        view,
+        render_mode,
+        sampling,
+        max_points,
+        aggregate,
+        selected_files,
+        stored_data,
+        client_filter,
+        plot_id,
+        session_id,
+    ):
+        mds_selected = view["dimensions"]
+        treenum_range = view["treenum_range"]
+        # Only update the graph if exactly 3 options are selected, and leave
+        # it to the browser while it filters by itself
+        if len(mds_selected) != 3 or client_filter:
+            return no_update
 
-        # Filter data based on treenum range
-        df = DF_TO_PLOT["df"]
-        filtered_dff = df[
-            (df["treenum"] >= treenum_range[0]) & (df["treenum"] <= treenum_range[1])
-        ]
+        session = store.session(session_id)
+        DF_TO_PLOT = ensure_plot_state(session, selected_files, stored_data, plot_id)
+        if DF_TO_PLOT is None:
+            return no_update
 
+        # Slider moved by the file watcher; its points are already plotted.
+        # The range is consumed so that later changes of the view redraw.
+        tail_range = DF_TO_PLOT.pop("tail_range", None)
+        if (
+            tail_range is not None
+            and treenum_range == tail_range
+            and list(dash.ctx.triggered_prop_ids) == ["graph-view.data"]
+        ):
+            return no_update
+
+        DF_TO_PLOT = merge_pending(session, DF_TO_PLOT)
         x, y, z = mds_selected
+        zoom = DF_TO_PLOT.get("zoom") or {}
+        key = view_key(
+            DF_TO_PLOT,
+            "patch",
+            (x, y, z),
+            tuple(treenum_range),
+            render_mode,
+            sampling,
+            max_points,
+            bool(aggregate),
+            # Density panels are binned over the zoomed ranges
+            tuple(sorted((a, tuple(r)) for a, r in zoom.items() if r))
+            if render_mode == "density"
+            else None,
+        )
+        patch = figures.get(key)
+        if patch is not None:
+            return patch
+
+        # Send only the changed arrays and titles; the figure stays on the client
+        patch = Patch()
+        patch_trace_multiplot(
+            patch,
+            DF_TO_PLOT["df"],
+            x,
+            y,
+            z,
+            DF_TO_PLOT["GROUPS"],
+            render_mode=render_mode,
+            max_points=max_points,
+            sampling=sampling,
+            index=DF_TO_PLOT["index"],
+            treenum_range=treenum_range,
+            COLOR_DICT=DF_TO_PLOT["COLOR_DICT"],
+            ranges=DF_TO_PLOT.get("zoom"),
+            aggregate=bool(aggregate),
+        )
+        figures.put(key, patch, serialized_bytes(patch), DF_TO_PLOT["hashes"])
+        return patch
+
+    # ------- CLIENT-SIDE FILTERING
 
-        fig = make_plot_grid()
-        add_trace_multiplot(
-            fig, filtered_dff, x, y, z, DF_TO_PLOT["GROUPS"], DF_TO_PLOT["COLOR_DICT"]
+    # Send the rows of the plot once while the browser filters by itself
+    @callback(
+        Output("client-trace-data", "data"),
+        Input("client-filter", "value"),
+        Input("sampling-method", "value"),
+        Input("point-budget", "value"),
+        State("dimensions-box", "options"),
+        State("files-multiselect", "value"),
+        State("uploaded-files-storage", "children"),
+        State("plot-id", "data"),
+        State("session-id", "data"),
+        prevent_initial_call=True,
+    )
+    def send_client_data(
+        client_filter,
+        sampling,
+        max_points,
+        mdscols,
+        selected_files,
+        stored_data,
+        plot_id,
+        session_id,
+    ):
+        if not client_filter:
+            # Free the browser's copy
+            return None
+        session = store.session(session_id)
+        DF_TO_PLOT = ensure_plot_state(session, selected_files, stored_data, plot_id)
+        if DF_TO_PLOT is None:
+            return no_update
+        DF_TO_PLOT = merge_pending(session, DF_TO_PLOT)
+        return client_trace_data(
+            DF_TO_PLOT["df"],
+            mdscols,
+            DF_TO_PLOT["GROUPS"],
+            DF_TO_PLOT["COLOR_DICT"],
+            max_points=max_points,
+            sampling=sampling,
+            index=DF_TO_PLOT["index"],
         )
 
-        # If we have a current figure, try to preserve visibility settings
+    # Filter and redraw in the browser; drag_value follows the slider live
+    app.clientside_callback(
+        ClientsideFunction(namespace="treetracer", function_name="render"),
+        Output("graph", "figure", allow_duplicate=True),
+        Input("client-trace-data", "data"),
+        Input("dimensions-box", "value"),
+        Input("treenum-slider", "drag_value"),
+        Input("treenum-slider", "value"),
+        Input("render-mode", "value"),
+        State("client-filter", "value"),
+        State("graph", "figure"),
+        prevent_initial_call=True,
+    )
+
+    app.clientside_callback(
+        "function (clientFilter) { return !(clientFilter && clientFilter.length); }",
+        Output("play-button", "disabled"),
+        Input("client-filter", "value"),
+    )
+
+    # Slide a treenum window through the chain in the browser
+    app.clientside_callback(
+        ClientsideFunction(namespace="treetracer", function_name="toggle_play"),
+        Output("play-button", "children"),
+        Input("play-button", "n_clicks"),
+        State("client-trace-data", "data"),
+        State("dimensions-box", "value"),
+        State("treenum-slider", "value"),
+        State("treenum-slider", "min"),
+        State("treenum-slider", "max"),
+        State("play-seconds", "value"),
+        State("render-mode", "value"),
+        State("graph", "figure"),
+        prevent_initial_call=True,
+    )
+
+    # Re-bin the density panels for the zoomed ranges
+    @callback(
+        Output("graph", "figure", allow_duplicate=True),
+        Input("graph", "relayoutData"),
+        State("render-mode", "value"),
+        State("dimensions-box", "value"),
+        State("treenum-slider", "value"),
+        State("files-multiselect", "value"),
+        State("uploaded-files-storage", "children"),
+        State("client-filter", "value"),
+        State("plot-id", "data"),
+        State("session-id", "data"),
+        prevent_initial_call=True,
+    )
+    def rebin_density(
+        relayout,
+        render_mode,
+        mds_selected,
+        treenum_range,
+        selected_files,
+        stored_data,
+        client_filter,
+        plot_id,
+        session_id,
+    ):
+        # The browser draws plain markers while it filters by itself
+        if not relayout or len(mds_selected) != 3 or client_filter:
+            return no_update
+        session = store.session(session_id)
+        DF_TO_PLOT = ensure_plot_state(session, selected_files, stored_data, plot_id)
+        if DF_TO_PLOT is None:
+            return no_update
+
+        # Zoom is tracked in every mode so that switching to density keeps it
+        zoom = DF_TO_PLOT.setdefault("zoom", {})
+        if not update_zoom(zoom, relayout) or render_mode != "density":
+            return no_update
+
+        x, y, z = mds_selected
+        patch = Patch()
+        patch_density_panels(
+            patch,
+            DF_TO_PLOT["df"],
+            x,
+            y,
+            z,
+            DF_TO_PLOT["GROUPS"],
+            index=DF_TO_PLOT["index"],
+            treenum_range=treenum_range,
+            ranges=zoom,
+        )
+        return patch
+
+    # Recompute the diagnostics when the dimensions or the treenum window change
+    @callback(
+        Output("diagnostics-panel", "children"),
+        Input("dimensions-box", "value"),
+        Input("treenum-slider", "value"),
+        State("files-multiselect", "value"),
+        State("uploaded-files-storage", "children"),
+        State("plot-id", "data"),
+        State("session-id", "data"),
+    )
+    def update_diagnostics(
+        mds_selected, treenum_range, selected_files, stored_data, plot_id, session_id
+    ):
+        if not mds_selected or not treenum_range:
+            return no_update
+        session = store.session(session_id)
+        DF_TO_PLOT = ensure_plot_state(session, selected_files, stored_data, plot_id)
+        if DF_TO_PLOT is None:
+            return no_update
+
+        # Cumulative sums are kept until the plot state or the dimensions change
+        diagnostics = DF_TO_PLOT.get("diagnostics")
         if (
-            current_figure
-            and "data" in current_figure
-            and len(current_figure["data"]) == len(fig.data)
+            diagnostics is None
+            or diagnostics.index is not DF_TO_PLOT["index"]
+            or diagnostics.columns != mds_selected
         ):
-            for i in range(len(fig.data)):
-                if "visible" in current_figure["data"][i]:
-                    fig.data[i].visible = current_figure["data"][i]["visible"]
+            diagnostics = TraceDiagnostics(DF_TO_PLOT["index"], mds_selected)
+            DF_TO_PLOT["diagnostics"] = diagnostics
+            store.evict(active=session.id)
+
+        lo, hi = treenum_range
+        return add_diagnostics_panel(diagnostics.summary(lo, hi), PSRF_THRESHOLD)
+
+    # ------- SELECTION
+
+    # Box and lasso selections on the 2D panels and clicks on any panel
+    @callback(
+        Output("selection-query", "data"),
+        Input("graph", "selectedData"),
+        Input("graph", "clickData"),
+        State("dimensions-box", "value"),
+        prevent_initial_call=True,
+    )
+    def select_trees(selected, click, mds_selected):
+        if len(mds_selected) != 3:
+            return no_update
+        if dash.ctx.triggered_prop_ids.get("graph.clickData"):
+            return selection_query(mds_selected, click=click)
+        return selection_query(mds_selected, selected=selected)
 
-        return fig
+    # Trees matched by the selection within the treenum window
+    @callback(
+        Output("selection-panel", "children"),
+        Output("selection-download-button", "disabled"),
+        Input("selection-query", "data"),
+        Input("treenum-slider", "value"),
+        State("files-multiselect", "value"),
+        State("uploaded-files-storage", "children"),
+        State("plot-id", "data"),
+        State("session-id", "data"),
+        prevent_initial_call=True,
+    )
+    def show_selection(
+        query, treenum_range, selected_files, stored_data, plot_id, session_id
+    ):
+        if not query:
+            return None, True
+        session = store.session(session_id)
+        DF_TO_PLOT = ensure_plot_state(session, selected_files, stored_data, plot_id)
+        if DF_TO_PLOT is None:
+            return no_update, no_update
+        frame = selection_frame(DF_TO_PLOT["index"], query, treenum_range)
+        # The spatial index built for the query counts toward the budget
+        store.evict(active=session.id)
+        return add_selection_panel(frame, query), frame.empty
+
+    @callback(
+        Output("selection-download", "data"),
+        Input("selection-download-button", "n_clicks"),
+        State("selection-query", "data"),
+        State("treenum-slider", "value"),
+        State("files-multiselect", "value"),
+        State("uploaded-files-storage", "children"),
+        State("plot-id", "data"),
+        State("session-id", "data"),
+        prevent_initial_call=True,
+    )
+    def download_selection(
+        n_clicks, query, treenum_range, selected_files, stored_data, plot_id, session_id
+    ):
+        if not query:
+            return no_update
+        session = store.session(session_id)
+        DF_TO_PLOT = ensure_plot_state(session, selected_files, stored_data, plot_id)
+        if DF_TO_PLOT is None:
+            return no_update
+        frame = selection_frame(DF_TO_PLOT["index"], query, treenum_range)
+        return dcc.send_data_frame(
+            frame.to_csv, "treetracer-selection.tsv", sep="\t", index=False
+        )
+
+    # ------- FILE WATCHING
+
+    @callback(
+        Output("tail-interval", "disabled"),
+        Input("watch-files", "value"),
+        prevent_initial_call=True,
+    )
+    def toggle_watch(watch):
+        return not watch
+
+    # Append rows written to watched files since the last tick to the plot
+    @callback(
+        [
+            Output("tail-points", "data"),
+            Output("treenum-slider", "max"),
+            Output("treenum-slider", "marks"),
+            Output("treenum-slider", "value"),
+        ],
+        Input("tail-interval", "n_intervals"),
+        State("files-multiselect", "value"),
+        State("dimensions-box", "value"),
+        State("treenum-slider", "value"),
+        State("treenum-slider", "min"),
+        State("treenum-slider", "max"),
+        State("render-mode", "value"),
+        State("sampling-method", "value"),
+        State("point-budget", "value"),
+        State("uploaded-files-storage", "children"),
+        State("client-filter", "value"),
+        State("aggregate-trees", "value"),
+        State("plot-id", "data"),
+        State("session-id", "data"),
+        prevent_initial_call=True,
+    )
+    def extend_traces(
+        n_intervals,
+        selected_files,
+        mds_selected,
+        treenum_range,
+        min_treenum,
+        max_treenum,
+        render_mode,
+        sampling,
+        max_points,
+        stored_data,
+        client_filter,
+        aggregate,
+        plot_id,
+        session_id,
+    ):
+        if len(mds_selected) != 3:
+            return no_update, no_update, no_update, no_update
+        session = store.session(session_id)
+
+        # Read and queue the new rows under the session lock, so that a
+        # rebuild flushes them into the frames either before or after both
+        with session.lock:
+            DF_TO_PLOT = ensure_plot_state(
+                session, selected_files, stored_data, plot_id
+            )
+            if DF_TO_PLOT is None:
+                return no_update, no_update, no_update, no_update
+            new_rows = []
+            for filename in selected_files:
+                tail = session.tails.get(filename)
+                df = tail.read_new() if tail is not None else None
+                if df is not None:
+                    new_rows.append(df)
+            if not new_rows:
+                return no_update, no_update, no_update, no_update
+
+            new_df = concat_traces(new_rows)
+            if len(selected_files) > 1:
+                new_df = prefix_groups(new_df)
+            DF_TO_PLOT["pending"].append(new_df)
+
+        new_max = max(max_treenum, int(new_df["treenum"].max()))
+        marks = {min_treenum: str(min_treenum), new_max: str(new_max)}
+
+        # Only follow the chain if the slider is at the last tree. The rows
+        # the browser filters are only resent when it is switched back on.
+        if treenum_range[1] < max_treenum or client_filter:
+            return no_update, new_max, marks, no_update
+        if aggregate:
+            # New rows can add to the counts of drawn points, so the window
+            # is moved and update_graph merges the points again
+            return no_update, new_max, marks, [treenum_range[0], new_max]
+
+        x, y, z = mds_selected
+        window = [treenum_range[0], new_max]
+        if render_mode == "density":
+            max_points = min(max_points or DENSITY_3D_POINTS, DENSITY_3D_POINTS)
+        GROUPS = DF_TO_PLOT["GROUPS"]
+        # Rows of every group in the extended window, pending rows included
+        totals = dict.fromkeys(GROUPS, 0)
+        index = DF_TO_PLOT["index"]
+        for gr in GROUPS:
+            if gr in index.positions:
+                start, end = index.bounds(gr, window)
+                totals[gr] += end - start
+        for pending in DF_TO_PLOT["pending"]:
+            for gr, n in pending["group"].value_counts().items():
+                if gr in totals:
+                    totals[gr] += n
+        budget = dict(
+            zip(GROUPS, split_point_budget([totals[gr] for gr in GROUPS], max_points))
+        )
+
+        # 3D and 2D traces are extended apart, as only the former have z
+        points = {
+            "3d": {"update": {"x": [], "y": [], "z": [], "customdata": []}, "indices": []},
+            "2d": {"update": {"x": [], "y": [], "customdata": []}, "indices": []},
+        }
+        trace_index = {gr: i * 4 for i, gr in enumerate(GROUPS)}
+        for gr, group_data in new_df.groupby("group", observed=True, sort=False):
+            if gr not in trace_index:
+                # New groups appear on the next full rebuild
+                continue
+            # Thin the new rows as much as update_graph thins their window
+            if budget[gr] < totals[gr]:
+                size = int(np.ceil(len(group_data) * budget[gr] / totals[gr]))
+                group_data = downsample(group_data, size, x, y, z, sampling)
+            tree = encode_points(group_data["tree"].to_numpy())
+            cols = {c: encode_points(group_data[c].to_numpy()) for c in {x, y, z}}
+            # Same panel order as add_trace_multiplot: 3D, x/y, x/z, y/z
+            panels = panel_columns(x, y, z)
+            if render_mode == "density":
+                # Density panels are re-binned on the next full update
+                panels = panels[:1]
+            for k, panel in enumerate(panels):
+                part = points["3d" if k == 0 else "2d"]
+                for axis, col in zip(["x", "y", "z"], panel):
+                    part["update"][axis].append(cols[col])
+                part["update"]["customdata"].append(tree)
+                part["indices"].append(trace_index[gr] + k)
+
+        DF_TO_PLOT["tail_range"] = window
+        if not points["3d"]["indices"]:
+            return no_update, new_max, marks, window
+        return points, new_max, marks, window
+
+    # Typed arrays cannot be extended by plotly as sent, so the browser
+    # decodes them and the traces they extend first
+    app.clientside_callback(
+        ClientsideFunction(namespace="treetracer", function_name="extend"),
+        Output("graph", "extendData"),
+        Input("tail-points", "data"),
+        prevent_initial_call=True,
+    )
@@ -0,0 +1,285 @@
+"""
+Command line entry point.
+
+    treetracer [paths ...]             serve the app with paths preloaded
+    treetracer report paths ... -o DIR write HTML reports without the app
+
+Only the standard library is imported at module level, so `treetracer
+--help` and argument errors return immediately. Dash, pandas and plotly
+are imported once the arguments are known and the server is started.
+"""
+
+import argparse
+import importlib.metadata
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import webbrowser
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8050
+
+# Addresses that listen on every interface but cannot be browsed to
+WILDCARD_HOSTS = ("0.0.0.0", "::", "")
+
+# Seconds to wait for the server to accept connections before giving up
+# on opening the browser
+BROWSER_TIMEOUT = 120
+
+
+def _version():
+    try:
+        return importlib.metadata.version("treetracer")
+    except importlib.metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="treetracer",
+        description="Visualize phylogenetic tree topology convergence",
+        epilog="Run 'treetracer report --help' to write HTML reports of many runs.",
+    )
+    parser.add_argument(
+        "paths",
+        nargs="*",
+        help="trace TSV or tree files, or directories, to preload at startup",
+    )
+    parser.add_argument(
+        "--host",
+        default=DEFAULT_HOST,
+        help="interface to listen on; 0.0.0.0 for every interface (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=DEFAULT_PORT,
+        help="port to listen on (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--no-browser",
+        action="store_true",
+        help="do not open the app in a web browser",
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=float,
+        help="memory in GiB shared by all sessions before old traces are evicted (default: 4)",
+    )
+    parser.add_argument(
+        "--figure-cache",
+        type=float,
+        help="memory in GiB for combined frames and figures of recent views; "
+        "0 disables the cache (default: 0.5)",
+    )
+    parser.add_argument(
+        "--path-root",
+        action="append",
+        help="directory the server path box may open files from; repeat for "
+        "several (default: any path)",
+    )
+    parser.add_argument(
+        "--session-hours",
+        type=float,
+        help="hours after which an unused session and its traces are dropped (default: 24)",
+    )
+    parser.add_argument(
+        "--spill-dir",
+        help="directory evicted traces are written to instead of being dropped",
+    )
+    parser.add_argument(
+        "--metrics",
+        action="store_true",
+        help="time callbacks and serve the results on /metrics",
+    )
+    parser.add_argument(
+        "--profile-dir",
+        help="write cProfile statistics of slow callback requests to this directory",
+    )
+    parser.add_argument(
+        "--profile-slow",
+        type=float,
+        help="seconds above which a callback request is profiled (default: 1)",
+    )
+    parser.add_argument("--version", action="version", version=f"%(prog)s {_version()}")
+    return parser.parse_args(argv)
+
+
+def parse_report_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="treetracer report",
+        description="Write a self-contained HTML report of every run, plus an index page",
+    )
+    parser.add_argument(
+        "paths",
+        nargs="+",
+        help="trace TSV or tree files, or directories of them; every file is one run",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default="treetracer-reports",
+        help="directory the reports are written to (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        help="worker processes, each holding one run in memory (default: CPU count)",
+    )
+    parser.add_argument(
+        "--max-points",
+        type=int,
+        help="points drawn per report before groups are downsampled (default: 200000)",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="trace cache shared with the app, so reruns skip parsing "
+        "(default: the app's cache)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="parse every run without reading or filling the trace cache",
+    )
+    parser.add_argument(
+        "--cdn",
+        action="store_true",
+        help="load plotly.js from a CDN instead of embedding it in every report",
+    )
+    return parser.parse_args(argv)
+
+
+def report(argv=None):
+    """
+    Entry point of `treetracer report`. Returns the exit status.
+    """
+    args = parse_report_args(argv)
+    from .cache import DEFAULT_CACHE_DIR
+    from .report import INDEX_FILE, write_reports
+
+    cache_dir = None if args.no_cache else args.cache_dir or DEFAULT_CACHE_DIR
+    results = write_reports(
+        args.paths, args.output, args.workers, cache_dir, args.max_points, args.cdn
+    )
+    failed = sum("error" in result for _, result in results)
+    print(
+        f"Wrote {len(results) - failed} reports to {args.output}"
+        + (f", {failed} failed" if failed else "")
+        + f". Open {os.path.join(args.output, INDEX_FILE)}",
+        flush=True,
+    )
+    return 1 if failed or not results else 0
+
+
+def _local_host(host):
+    return DEFAULT_HOST if host in WILDCARD_HOSTS else host
+
+
+def app_url(host, port):
+    host = _local_host(host)
+    if ":" in host:
+        host = f"[{host}]"
+    return f"http://{host}:{port}/"
+
+
+def open_browser(host, port, timeout=BROWSER_TIMEOUT):
+    """
+    Open the app in a browser as soon as the server accepts connections.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((_local_host(host), port), timeout=1):
+                break
+        except OSError:
+            time.sleep(0.1)
+    else:
+        return
+    webbrowser.open_new(app_url(host, port))
+
+
+def serve(args):
+    """
+    Preload the given traces and run the development server until stopped.
+    """
+    # Heavy imports are deferred until here
+    from .app import create_dash_app
+    from .cache import DEFAULT_FIGURE_CACHE_SIZE, FigureCache, TraceCache
+    from .callbacks import load_trace_paths, register_callbacks
+    from .jobs import job_manager
+    from .loader import TRACE_EXTENSIONS, list_trace_files
+    from .metrics import DEFAULT_SLOW_SECONDS, CallbackMetrics
+    from .store import DEFAULT_MEMORY_BUDGET, DEFAULT_SESSION_TTL, SessionStore
+    from .trees import TREE_EXTENSIONS
+
+    cache = TraceCache()
+    memory_budget = (
+        DEFAULT_MEMORY_BUDGET
+        if args.memory_budget is None
+        else int(args.memory_budget * 1024**3)
+    )
+    session_ttl = (
+        DEFAULT_SESSION_TTL if args.session_hours is None else args.session_hours * 3600
+    )
+    store = SessionStore(memory_budget, args.spill_dir, session_ttl)
+    figures = FigureCache(
+        DEFAULT_FIGURE_CACHE_SIZE
+        if args.figure_cache is None
+        else int(args.figure_cache * 1024**3)
+    )
+
+    # Preload traces given on the command line; they are shared by all sessions
+    file_data = []
+    paths = []
+    for path in args.paths:
+        paths.extend(list_trace_files(path, TRACE_EXTENSIONS + TREE_EXTENSIONS))
+    load_trace_paths(paths, store.shared, file_data, cache, store.shared_tails)
+    stored_data = json.dumps(file_data) if file_data else None
+
+    app = create_dash_app(stored_data, job_manager())
+    metrics = None
+    if args.metrics or args.profile_dir:
+        slow = DEFAULT_SLOW_SECONDS if args.profile_slow is None else args.profile_slow
+        metrics = CallbackMetrics(args.profile_dir, slow)
+    register_callbacks(
+        app,
+        store,
+        cache=cache,
+        metrics=metrics,
+        figures=figures,
+        path_roots=args.path_root,
+    )
+
+    # VERY IMPORTANT: This call starts the server and keeps the process running.
+    # Use debug=True for development. Use --host 0.0.0.0 if you need to access
+    # it from other devices on your network (e.g., Docker, WSL).
+    app.run(debug=False, host=args.host, port=args.port)
+
+
+def main(argv=None):
+    """
+    Main entry point for the TreeTracer application.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv[:1] == ["report"]:
+        sys.exit(report(argv[1:]))
+
+    args = parse_args(argv)
+    print(f"Starting TreeTracer on {app_url(args.host, args.port)}", flush=True)
+    if not args.no_browser:
+        threading.Thread(
+            target=open_browser, args=(args.host, args.port), daemon=True
+        ).start()
+    try:
+        serve(args)
+    except Exception as e:
+        print(f"ERROR: An unexpected error occurred: {e}", file=sys.stderr)
+        import traceback
+
+        traceback.print_exc(file=sys.stderr)  # Prints the full traceback
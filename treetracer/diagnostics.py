@@ -0,0 +1,210 @@
+import numpy as np
+
+
+# Number of sliding windows in the PSRF series
+DEFAULT_WINDOWS = 50
+
+# Sliding windows cover this fraction of the selected treenum range
+WINDOW_FRACTION = 0.25
+
+# PSRF values below this are usually taken as converged
+PSRF_THRESHOLD = 1.1
+
+# Longest series per group whose autocorrelation the ESS is computed from
+ESS_BLOCKS = 1024
+
+
+def psrf(n, mean, var):
+    """
+    Potential scale reduction factor of every MDS axis (Gelman and Rubin),
+    treating groups as chains.
+
+    n, mean and var are the per-group counts (..., groups) and per-axis
+    means and variances (..., groups, axes) of one or more windows.
+    Groups with fewer than two rows are left out; NaN if fewer than two
+    groups remain.
+    """
+    valid = n >= 2
+    chains = valid.sum(axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        weights = valid[..., None]
+        W = (var * weights).sum(axis=-2) / chains[..., None]
+        chain_mean = (mean * weights).sum(axis=-2) / chains[..., None]
+        B_over_n = ((mean - chain_mean[..., None, :]) ** 2 * weights).sum(axis=-2) / (
+            chains[..., None] - 1
+        )
+        n_bar = (n * valid).sum(axis=-1) / chains
+        V = (n_bar[..., None] - 1) / n_bar[..., None] * W + B_over_n
+        R = np.sqrt(V / W)
+    return np.where(chains[..., None] >= 2, R, np.nan)
+
+
+def autocorrelation_time(x, n):
+    """
+    Integrated autocorrelation time of every row of x.
+
+    x holds one centered series per row, zero-padded to equal length, with
+    n valid values each. Autocorrelations of all rows come from one FFT
+    and are summed up to the first negative pair (Geyer's initial positive
+    sequence).
+    """
+    length = x.shape[-1]
+    size = 1 << int(2 * length - 1).bit_length()
+    f = np.fft.rfft(x, n=size, axis=-1)
+    acov = np.fft.irfft(f * np.conj(f), n=size, axis=-1)[..., :length]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rho = acov / acov[..., :1]
+
+    # Sums of adjacent lag pairs, kept while they stay positive
+    pairs = length // 2
+    P = rho[..., 0 : 2 * pairs : 2] + rho[..., 1 : 2 * pairs : 2]
+    lags = np.arange(pairs)
+    P = np.where(2 * lags + 1 < n[..., None], P, -1)
+    keep = np.cumprod(P > 0, axis=-1, dtype=bool)
+    tau = -1 + 2 * np.where(keep, P, 0).sum(axis=-1)
+    return np.maximum(tau, 1)
+
+
+class TraceDiagnostics:
+    """
+    Convergence diagnostics in MDS space for the groups of a GroupIndex.
+
+    Cumulative sums of every MDS column and of its square are computed once
+    over the sorted index rows, so the mean and variance of any group in any
+    treenum window are two lookups. Moving the window only costs a binary
+    search per group, and many windows are evaluated in one vectorized pass.
+    """
+
+    def __init__(self, index, columns):
+        self.index = index
+        self.columns = list(columns)
+        self.groups = index.groups
+
+        # Center the columns so the variances keep their precision
+        values = np.column_stack(
+            [index.df[col].to_numpy(dtype=np.float64) for col in self.columns]
+        )
+        values -= values.mean(axis=0)
+        zero = np.zeros((1, len(self.columns)))
+        self.sums = np.concatenate([zero, np.cumsum(values, axis=0)])
+        self.squares = np.concatenate([zero, np.cumsum(values**2, axis=0)])
+
+        # Rows are sorted by (group, treenum), so this key is sorted too
+        counts = np.diff(index.offsets)
+        self.span = int(index.treenum.max(initial=0)) + 2
+        self.keys = (
+            np.repeat(np.arange(len(self.groups), dtype=np.int64), counts) * self.span
+            + index.treenum
+        )
+
+    def memory_usage(self):
+        return self.sums.nbytes + self.squares.nbytes + self.keys.nbytes
+
+    def bounds(self, lo, hi):
+        """
+        Start and end rows of every group in the treenum windows lo..hi.
+        lo and hi may be arrays of windows; the group axis is added last.
+        """
+        base = np.arange(len(self.groups), dtype=np.int64) * self.span
+        lo = np.clip(np.asarray(lo, dtype=np.int64), 0, self.span - 1)[..., None]
+        hi = np.clip(np.asarray(hi, dtype=np.int64), -1, self.span - 1)[..., None]
+        start = np.searchsorted(self.keys, base + lo, side="left")
+        end = np.searchsorted(self.keys, base + hi, side="right")
+        return start, np.maximum(end, start)
+
+    def moments(self, start, end):
+        """
+        Row count, mean and sample variance of every axis between start and end.
+        """
+        n = end - start
+        total = self.sums[end] - self.sums[start]
+        squares = self.squares[end] - self.squares[start]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = total / n[..., None]
+            var = (squares - total * mean) / (n[..., None] - 1)
+        return n, mean, np.maximum(var, 0)
+
+    def window(self, lo, hi):
+        return self.moments(*self.bounds(lo, hi))
+
+    def psrf(self, lo, hi):
+        """
+        PSRF of every axis in the treenum window lo..hi.
+        """
+        return psrf(*self.window(lo, hi))
+
+    def psrf_series(self, lo, hi, windows=DEFAULT_WINDOWS, width=None):
+        """
+        PSRF of every axis over sliding windows ending at evenly spaced
+        treenums of lo..hi. Returns the window ends and a (windows, axes)
+        array.
+        """
+        if width is None:
+            width = max(1, int((hi - lo + 1) * WINDOW_FRACTION))
+        ends = np.unique(np.linspace(min(lo + width - 1, hi), hi, windows).astype(np.int64))
+        return ends, psrf(*self.window(ends - width + 1, ends))
+
+    def drift(self, lo, hi):
+        """
+        Distance between the centroids of the first and second half of the
+        window, per group, relative to the spread of the whole window.
+        """
+        mid = (lo + hi) // 2
+        _, first, _ = self.window(lo, mid)
+        _, second, _ = self.window(mid + 1, hi)
+        _, _, var = self.window(lo, hi)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.sqrt(((second - first) ** 2).sum(axis=-1) / var.sum(axis=-1))
+
+    def ess(self, lo, hi):
+        """
+        Effective sample size of every group along every axis in the window,
+        as a (groups, axes) array, from the autocorrelation of the rows.
+
+        Groups with more than ESS_BLOCKS rows are cut into ESS_BLOCKS
+        equal blocks, whose means come from the cumulative sums, and the
+        autocorrelation of the block means is used instead. This keeps the
+        cost of a window independent of its length: with one row per block
+        it is the plain estimator, and as long as blocks are shorter than
+        the autocorrelation time they lose little. Longer blocks average
+        out the short-range correlation, which then shows up as a smaller
+        variance of the block means rather than in their autocorrelation,
+        so the estimate stays close to n / tau but is noisier.
+        """
+        start, end = self.bounds(lo, hi)
+        n, _, var = self.moments(start, end)
+        step = np.maximum(-(-n // ESS_BLOCKS), 1)
+        blocks = n // step
+
+        # Block edges of every group; blocks past a group's count are masked
+        k = np.arange(ESS_BLOCKS + 1)
+        edges = np.minimum(start[:, None] + k * step[:, None], end[:, None])
+        valid = (k[1:] <= blocks[:, None])[..., None]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            sums = self.sums[edges[:, 1:]] - self.sums[edges[:, :-1]]
+            means = sums / step[:, None, None]
+            grand = means.sum(axis=1, where=valid) / blocks[:, None]
+            centered = np.where(valid, means - grand[:, None, :], 0)
+            block_var = (centered**2).sum(axis=1) / (blocks[:, None] - 1)
+            tau = autocorrelation_time(centered.transpose(0, 2, 1), blocks[:, None])
+
+            # Variance of the window mean is block_var * tau / blocks
+            ess = np.minimum(var * blocks[:, None] / (block_var * tau), n[:, None])
+        return np.where(blocks[:, None] >= 2, ess, np.nan)
+
+    def summary(self, lo, hi):
+        """
+        Diagnostics of the window lo..hi as plain lists for display.
+        """
+        n, _, _ = self.window(lo, hi)
+        ends, series = self.psrf_series(lo, hi)
+        return {
+            "columns": self.columns,
+            "groups": [str(g) for g in self.groups],
+            "rows": n.tolist(),
+            "psrf": self.psrf(lo, hi).tolist(),
+            "drift": self.drift(lo, hi).tolist(),
+            "ess": self.ess(lo, hi).tolist(),
+            "series_treenum": ends.tolist(),
+            "series_psrf": series.max(axis=-1, initial=-np.inf).tolist(),
+        }
@@ -0,0 +1,150 @@
+import numpy as np
+import pandas as pd
+
+from .loader import concat_traces
+from .spatial import SpatialIndex
+
+
+def row_codes(df, columns):
+    """
+    Integer code of every row of df, equal for rows with identical values
+    in columns. Rows are compared by a 64-bit hash of their values.
+    """
+    hashes = pd.util.hash_pandas_object(df[list(columns)], index=False)
+    return pd.factorize(hashes.to_numpy())[0]
+
+
+class GroupIndex:
+    """
+    Trace rows reordered into one contiguous block per group, sorted by treenum.
+
+    The frame is sorted once when the index is built. Selecting a group and
+    a treenum range is then a binary search inside the group's block and a
+    positional slice of the sorted frame, instead of boolean scans over all
+    rows. A frame that is already in index order, such as the df of an
+    earlier index, can be passed with presorted=True to skip the copy.
+    """
+
+    def __init__(self, df, presorted=False):
+        codes, groups = pd.factorize(df["group"])
+        if presorted:
+            self.df = df
+        else:
+            order = np.lexsort((df["treenum"].to_numpy(), codes))
+            self.df = df.iloc[order].reset_index(drop=True)
+        self.treenum = self.df["treenum"].to_numpy()
+        self.groups = np.asarray(groups)
+        self.positions = {gr: i for i, gr in enumerate(self.groups)}
+
+        counts = np.bincount(codes, minlength=len(self.groups))
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+        self._point_codes = {}
+        self._spatial = {}
+        self._frame_bytes = None
+
+    def __len__(self):
+        return len(self.df)
+
+    def extend(self, df):
+        """
+        New index with the rows of df added to the blocks of their groups.
+
+        Only the new rows are sorted. Each is placed after the rows of its
+        group with a treenum up to its own, found by a binary search in the
+        group's block, and groups not in the index get blocks at the end.
+        The merged frame is then one concatenation of slices, with no full sort.
+        """
+        codes, groups = pd.factorize(df["group"])
+        known = pd.Index(self.groups).get_indexer(groups)
+        unseen = known < 0
+        known[unseen] = len(self.groups) + np.arange(unseen.sum())
+        codes = known[codes]
+        treenum = df["treenum"].to_numpy()
+        order = np.lexsort((treenum, codes))
+        codes, treenum = codes[order], treenum[order]
+
+        # Insertion row of every new row in the current frame
+        inserts = np.full(len(df), len(self.df), dtype=np.int64)
+        for i in np.unique(codes[codes < len(self.groups)]):
+            lo, hi = np.searchsorted(codes, [i, i + 1])
+            start, end = self.offsets[i], self.offsets[i + 1]
+            inserts[lo:hi] = start + np.searchsorted(
+                self.treenum[start:end], treenum[lo:hi], side="right"
+            )
+
+        # Splice the new rows between slices of the current frame
+        df = df.iloc[order]
+        cuts = np.unique(inserts)
+        firsts = np.searchsorted(inserts, cuts, side="left")
+        lasts = np.searchsorted(inserts, cuts, side="right")
+        pieces = []
+        previous = 0
+        for cut, first, last in zip(cuts, firsts, lasts):
+            pieces += [self.df.iloc[previous:cut], df.iloc[first:last]]
+            previous = cut
+        pieces.append(self.df.iloc[previous:])
+        merged = concat_traces(pieces)
+        return GroupIndex(merged, presorted=True)
+
+    def bounds(self, gr, treenum_range=None):
+        """
+        Start and end row of group gr, limited to treenum_range if given.
+        """
+        i = self.positions[gr]
+        start, end = self.offsets[i], self.offsets[i + 1]
+        if treenum_range is not None:
+            block = self.treenum[start:end]
+            lo, hi = treenum_range
+            start, end = (
+                start + np.searchsorted(block, lo, side="left"),
+                start + np.searchsorted(block, hi, side="right"),
+            )
+        return start, end
+
+    def memory_usage(self):
+        """
+        Bytes held by the sorted frame and the point codes and spatial
+        indexes built on it.
+        """
+        if self._frame_bytes is None:
+            self._frame_bytes = int(self.df.memory_usage(deep=True, index=True).sum())
+        return (
+            self._frame_bytes
+            + sum(codes.nbytes for codes in self._point_codes.values())
+            + sum(spatial.memory_usage() for spatial in self._spatial.values())
+        )
+
+    def point_codes(self, columns):
+        """
+        row_codes of the sorted frame for columns, computed once per set of
+        columns so that any treenum window is a slice of them.
+        """
+        key = tuple(columns)
+        if key not in self._point_codes:
+            self._point_codes[key] = row_codes(self.df, key)
+        return self._point_codes[key]
+
+    def spatial_index(self, columns):
+        """
+        SpatialIndex of the sorted frame over columns, built on first use.
+        """
+        key = tuple(columns)
+        if key not in self._spatial:
+            self._spatial[key] = SpatialIndex(self.df[list(key)].to_numpy())
+        return self._spatial[key]
+
+    def group_frame(self, gr, treenum_range=None):
+        start, end = self.bounds(gr, treenum_range)
+        return self.df.iloc[start:end]
+
+    def group_frames(self, GROUPS, treenum_range=None):
+        """
+        One frame per group in GROUPS; groups not in the index are empty.
+        """
+        frames = []
+        for gr in GROUPS:
+            if gr in self.positions:
+                frames.append(self.group_frame(gr, treenum_range))
+            else:
+                frames.append(self.df.iloc[0:0])
+        return frames
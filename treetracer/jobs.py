@@ -0,0 +1,20 @@
+import os
+
+from dash import DiskcacheManager
+
+from .cache import DEFAULT_CACHE_DIR
+
+
+# Where progress and results of background jobs are kept
+DEFAULT_JOBS_DIR = os.path.join(DEFAULT_CACHE_DIR, "jobs")
+
+
+def job_manager(directory=DEFAULT_JOBS_DIR):
+    """
+    Background callback manager running every job in its own local process,
+    with progress and results kept in a disk cache that several server
+    workers can share.
+    """
+    import diskcache
+
+    return DiskcacheManager(diskcache.Cache(directory))
@@ -0,0 +1,307 @@
+import binascii
+import bz2
+import gzip
+import io
+import mmap
+import os
+
+import numpy as np
+import pandas as pd
+
+from .cache import content_key
+
+
+# Extensions accepted as trace tables, plain or compressed
+TRACE_EXTENSIONS = (".tsv", ".tsv.gz", ".tsv.bz2", ".tsv.zst")
+
+# Leading bytes of the compressed formats read by read_trace
+COMPRESSION_MAGIC = {
+    b"\x1f\x8b": "gzip",
+    b"BZh": "bz2",
+    b"\x28\xb5\x2f\xfd": "zstd",
+}
+
+# Base64 characters decoded per step; a multiple of 4 so chunks stay aligned
+DECODE_CHUNK = 1 << 20
+
+# Bytes decompressed per read while a compressed trace is parsed
+STREAM_CHUNK = 1 << 20
+
+
+def csv_engine(engine="auto"):
+    """
+    Resolve the pandas CSV engine, preferring pyarrow when it is installed.
+    """
+    if engine != "auto":
+        return engine
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return "c"
+    return "pyarrow"
+
+
+class BufferReader(io.RawIOBase):
+    """
+    Read-only binary file object over a bytes-like buffer.
+
+    Unlike io.BytesIO it never copies the underlying buffer, so parsers
+    only ever hold one chunk of it at a time.
+    """
+
+    def __init__(self, buffer):
+        self._view = memoryview(buffer).cast("B")
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), len(self._view) - self._pos)
+        b[:n] = self._view[self._pos : self._pos + n]
+        self._pos += n
+        return n
+
+    def close(self):
+        # Release the buffer export so that mmaps can be closed afterwards
+        self._view.release()
+        super().close()
+
+
+def decode_upload(content):
+    """
+    Decode a dcc.Upload data URL into a bytearray.
+
+    The payload is decoded chunk by chunk straight into the output buffer,
+    so no full-size intermediate bytes or str copies are created.
+    """
+    start = content.index(",") + 1
+    length = len(content) - start
+    # Base64 pads with at most two '='; rstrip would copy the whole payload
+    padding = content[-2:].count("=")
+    out = bytearray(length // 4 * 3 - padding)
+    view = memoryview(out)
+
+    pos = 0
+    for i in range(start, len(content), DECODE_CHUNK):
+        block = binascii.a2b_base64(content[i : i + DECODE_CHUNK])
+        view[pos : pos + len(block)] = block
+        pos += len(block)
+    return out
+
+
+def is_trace_file(filename):
+    return filename.lower().endswith(TRACE_EXTENSIONS)
+
+
+def is_compressed_file(filename):
+    return is_trace_file(filename) and not filename.lower().endswith(".tsv")
+
+
+def compression_of(buffer):
+    """
+    Compression format of a buffer from its leading bytes, or None.
+    """
+    head = bytes(buffer[:4])
+    for magic, name in COMPRESSION_MAGIC.items():
+        if head.startswith(magic):
+            return name
+    return None
+
+
+def decompressed_reader(raw, compression):
+    """
+    Binary file object decompressing the raw file object as it is read.
+    """
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=raw, mode="rb")
+    if compression == "bz2":
+        return bz2.BZ2File(raw, mode="rb")
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError(
+            "Reading .zst traces needs the zstandard package "
+            "(pip install 'treetracer[zstd]')."
+        ) from None
+    return zstandard.ZstdDecompressor().stream_reader(raw)
+
+
+def header_columns(buffer):
+    """
+    Column names from the first line of a TSV buffer.
+    """
+    end = buffer.find(b"\n")
+    line = bytes(buffer[: end if end >= 0 else len(buffer)])
+    return line.decode("utf-8").rstrip("\r").split("\t")
+
+
+def is_mds_column(name):
+    return "V" in name or "MDS" in name
+
+
+def trace_dtypes(columns):
+    dtypes = {c: np.float32 for c in columns if is_mds_column(c)}
+    if "group" in columns:
+        dtypes["group"] = "category"
+    return dtypes
+
+
+def normalize_trace(df):
+    """
+    Rename V* columns to MDS* and add the group code and tree number columns.
+    """
+    df.columns = [x.replace("V", "MDS") for x in df.columns]
+    for col in df.columns:
+        if "MDS" in col:
+            df[col] = df[col].astype(np.float32)
+    if not isinstance(df["group"].dtype, pd.CategoricalDtype):
+        df["group"] = df["group"].astype(str).astype("category")
+
+    # categorical group, numbered in order of appearance
+    df["group_col"] = pd.factorize(df["group"])[0].astype(np.int32)
+
+    # Renumber trees
+    treenum = (
+        df.groupby("group", observed=True, sort=False)
+        .cumcount()
+        .to_numpy(dtype=np.int32)
+    )
+    treenum += 1
+    df["treenum"] = treenum
+    df["size"] = np.full(len(df), 6, dtype=np.int8)
+    return df
+
+
+def concat_traces(frames):
+    """
+    Concatenate trace frames keeping categorical columns categorical.
+    """
+    frames = list(frames)
+    for col in frames[0].columns:
+        if not all(
+            isinstance(f[col].dtype, pd.CategoricalDtype) for f in frames if col in f
+        ):
+            continue
+        categories = pd.Index(
+            np.concatenate([f[col].cat.categories.to_numpy() for f in frames])
+        ).unique()
+        frames = [
+            f.assign(**{col: f[col].cat.set_categories(categories)}) for f in frames
+        ]
+    return pd.concat(frames, ignore_index=True)
+
+
+def set_file(df, filename):
+    """
+    Tag every row of df with filename as a single-category column.
+    """
+    df["file"] = pd.Categorical.from_codes(
+        np.zeros(len(df), dtype=np.int8), categories=[filename]
+    )
+    return df
+
+
+def read_trace(buffer, engine="auto"):
+    """
+    Parse a trace TSV held in a bytes-like buffer into a normalized DataFrame.
+    gzip, bz2 and zstd compressed buffers are decompressed as a stream while
+    the parser reads them, so the uncompressed text is never held in full.
+    """
+    compression = compression_of(buffer)
+    if compression is None:
+        columns = header_columns(buffer)
+        with BufferReader(buffer) as reader:
+            df = pd.read_csv(
+                reader,
+                sep="\t",
+                dtype=trace_dtypes(columns),
+                engine=csv_engine(engine),
+            )
+        return normalize_trace(df)
+
+    with BufferReader(buffer) as raw:
+        with decompressed_reader(raw, compression) as reader:
+            reader = io.BufferedReader(reader, STREAM_CHUNK)
+            columns = header_columns(reader.readline())
+            df = pd.read_csv(
+                reader,
+                sep="\t",
+                header=None,
+                names=columns,
+                dtype=trace_dtypes(columns),
+                engine=csv_engine(engine),
+            )
+    return normalize_trace(df)
+
+
+def load_buffer(buffer, cache=None, engine="auto"):
+    """
+    Parse buffer, or fetch its normalized frame from cache.
+    Returns the DataFrame and the content hash of buffer.
+    """
+    key = content_key(buffer)
+    df = cache.get(key) if cache is not None else None
+    if df is None:
+        df = read_trace(buffer, engine)
+        if cache is not None:
+            cache.put(key, df)
+    return df, key
+
+
+def complete_length(buffer):
+    """
+    Length of buffer up to and including its last newline, or the whole
+    buffer if it has none.
+    """
+    end = buffer.rfind(b"\n") + 1
+    return end if end > 0 else len(buffer)
+
+
+def load_path(path, cache=None, engine="auto"):
+    """
+    Memory-map the TSV at path, compressed or not, and load it like an
+    upload. A plain TSV may still be written, so only its complete lines
+    are parsed. Returns the DataFrame, its content hash and the number of
+    bytes of the file that were read.
+    """
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            if compression_of(buffer) is not None:
+                return (*load_buffer(buffer, cache, engine), len(buffer))
+            end = complete_length(buffer)
+            if end == len(buffer):
+                return (*load_buffer(buffer, cache, engine), end)
+        # Map the complete lines only, leaving the row being written out
+        with mmap.mmap(f.fileno(), end, access=mmap.ACCESS_READ) as buffer:
+            return (*load_buffer(buffer, cache, engine), end)
+
+
+def list_trace_files(path, extensions=TRACE_EXTENSIONS):
+    """
+    Trace files found at path, which may be a file or a directory.
+    """
+    path = os.path.expanduser(path)
+    if os.path.isdir(path):
+        return sorted(
+            os.path.join(path, name)
+            for name in os.listdir(path)
+            if name.lower().endswith(extensions)
+        )
+    return [path]
+
+
+def trace_metadata(df, filename, date, key):
+    """
+    File metadata stored in uploaded-files-storage for a loaded trace.
+    """
+    return {
+        "filename": filename,
+        "date": date,
+        "hash": key,
+        "rows": len(df),
+        "dimensions": sorted([x for x in df.columns if "MDS" in x]),
+        "groups": df["group"].unique().tolist(),
+        "MIN_TREENUM": int(df["treenum"].min()),
+        "MAX_TREENUM": int(df["treenum"].max()),
+    }
@@ -0,0 +1,64 @@
+import numpy as np
+
+
+# Number of MDS coordinates computed for tree files
+DEFAULT_DIMENSIONS = 4
+
+
+def classical_mds(D, k=DEFAULT_DIMENSIONS):
+    """
+    Classical (Torgerson) MDS of a square distance matrix D into k dimensions.
+    """
+    D = np.asarray(D, dtype=np.float64)
+    n = len(D)
+    D2 = D**2
+
+    # Double centering of the squared distances
+    row_mean = D2.mean(axis=1)
+    B = -0.5 * (D2 - row_mean[:, None] - row_mean[None, :] + row_mean.mean())
+
+    eigvals, eigvecs = np.linalg.eigh(B)
+    top = np.argsort(eigvals)[::-1][:k]
+    scale = np.sqrt(np.clip(eigvals[top], 0, None))
+    coords = eigvecs[:, top] * scale
+
+    # Pad if there are fewer points than requested dimensions
+    if coords.shape[1] < k:
+        coords = np.hstack([coords, np.zeros((n, k - coords.shape[1]))])
+    return coords
+
+
+class LandmarkMDS:
+    """
+    Landmark MDS (de Silva and Tenenbaum) for samples too large for a full
+    distance matrix.
+
+    Landmarks are embedded with classical MDS; every other point is placed
+    by distance-based triangulation from its distances to the landmarks
+    alone, so points can be embedded in chunks of any size.
+    """
+
+    def __init__(self, landmark_D, k=DEFAULT_DIMENSIONS):
+        D2 = np.asarray(landmark_D, dtype=np.float64) ** 2
+        self.k = k
+        self.mean = D2.mean(axis=0)
+
+        row_mean = D2.mean(axis=1)
+        B = -0.5 * (D2 - row_mean[:, None] - row_mean[None, :] + row_mean.mean())
+        eigvals, eigvecs = np.linalg.eigh(B)
+        top = np.argsort(eigvals)[::-1][:k]
+        eigvals = eigvals[top]
+        positive = eigvals > 1e-9 * max(eigvals.max(initial=0), 1)
+
+        # Pseudo-inverse of the landmark coordinates
+        self.pinv = np.zeros((len(D2), k))
+        self.pinv[:, : positive.sum()] = eigvecs[:, top][:, positive] / np.sqrt(
+            eigvals[positive]
+        )
+
+    def transform(self, D):
+        """
+        Coordinates of points from their distances D to the landmarks.
+        """
+        D2 = np.asarray(D, dtype=np.float64) ** 2
+        return -0.5 * (D2 - self.mean) @ self.pinv
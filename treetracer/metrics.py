@@ -0,0 +1,237 @@
+import cProfile
+import functools
+import os
+import re
+import resource
+import sys
+import threading
+import time
+
+from flask import Response, g, request
+
+
+# Upper bounds of the histogram buckets
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTES_BUCKETS = tuple(10**k for k in range(2, 11))
+
+# Requests slower than this are profiled when a profile directory is set
+DEFAULT_SLOW_SECONDS = 1.0
+
+CALLBACK_PATH = "/_dash-update-component"
+
+
+def process_rss():
+    """
+    Resident set size of this process in bytes (peak RSS if unavailable).
+    """
+    try:
+        import psutil
+    except ImportError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        return peak if sys.platform == "darwin" else peak * 1024
+    return psutil.Process().memory_info().rss
+
+
+class Histogram:
+    """
+    Prometheus histogram with one series per callback name.
+    """
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, label, value):
+        # Per label: cumulative bucket counts, sum and count
+        series = self.series.setdefault(label, [[0] * len(self.buckets), 0.0, 0])
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][i] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label, (counts, total, count) in sorted(self.series.items()):
+            tag = f'callback="{label}"'
+            for bound, n in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{{{tag},le="{bound:g}"}} {n}')
+            lines.append(f'{self.name}_bucket{{{tag},le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{tag}}} {total:.6g}")
+            lines.append(f"{self.name}_count{{{tag}}} {count}")
+        return lines
+
+
+class CallbackMetrics:
+    """
+    Timing and payload sizes of the Dash callbacks of one app.
+
+    Callback functions are timed by wrapping the callback decorator; whole
+    requests, including JSON serialization, are measured by hooks on the
+    Flask server, which also serves the results in Prometheus text format
+    on /metrics. With a profile directory every callback request is run
+    under cProfile and the statistics of slow ones are written there.
+    """
+
+    def __init__(self, profile_dir=None, slow_seconds=DEFAULT_SLOW_SECONDS):
+        self.profile_dir = profile_dir
+        self.slow_seconds = slow_seconds
+        self.request_seconds = Histogram(
+            "treetracer_request_seconds",
+            "Wall time of callback requests, including serialization.",
+            SECONDS_BUCKETS,
+        )
+        self.callback_seconds = Histogram(
+            "treetracer_callback_seconds",
+            "Wall time spent inside callback functions.",
+            SECONDS_BUCKETS,
+        )
+        self.request_bytes = Histogram(
+            "treetracer_request_bytes",
+            "Size of the callback inputs sent by the browser.",
+            BYTES_BUCKETS,
+        )
+        self.response_bytes = Histogram(
+            "treetracer_response_bytes",
+            "Size of the serialized callback responses.",
+            BYTES_BUCKETS,
+        )
+        self.rss = {}
+        # FigureCache whose hits and misses are reported, if any
+        self.figure_cache = None
+        self._names = {}
+        self._lock = threading.Lock()
+
+    def instrument(self, register):
+        """
+        Wrap a Dash callback decorator so that registered functions are timed.
+        """
+
+        @functools.wraps(register)
+        def decorator(*args, **kwargs):
+            wrap = register(*args, **kwargs)
+            return lambda func: wrap(self.timed(func))
+
+        return decorator
+
+    def timed(self, func):
+        @functools.wraps(func)
+        def run(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.callback_seconds.observe(
+                        func.__name__, time.perf_counter() - start
+                    )
+
+        return run
+
+    def _callback_name(self, app, output):
+        # Outputs in the request are mapped to the callback function names
+        if output not in self._names:
+            entry = app.callback_map.get(output, {})
+            self._names[output] = getattr(entry.get("callback"), "__name__", output)
+        return self._names[output]
+
+    def install(self, app):
+        """
+        Add the request hooks and the /metrics route to the app's server.
+        """
+        server = app.server
+
+        @server.before_request
+        def start_request():
+            if request.path.endswith(CALLBACK_PATH):
+                g.metrics_start = time.perf_counter()
+                g.metrics_profile = None
+                if self.profile_dir:
+                    profile = cProfile.Profile()
+                    try:
+                        profile.enable()
+                    except ValueError:
+                        # Another profiler is running in this process
+                        profile = None
+                    g.metrics_profile = profile
+
+        @server.after_request
+        def end_request(response):
+            start = g.pop("metrics_start", None)
+            if start is None:
+                return response
+            seconds = time.perf_counter() - start
+            profile = g.pop("metrics_profile", None)
+            if profile is not None:
+                profile.disable()
+
+            body = request.get_json(silent=True) or {}
+            name = self._callback_name(app, body.get("output", "unknown"))
+            size = response.content_length
+            if size is None and not response.is_streamed:
+                size = len(response.get_data())
+            with self._lock:
+                self.request_seconds.observe(name, seconds)
+                self.request_bytes.observe(name, request.content_length or 0)
+                if size is not None:
+                    self.response_bytes.observe(name, size)
+                self.rss[name] = process_rss()
+
+            if profile is not None and seconds >= self.slow_seconds:
+                self.dump_profile(profile, name, seconds)
+            return response
+
+        server.add_url_rule("/metrics", "metrics", self.metrics_response)
+
+    def dump_profile(self, profile, name, seconds):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        safe_name = re.sub(r"[^\w.-]", "_", name)
+        path = os.path.join(
+            self.profile_dir, f"{stamp}-{safe_name}-{seconds * 1000:.0f}ms.prof"
+        )
+        profile.dump_stats(path)
+
+    def render(self):
+        """
+        All metrics in Prometheus text exposition format.
+        """
+        with self._lock:
+            lines = []
+            for histogram in [
+                self.request_seconds,
+                self.callback_seconds,
+                self.request_bytes,
+                self.response_bytes,
+            ]:
+                lines.extend(histogram.render())
+            lines.append(
+                "# HELP treetracer_callback_rss_bytes Process RSS after the last call of a callback."
+            )
+            lines.append("# TYPE treetracer_callback_rss_bytes gauge")
+            for name, rss in sorted(self.rss.items()):
+                lines.append(f'treetracer_callback_rss_bytes{{callback="{name}"}} {rss}')
+        if self.figure_cache is not None:
+            stats = self.figure_cache.stats()
+            for name, kind, help_text in [
+                ("hits", "counter", "Lookups answered by the figure cache."),
+                ("misses", "counter", "Lookups the figure cache could not answer."),
+                ("entries", "gauge", "Frames and figures held by the figure cache."),
+                ("bytes", "gauge", "Size of the frames and figures in the figure cache."),
+            ]:
+                metric = f"treetracer_figure_cache_{name}" + (
+                    "_total" if kind == "counter" else ""
+                )
+                lines.append(f"# HELP {metric} {help_text}")
+                lines.append(f"# TYPE {metric} {kind}")
+                lines.append(f"{metric} {stats[name]}")
+        lines.append("# HELP treetracer_process_rss_bytes Resident set size of the process.")
+        lines.append("# TYPE treetracer_process_rss_bytes gauge")
+        lines.append(f"treetracer_process_rss_bytes {process_rss()}")
+        return "\n".join(lines) + "\n"
+
+    def metrics_response(self):
+        return Response(self.render(), mimetype="text/plain; version=0.0.4")
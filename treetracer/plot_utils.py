@@ -1,6 +1,145 @@
+import base64
+
+import numpy as np
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 
+from .index import row_codes
+
+# Maximum number of rows drawn per figure before groups are downsampled
+DEFAULT_MAX_POINTS = 200_000
+RENDER_MODES = ["webgl", "svg", "density"]
+SAMPLING_METHODS = ["stratified", "density"]
+
+# Bins per axis of the 2D histograms drawn by the density render mode
+DENSITY_BINS = 100
+
+# Points of the 3D panel drawn next to density panels
+DENSITY_3D_POINTS = 20_000
+
+# Marker sizes of the 3D and 2D panels. Merged points grow with the log of
+# the number of trees they stand for, up to MAX_MARKER_SIZE.
+MARKER_SIZE_3D = 4
+MARKER_SIZE_2D = 6
+MAX_MARKER_SIZE = 24
+
+# Columns added to the rows of merged points
+AGGREGATE_COLUMNS = ["count", "first_treenum", "last_treenum"]
+
+# Plotly's Dark24 qualitative palette, spelled out so that plotly.express
+# is never imported just to read it
+GROUP_PALETTE = [
+    "#2E91E5", "#E15F99", "#1CA71C", "#FB0D0D", "#DA16FF", "#222A2A",
+    "#B68100", "#750D86", "#EB663B", "#511CFB", "#00A08B", "#FB00D1",
+    "#FC0080", "#B2828D", "#6C7C32", "#778AAE", "#862A16", "#A777F1",
+    "#620042", "#1616A7", "#DA60CA", "#6C4516", "#0D2A63", "#AF0038",
+]  # fmt: skip
+
+
+# numpy dtypes plotly.js decodes from typed array specs
+TYPED_ARRAY_DTYPES = {
+    "float64": "f8",
+    "float32": "f4",
+    "int32": "i4",
+    "uint32": "u4",
+    "int16": "i2",
+    "uint16": "u2",
+    "int8": "i1",
+    "uint8": "u1",
+}
+
+
+def typed_array(values):
+    """
+    Plotly.js typed array spec of a numeric array: its raw bytes in base64,
+    which is a fraction of the size of JSON numbers and is decoded by the
+    browser without parsing. Floats are sent as float32, plenty for plotting;
+    64-bit integers as int32 when they fit. Works inside Patches too, which
+    Dash otherwise serializes as plain lists.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind == "f":
+        values = values.astype(np.float32, copy=False)
+    elif values.dtype.name not in TYPED_ARRAY_DTYPES:
+        info = np.iinfo(np.int32)
+        fits = values.size == 0 or (values.min() >= info.min and values.max() <= info.max)
+        values = values.astype(np.int32 if fits else np.float64)
+    values = np.ascontiguousarray(values)
+    spec = {
+        "dtype": TYPED_ARRAY_DTYPES[values.dtype.name],
+        "bdata": base64.b64encode(values).decode("ascii"),
+    }
+    if values.ndim > 1:
+        spec["shape"] = ",".join(str(n) for n in values.shape)
+    return spec
+
+
+def encode_points(values, compact=True):
+    """
+    Point data of a trace as sent to the browser: a typed array in compact
+    mode, else a JSON list. Non-numeric values, e.g. string tree labels,
+    are always sent as a list, and scalars as they are.
+    """
+    values = np.asarray(values)
+    if values.ndim == 0:
+        return values.item()
+    if compact and values.dtype.kind in "fiu":
+        return typed_array(values)
+    return values.tolist()
+
+
+# Items of a plain list measured to estimate the size of the whole list
+SIZE_SAMPLE = 100
+
+
+def serialized_bytes(value):
+    """
+    Estimated size in bytes of a figure or dash Patch serialized to JSON.
+    Typed arrays count their base64 data and numpy arrays their bytes, and
+    long lists are extrapolated from their first items, so that a figure
+    is not serialized just to be measured.
+    """
+    if hasattr(value, "to_plotly_json"):
+        value = value.to_plotly_json()
+    if isinstance(value, dict):
+        return sum(len(str(k)) + 4 + serialized_bytes(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        sample = value[:SIZE_SAMPLE]
+        if not sample:
+            return 2
+        size = sum(serialized_bytes(v) + 1 for v in sample)
+        return size * len(value) // len(sample)
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, str):
+        return len(value) + 2
+    return len(str(value))
+
+
+# Hover label of scatter traces; customdata holds the tree of every point
+def scatter_hovertemplate(gr):
+    return f"{gr}<br>Tree: %{{customdata}}<extra></extra>"
+
+
+# Hover label of merged points; customdata holds the tree, the number of
+# trees and the first and last treenum of every point
+def aggregate_hovertemplate(gr):
+    return (
+        f"{gr}<br>Tree: %{{customdata[0]}}<br>%{{customdata[1]}} trees, "
+        f"treenum %{{customdata[2]}}-%{{customdata[3]}}<extra></extra>"
+    )
+
+
+def marker_size(counts, base):
+    """
+    Marker size of points standing for counts trees each, or base for
+    plain points when counts is None.
+    """
+    if counts is None:
+        return base
+    sizes = base * (1 + np.log10(np.maximum(counts, 1)))
+    return np.minimum(sizes, MAX_MARKER_SIZE).astype(np.float32)
+
 
 def make_plot_grid():
     f = make_subplots(
@@ -17,69 +156,394 @@ def make_plot_grid():
     return f
 
 
-def add_trace_multiplot(fig, df, x, y, z, GROUPS, COLOR_DICT):
+def split_point_budget(sizes, max_points):
+    """
+    Share max_points between groups proportionally to their sizes.
+    Every non-empty group keeps at least one point.
+    """
+    sizes = np.asarray(sizes, dtype=np.int64)
+    total = sizes.sum()
+    if not max_points or total <= max_points:
+        return sizes
+    budget = np.floor(sizes * (max_points / total)).astype(np.int64)
+    return np.minimum(np.maximum(budget, sizes > 0), sizes)
+
+
+def _stratified_sample(n, size):
+    # evenly spaced rows along the treenum order of the group
+    return np.unique(np.linspace(0, n - 1, size).round().astype(np.int64))
+
+
+def _density_sample(coords, size):
+    # keep a share of every occupied voxel so that sparse regions survive;
+    # the grid is sized so that occupied voxels stay well below the budget
+    n = len(coords)
+    bins = max(2, int((size / 8) ** (1 / 3)))
+    lo = coords.min(axis=0)
+    span = coords.max(axis=0) - lo
+    span[span == 0] = 1
+    cells = np.clip(((coords - lo) / span * bins).astype(np.int64), 0, bins - 1)
+    cell_id = (cells[:, 0] * bins + cells[:, 1]) * bins + cells[:, 2]
+
+    order = np.argsort(cell_id, kind="stable")
+    _, start, counts = np.unique(cell_id[order], return_index=True, return_counts=True)
+    quota = np.minimum(np.maximum(1, counts * size // n), counts)
+
+    rank = np.arange(n) - np.repeat(start, counts)
+    c = np.repeat(counts, counts)
+    q = np.repeat(quota, counts)
+    keep = (rank == 0) | ((rank * q) // c != ((rank - 1) * q) // c)
+    return np.sort(order[keep])
+
+
+def aggregate_points(codes, treenum):
+    """
+    Collapse rows with equal codes into one point each. Returns the position
+    of the first row of every point, in row order, and the number of rows
+    and the first and last treenum it stands for.
+    """
+    if len(codes) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, treenum[:0], treenum[:0]
+    order = np.argsort(codes, kind="stable")
+    sorted_codes = codes[order]
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    counts = np.diff(np.r_[starts, len(codes)])
+    values = treenum[order]
+    first = np.minimum.reduceat(values, starts)
+    last = np.maximum.reduceat(values, starts)
+    rows = order[starts]
+    keep = np.argsort(rows)
+    return rows[keep], counts[keep], first[keep], last[keep]
+
+
+def aggregate_frame(group_data, codes):
+    """
+    One row per distinct point of group_data, with AGGREGATE_COLUMNS added.
+    """
+    rows, counts, first, last = aggregate_points(
+        codes, group_data["treenum"].to_numpy()
+    )
+    return group_data.iloc[rows].assign(
+        **dict(zip(AGGREGATE_COLUMNS, [counts, first, last]))
+    )
+
+
+def downsample(group_data, size, x, y, z, method="stratified"):
+    """
+    Reduce group_data to about size rows, keeping the treenum order.
+    """
+    if len(group_data) <= size:
+        return group_data
+    if method == "density":
+        coords = group_data[[x, y, z]].to_numpy(dtype=np.float64)
+        idx = _density_sample(coords, size)
+    else:
+        idx = _stratified_sample(len(group_data), size)
+    return group_data.iloc[idx]
+
+
+def panel_columns(x, y, z):
+    """
+    Columns shown by the four traces of a group: 3D, x/y, x/z and y/z.
+    """
+    return [(x, y, z), (x, y), (x, z), (y, z)]
+
+
+# 2D axes of make_plot_grid, in panel order
+PANEL_AXES = [("xaxis", "yaxis"), ("xaxis2", "yaxis2"), ("xaxis3", "yaxis3")]
+
+
+def trace_multiplot_data(
+    df,
+    x,
+    y,
+    z,
+    GROUPS,
+    max_points=DEFAULT_MAX_POINTS,
+    sampling="stratified",
+    index=None,
+    treenum_range=None,
+    aggregate=False,
+):
+    """
+    Per-group data plotted by add_trace_multiplot, after downsampling.
+    If a GroupIndex is given, groups and the treenum range are sliced from
+    it and df is not scanned. With aggregate, rows of a group at the same
+    x, y and z are merged into one point first; "counts" then holds the
+    number of trees of every point and customdata their tree, count and
+    first and last treenum.
+    """
+    if index is not None:
+        group_frames = index.group_frames(GROUPS, treenum_range)
+    else:
+        if treenum_range is not None:
+            df = df[df["treenum"].between(*treenum_range)]
+        group_frames = [df[df["group"] == gr] for gr in GROUPS]
+    totals = [len(g) for g in group_frames]
+
+    if aggregate:
+        for i, gr in enumerate(GROUPS):
+            if index is not None and gr in index.positions:
+                # Codes are computed once per index; a window is a slice
+                start, end = index.bounds(gr, treenum_range)
+                codes = index.point_codes((x, y, z))[start:end]
+            else:
+                codes = row_codes(group_frames[i], (x, y, z))
+            group_frames[i] = aggregate_frame(group_frames[i], codes)
+    budget = split_point_budget([len(g) for g in group_frames], max_points)
+
+    groups = []
     for i, gr in enumerate(GROUPS):
-        group_data = df[df["group"] == gr]
+        total = totals[i]
+        group_data = downsample(group_frames[i], budget[i], x, y, z, sampling)
+        if len(group_data) < total:
+            name = f"{gr} ({len(group_data):,}/{total:,})"
+        else:
+            name = gr
+        customdata = group_data["tree"].to_numpy()
+        counts = None
+        if aggregate:
+            counts = group_data["count"].to_numpy()
+            customdata = np.column_stack(
+                [customdata, *(group_data[c].to_numpy() for c in AGGREGATE_COLUMNS)]
+            )
+        groups.append(
+            {
+                "group": gr,
+                "name": name,
+                "columns": {c: group_data[c].to_numpy() for c in {x, y, z}},
+                "customdata": customdata,
+                "counts": counts,
+            }
+        )
+    return groups
+
+
+def client_trace_data(
+    df,
+    columns,
+    GROUPS,
+    COLOR_DICT,
+    max_points=DEFAULT_MAX_POINTS,
+    sampling="stratified",
+    index=None,
+):
+    """
+    Rows of every group sent once to the browser for client-side filtering
+    (see assets/treetracer.js): treenum, tree and every MDS column in
+    columns as typed arrays. Rows stay in treenum order, so a treenum window
+    is a binary search and a slice of each group's arrays. Groups are
+    downsampled to max_points over the whole chain.
+    """
+    x, y, z = columns[:3]
+    if index is not None:
+        group_frames = index.group_frames(GROUPS)
+    else:
+        group_frames = [
+            df[df["group"] == gr].sort_values("treenum", kind="stable") for gr in GROUPS
+        ]
+    budget = split_point_budget([len(g) for g in group_frames], max_points)
+
+    groups = []
+    for i, gr in enumerate(GROUPS):
+        total = len(group_frames[i])
+        group_data = downsample(group_frames[i], budget[i], x, y, z, sampling)
+        if len(group_data) < total:
+            name = f"{gr} ({len(group_data):,}/{total:,})"
+        else:
+            name = str(gr)
+        groups.append(
+            {
+                "group": str(gr),
+                "name": name,
+                "color": COLOR_DICT[gr],
+                "treenum": typed_array(group_data["treenum"].to_numpy(dtype=np.int32)),
+                "tree": encode_points(group_data["tree"].to_numpy()),
+                "columns": {c: typed_array(group_data[c].to_numpy()) for c in columns},
+            }
+        )
+    return {"columns": list(columns), "groups": groups}
+
+
+def density_grid(xs, ys, x_range, y_range, bins=DENSITY_BINS):
+    """
+    Counts of the points inside x_range and y_range on a bins x bins grid,
+    one row per y bin.
+    """
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    (x0, x1), (y0, y1) = x_range, y_range
+    inside = (xs >= x0) & (xs <= x1) & (ys >= y0) & (ys <= y1)
+    xs, ys = xs[inside], ys[inside]
+    # Points on the upper edge fall into the last bin
+    ix = np.minimum(((xs - x0) * (bins / ((x1 - x0) or 1))).astype(np.int64), bins - 1)
+    iy = np.minimum(((ys - y0) * (bins / ((y1 - y0) or 1))).astype(np.int64), bins - 1)
+    return np.bincount(iy * bins + ix, minlength=bins * bins).reshape(bins, bins)
+
+
+def _bin_centers(value_range, bins):
+    lo, hi = value_range
+    step = ((hi - lo) or 1) / bins
+    return lo + step * (np.arange(bins) + 0.5)
+
+
+def trace_density_data(
+    df,
+    x,
+    y,
+    z,
+    GROUPS,
+    index=None,
+    treenum_range=None,
+    ranges=None,
+    bins=DENSITY_BINS,
+):
+    """
+    Per-panel 2D histograms of every group for the density render mode.
+
+    ranges maps 2D axis names (as in PANEL_AXES) to the [min, max] shown by
+    a zoomed panel; other axes span the full column. The size of the result
+    only depends on bins and the number of groups.
+    """
+    ranges = ranges or {}
+    if index is not None:
+        group_frames = index.group_frames(GROUPS, treenum_range)
+        df = index.df
+    else:
+        group_frames = [
+            df[(df["group"] == gr) & df["treenum"].between(*treenum_range)]
+            if treenum_range is not None
+            else df[df["group"] == gr]
+            for gr in GROUPS
+        ]
+
+    panels = []
+    for (xaxis, yaxis), (px, py) in zip(PANEL_AXES, panel_columns(x, y, z)[1:]):
+        x_range = ranges.get(xaxis) or [float(df[px].min()), float(df[px].max())]
+        y_range = ranges.get(yaxis) or [float(df[py].min()), float(df[py].max())]
+        panels.append(
+            {
+                "x": _bin_centers(x_range, bins),
+                "y": _bin_centers(y_range, bins),
+                "counts": [
+                    density_grid(g[px].to_numpy(), g[py].to_numpy(), x_range, y_range, bins)
+                    for g in group_frames
+                ],
+            }
+        )
+    return panels
+
+
+def density_trace_style(gr, color):
+    """
+    Properties that turn a 2D panel trace into line contours of one color.
+    """
+    return {
+        "type": "contour",
+        "mode": None,
+        "customdata": None,
+        "showscale": False,
+        "ncontours": 8,
+        "contours": {"coloring": "lines"},
+        "colorscale": [[0, color], [1, color]],
+        "line": {"width": 1},
+        "hovertemplate": f"{gr}<br>%{{z}} trees<extra></extra>",
+    }
+
+
+def add_trace_multiplot(
+    fig,
+    df,
+    x,
+    y,
+    z,
+    GROUPS,
+    COLOR_DICT,
+    render_mode="webgl",
+    max_points=DEFAULT_MAX_POINTS,
+    sampling="stratified",
+    index=None,
+    treenum_range=None,
+    compact=True,
+    aggregate=False,
+):
+    """
+    Add the 3D and 2D traces of every group to a figure from make_plot_grid.
+    With compact, point data is sent as base64 typed arrays (see
+    typed_array) instead of JSON lists. With aggregate, identical points are
+    drawn once, sized by the number of trees at them.
+    """
+    Scatter2d = go.Scattergl if render_mode == "webgl" else go.Scatter
+    panels = panel_columns(x, y, z)
+
+    if render_mode == "density":
+        max_points = min(max_points or DENSITY_3D_POINTS, DENSITY_3D_POINTS)
+        density = trace_density_data(df, x, y, z, GROUPS, index, treenum_range)
+    groups = trace_multiplot_data(
+        df, x, y, z, GROUPS, max_points, sampling, index, treenum_range, aggregate
+    )
+    for i, group in enumerate(groups):
+        gr = group["group"]
+        cols = {c: encode_points(v, compact) for c, v in group["columns"].items()}
+        customdata = encode_points(group["customdata"], compact)
+        counts = group["counts"]
+        hovertemplate = (aggregate_hovertemplate if aggregate else scatter_hovertemplate)(gr)
         fig.add_trace(
             go.Scatter3d(
-                x=group_data[x],
-                y=group_data[y],
-                z=group_data[z],
-                name=gr,
+                x=cols[x],
+                y=cols[y],
+                z=cols[z],
+                name=group["name"],
                 showlegend=True,
-                marker=dict(color=COLOR_DICT[gr], size=4),
+                marker=dict(
+                    color=COLOR_DICT[gr],
+                    size=encode_points(marker_size(counts, MARKER_SIZE_3D), compact),
+                ),
                 legendgroup=gr,
-                hovertemplate=f"{gr}<br>Tree: %{{customdata[0]}}<extra></extra>",
-                customdata=group_data[["tree"]].values,
+                hovertemplate=hovertemplate,
+                customdata=customdata,
             ),
             row=1,
             col=1,
         )  # scatter 3D
-        fig.add_trace(
-            go.Scatter(
-                x=group_data[x],
-                y=group_data[y],
-                mode="markers",
-                name=gr,
-                showlegend=False,  # Show legend for proper sync
-                marker=dict(color=COLOR_DICT[gr]),
-                legendgroup=gr,  # Add legend group for synchronization
-                hovertemplate=f"{gr}<br>Tree: %{{customdata[0]}}<extra></extra>",
-                customdata=group_data[["tree"]].values,
-            ),
-            row=1,
-            col=2,
-        )  # scatter 2D - 1
-        fig.add_trace(
-            go.Scatter(
-                x=group_data[x],
-                y=group_data[z],
-                mode="markers",
-                name=gr,
-                showlegend=False,  # Show legend for proper sync
-                marker=dict(color=COLOR_DICT[gr]),
-                legendgroup=gr,  # Add legend group for synchronization
-                hovertemplate=f"{gr}<br>Tree: %{{customdata[0]}}<extra></extra>",
-                customdata=group_data[["tree"]].values,
-            ),
-            row=2,
-            col=2,
-        )  # scatter 2D - 2
-        fig.add_trace(
-            go.Scatter(
-                x=group_data[y],
-                y=group_data[z],
-                mode="markers",
-                name=gr,
-                showlegend=False,  # Hide duplicate legends
-                marker=dict(color=COLOR_DICT[gr]),
-                legendgroup=gr,  # Add legend group
-                hovertemplate=f"{gr}<br>Tree: %{{customdata[0]}}<extra></extra>",
-                customdata=group_data[["tree"]].values,
-            ),
-            row=3,
-            col=2,
-        )
+        for row, (px, py) in enumerate(panels[1:], start=1):
+            if render_mode == "density":
+                panel = density[row - 1]
+                style = density_trace_style(gr, COLOR_DICT[gr])
+                del style["type"], style["mode"], style["customdata"]
+                fig.add_trace(
+                    go.Contour(
+                        x=panel["x"],
+                        y=panel["y"],
+                        z=panel["counts"][i],
+                        name=group["name"],
+                        showlegend=False,
+                        legendgroup=gr,
+                        **style,
+                    ),
+                    row=row,
+                    col=2,
+                )  # density 2D
+                continue
+            fig.add_trace(
+                Scatter2d(
+                    x=cols[px],
+                    y=cols[py],
+                    mode="markers",
+                    name=group["name"],
+                    showlegend=False,  # Hide duplicate legends
+                    marker=dict(
+                        color=COLOR_DICT[gr],
+                        size=encode_points(marker_size(counts, MARKER_SIZE_2D), compact),
+                    ),
+                    legendgroup=gr,  # Add legend group for synchronization
+                    hovertemplate=hovertemplate,
+                    customdata=customdata,
+                ),
+                row=row,
+                col=2,
+            )  # scatter 2D
 
     fig.update_layout(
         scene=dict(
@@ -98,11 +562,188 @@ def add_trace_multiplot(fig, df, x, y, z, GROUPS, COLOR_DICT):
         uirevision="constant",
     )
 
-    fig.update_xaxes(title_text=x, row=1, col=2)
-    fig.update_yaxes(title_text=y, row=1, col=2)
+    for row, (px, py) in enumerate(panels[1:], start=1):
+        fig.update_xaxes(title_text=px, row=row, col=2)
+        fig.update_yaxes(title_text=py, row=row, col=2)
+
+
+def patch_trace_multiplot(
+    patch,
+    df,
+    x,
+    y,
+    z,
+    GROUPS,
+    render_mode="webgl",
+    max_points=DEFAULT_MAX_POINTS,
+    sampling="stratified",
+    index=None,
+    treenum_range=None,
+    COLOR_DICT=None,
+    ranges=None,
+    compact=True,
+    aggregate=False,
+):
+    """
+    Update the traces of a figure built by add_trace_multiplot in a dash
+    Patch. Only point arrays, marker sizes, names and axis titles are sent;
+    trace styling and legend visibility stay as they are on the client. In
+    density mode the 2D panels are switched to contours colored from
+    COLOR_DICT. With compact, point arrays are sent as typed arrays.
+    """
+    panels = panel_columns(x, y, z)
+    scatter_type = "scattergl" if render_mode == "webgl" else "scatter"
+    if render_mode == "density":
+        max_points = min(max_points or DENSITY_3D_POINTS, DENSITY_3D_POINTS)
+
+    groups = trace_multiplot_data(
+        df, x, y, z, GROUPS, max_points, sampling, index, treenum_range, aggregate
+    )
+    for i, group in enumerate(groups):
+        gr = group["group"]
+        cols = {c: encode_points(v, compact) for c, v in group["columns"].items()}
+        customdata = encode_points(group["customdata"], compact)
+        counts = group["counts"]
+        hovertemplate = (aggregate_hovertemplate if aggregate else scatter_hovertemplate)(gr)
+        for k, panel in enumerate(panels):
+            trace = patch["data"][i * 4 + k]
+            trace["name"] = group["name"]
+            if k > 0 and render_mode == "density":
+                for key, value in density_trace_style(gr, COLOR_DICT[gr]).items():
+                    trace[key] = value
+                continue
+            for axis, col in zip(["x", "y", "z"], panel):
+                trace[axis] = cols[col]
+            trace["customdata"] = customdata
+            trace["hovertemplate"] = hovertemplate
+            base = MARKER_SIZE_2D if k > 0 else MARKER_SIZE_3D
+            trace["marker"]["size"] = encode_points(marker_size(counts, base), compact)
+            if k > 0:
+                trace["type"] = scatter_type
+                trace["mode"] = "markers"
+    if render_mode == "density":
+        patch_density_panels(
+            patch, df, x, y, z, GROUPS, index, treenum_range, ranges
+        )
+
+    scene = patch["layout"]["scene"]
+    for axis, col in zip(["xaxis", "yaxis", "zaxis"], panels[0]):
+        scene[axis]["title"]["text"] = col
+    for (xaxis, yaxis), (px, py) in zip(PANEL_AXES, panels[1:]):
+        patch["layout"][xaxis]["title"]["text"] = px
+        patch["layout"][yaxis]["title"]["text"] = py
+
 
-    fig.update_xaxes(title_text=x, row=2, col=2)
-    fig.update_yaxes(title_text=z, row=2, col=2)
+def patch_density_panels(
+    patch, df, x, y, z, GROUPS, index=None, treenum_range=None, ranges=None
+):
+    """
+    Re-bin the contours of the 2D panels in a dash Patch, e.g. after a zoom.
+    """
+    density = trace_density_data(df, x, y, z, GROUPS, index, treenum_range, ranges)
+    for k, panel in enumerate(density, start=1):
+        for i in range(len(GROUPS)):
+            trace = patch["data"][i * 4 + k]
+            trace["x"] = panel["x"]
+            trace["y"] = panel["y"]
+            trace["z"] = panel["counts"][i]
 
-    fig.update_xaxes(title_text=y, row=3, col=2)
-    fig.update_yaxes(title_text=z, row=3, col=2)
+
+def update_zoom(zoom, relayout):
+    """
+    Apply a relayoutData event of the graph to zoom, which maps 2D axis
+    names to the [min, max] they show. Returns True if a range changed.
+    """
+    changed = False
+    for axis in [a for axes in PANEL_AXES for a in axes]:
+        if relayout.get(f"{axis}.autorange"):
+            value = None
+        elif f"{axis}.range" in relayout:
+            value = [float(v) for v in relayout[f"{axis}.range"]]
+        elif f"{axis}.range[0]" in relayout and f"{axis}.range[1]" in relayout:
+            value = [
+                float(relayout[f"{axis}.range[0]"]),
+                float(relayout[f"{axis}.range[1]"]),
+            ]
+        else:
+            continue
+        if zoom.get(axis) != value:
+            zoom[axis] = value
+            changed = True
+    return changed
+
+
+def _panel_of_axis(key):
+    # Panel columns index of a selection range key such as "x" or "y2"
+    for p, (xaxis, yaxis) in enumerate(PANEL_AXES, start=1):
+        if key in (xaxis.replace("axis", ""), yaxis.replace("axis", "")):
+            return p
+    return None
+
+
+def selection_query(dims, selected=None, click=None):
+    """
+    Query for the rows matched by a selectedData or clickData event of the
+    graph, in the columns dims shown by the figure. A box or lasso drawn
+    on a 2D panel gives a "box" or "lasso" query with the selected range
+    of its two columns; a click gives a "nearest" query around the clicked
+    point. Returns None for an empty selection.
+    """
+    x, y, z = dims
+    panels = panel_columns(x, y, z)
+    if click is not None:
+        if not click.get("points"):
+            return None
+        point = click["points"][0]
+        k = point.get("curveNumber", 0) % 4
+        tree = point.get("customdata")
+        if isinstance(tree, list):
+            tree = tree[0]
+        return {
+            "kind": "nearest",
+            "dimensions": list(dims),
+            "point": {
+                c: float(point[axis]) for c, axis in zip(panels[k], ["x", "y", "z"])
+            },
+            "tree": tree,
+        }
+
+    if not selected:
+        return None
+    if selected.get("range"):
+        kind, shapes = "box", selected["range"]
+    elif selected.get("lassoPoints"):
+        kind, shapes = "lasso", selected["lassoPoints"]
+    else:
+        return None
+    key_x, key_y = sorted(shapes)[:2]
+    p = _panel_of_axis(key_x)
+    if p is None:
+        return None
+    cx, cy = panels[p]
+    query = {"kind": kind, "dimensions": list(dims)}
+    if kind == "box":
+        query["range"] = {cx: sorted(shapes[key_x]), cy: sorted(shapes[key_y])}
+    else:
+        xs, ys = shapes[key_x], shapes[key_y]
+        query["range"] = {cx: [min(xs), max(xs)], cy: [min(ys), max(ys)]}
+        query["polygon"] = {cx: xs, cy: ys}
+    return query
+
+
+def make_psrf_figure(treenum, psrf, threshold):
+    """
+    Line plot of the largest PSRF of any axis over sliding treenum windows.
+    """
+    fig = go.Figure(
+        go.Scatter(x=treenum, y=psrf, mode="lines", line={"color": "#1f77b4"})
+    )
+    fig.add_hline(y=threshold, line_dash="dash", line_color="red")
+    fig.update_layout(
+        height=200,
+        margin={"l": 40, "r": 10, "t": 30, "b": 30},
+        title={"text": "PSRF over sliding windows", "font": {"size": 12}},
+        xaxis_title="treenum",
+        showlegend=False,
+    )
+    return fig
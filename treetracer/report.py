@@ -0,0 +1,293 @@
+import html
+import math
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import plotly.io as pio
+
+from .cache import TraceCache
+from .callbacks import load_trace_paths
+from .diagnostics import PSRF_THRESHOLD, TraceDiagnostics
+from .index import GroupIndex
+from .loader import TRACE_EXTENSIONS, list_trace_files
+from .plot_utils import (
+    DEFAULT_MAX_POINTS,
+    GROUP_PALETTE,
+    add_trace_multiplot,
+    make_plot_grid,
+    make_psrf_figure,
+)
+from .trees import TREE_EXTENSIONS
+
+
+# Runs a worker process reports on before it is replaced, so memory kept
+# by the allocator after large runs is given back to the system
+RUNS_PER_WORKER = 10
+
+INDEX_FILE = "index.html"
+
+_PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+body {{ font-family: sans-serif; margin: 20px; }}
+table {{ border-collapse: collapse; margin: 10px 0; }}
+th, td {{ border: 1px solid #ddd; padding: 4px 8px; text-align: right; }}
+th:first-child, td:first-child {{ text-align: left; }}
+.bad {{ color: #c92a2a; }}
+.good {{ color: #2b8a3e; }}
+</style>
+</head>
+<body>
+{body}
+</body>
+</html>
+"""
+
+
+def _format_number(value, digits=3):
+    if value is None or not math.isfinite(value):
+        return "-"
+    return f"{value:.{digits}g}"
+
+
+def _psrf_class(value):
+    if value is None or not math.isfinite(value):
+        return ""
+    return "good" if value < PSRF_THRESHOLD else "bad"
+
+
+def _table(header, rows):
+    lines = ["<table>", "<tr>" + "".join(f"<th>{h}</th>" for h in header) + "</tr>"]
+    for row in rows:
+        lines.append("<tr>" + "".join(row) + "</tr>")
+    lines.append("</table>")
+    return "\n".join(lines)
+
+
+def report_names(paths):
+    """
+    Report file names for trace paths, unique even when runs in different
+    directories share a file name. Runs whose names only differ in their
+    extension, such as run.tsv and run.trees, keep the full file name, and
+    any names still equal get a numbered suffix.
+    """
+    paths = [os.path.abspath(p) for p in paths]
+    if not paths:
+        return []
+    root = os.path.commonpath([os.path.dirname(p) for p in paths])
+    relatives = [os.path.relpath(p, root).replace(os.sep, "_") for p in paths]
+    stems = [os.path.splitext(r)[0] for r in relatives]
+    counts = Counter(stems)
+    names = []
+    taken = set()
+    for relative, stem in zip(relatives, stems):
+        name = stem if counts[stem] == 1 else relative
+        unique, suffix = name, 2
+        while unique in taken:
+            unique = f"{name}-{suffix}"
+            suffix += 1
+        taken.add(unique)
+        names.append(unique + ".html")
+    return names
+
+
+def run_summary(summary):
+    """
+    Largest PSRF and smallest ESS over all axes and groups of a
+    TraceDiagnostics summary.
+    """
+    psrf = np.asarray(summary["psrf"], dtype=float)
+    ess = np.asarray(summary["ess"], dtype=float)
+    return {
+        "max_psrf": float(np.nanmax(psrf)) if np.isfinite(psrf).any() else None,
+        "min_ess": float(np.nanmin(ess)) if np.isfinite(ess).any() else None,
+    }
+
+
+def render_report(filename, item, summary, fig, psrf_fig, include_plotlyjs=True):
+    """
+    HTML page of one run: diagnostics tables, the PSRF series and the
+    trace plots.
+    """
+    totals = run_summary(summary)
+    psrf_cells = [
+        f'<td class="{_psrf_class(v)}">{_format_number(v)}</td>' for v in summary["psrf"]
+    ]
+    group_rows = []
+    for group, rows, ess, drift in zip(
+        summary["groups"], summary["rows"], summary["ess"], summary["drift"]
+    ):
+        finite = [v for v in ess if v is not None and math.isfinite(v)]
+        group_rows.append(
+            [
+                f"<td>{html.escape(group)}</td>",
+                f"<td>{rows}</td>",
+                f"<td>{_format_number(min(finite) if finite else None, 4)}</td>",
+                f"<td>{_format_number(drift)}</td>",
+            ]
+        )
+
+    body = [
+        f"<h1>{html.escape(filename)}</h1>",
+        f"<p>{item['rows']:,} rows, {len(item['groups'])} groups, "
+        f"trees {item['MIN_TREENUM']} to {item['MAX_TREENUM']}. "
+        f"Largest PSRF {_format_number(totals['max_psrf'])} "
+        f"(threshold {PSRF_THRESHOLD}).</p>",
+        _table(["", *summary["columns"]], [["<td>PSRF</td>", *psrf_cells]]),
+        pio.to_html(psrf_fig, full_html=False, include_plotlyjs=include_plotlyjs),
+        _table(["Group", "Trees", "Min ESS", "Drift"], group_rows),
+        pio.to_html(
+            fig, full_html=False, include_plotlyjs=False, default_height="800px"
+        ),
+    ]
+    return _PAGE.format(title=html.escape(filename), body="\n".join(body))
+
+
+def write_report(path, output, cache_dir=None, max_points=DEFAULT_MAX_POINTS, cdn=False):
+    """
+    Load one run, build its figures and diagnostics and write them to the
+    HTML file output. Returns a summary of the run for the index page.
+    Runs in a worker process.
+    """
+    start = time.perf_counter()
+    cache = TraceCache(cache_dir) if cache_dir else None
+    frames = {}
+    file_data = []
+    load_trace_paths([path], frames, file_data, cache)
+    item = file_data[0]
+    mdscols = item["dimensions"]
+    index = GroupIndex(frames.pop(item["filename"]))
+    groups = index.groups
+    color_dict = {g: GROUP_PALETTE[i % len(GROUP_PALETTE)] for i, g in enumerate(groups)}
+
+    fig = make_plot_grid()
+    x, y, z = mdscols[0], mdscols[1], mdscols[2]
+    add_trace_multiplot(
+        fig, index.df, x, y, z, groups, color_dict, max_points=max_points, index=index
+    )
+    fig.update_layout(title_text=item["filename"])
+
+    lo, hi = item["MIN_TREENUM"], item["MAX_TREENUM"]
+    summary = TraceDiagnostics(index, mdscols[:3]).summary(lo, hi)
+    psrf_fig = make_psrf_figure(
+        summary["series_treenum"], summary["series_psrf"], PSRF_THRESHOLD
+    )
+
+    page = render_report(
+        item["filename"], item, summary, fig, psrf_fig, "cdn" if cdn else True
+    )
+    with open(output, "w", encoding="utf-8") as f:
+        f.write(page)
+
+    return {
+        "filename": item["filename"],
+        "rows": item["rows"],
+        "groups": len(item["groups"]),
+        "trees": [lo, hi],
+        **run_summary(summary),
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def render_index(results):
+    """
+    Index page linking the report of every run, failed runs included.
+    """
+    rows = []
+    for name, result in results:
+        if "error" in result:
+            rows.append(
+                [
+                    f"<td>{html.escape(result['path'])}</td>",
+                    f'<td colspan="5" class="bad">{html.escape(result["error"])}</td>',
+                ]
+            )
+            continue
+        rows.append(
+            [
+                f'<td><a href="{html.escape(name)}">{html.escape(result["filename"])}</a></td>',
+                f"<td>{result['rows']:,}</td>",
+                f"<td>{result['groups']}</td>",
+                f"<td>{result['trees'][0]} - {result['trees'][1]}</td>",
+                f'<td class="{_psrf_class(result["max_psrf"])}">'
+                f"{_format_number(result['max_psrf'])}</td>",
+                f"<td>{_format_number(result['min_ess'], 4)}</td>",
+            ]
+        )
+    failed = sum("error" in r for _, r in results)
+    body = [
+        "<h1>TreeTracer reports</h1>",
+        f"<p>{len(results)} runs, {failed} failed. "
+        f"Generated {time.strftime('%Y-%m-%d %H:%M')}.</p>",
+        _table(["Run", "Rows", "Groups", "Trees", "Max PSRF", "Min ESS"], rows),
+    ]
+    return _PAGE.format(title="TreeTracer reports", body="\n".join(body))
+
+
+def collect_runs(paths):
+    """
+    Trace and tree files of the given files and directories, in order and
+    without duplicates. Every file is reported as a run of its own.
+    """
+    files = []
+    for path in paths:
+        files.extend(list_trace_files(path, TRACE_EXTENSIONS + TREE_EXTENSIONS))
+    return list(dict.fromkeys(files))
+
+
+def write_reports(
+    paths,
+    output_dir,
+    workers=None,
+    cache_dir=None,
+    max_points=None,
+    cdn=False,
+):
+    """
+    Write an HTML report of every run under paths to output_dir, plus an
+    index page. Runs are spread over a pool of worker processes that each
+    hold one run at a time. Returns (report name, summary) pairs in input
+    order; failed runs have an "error" entry instead.
+    """
+    if max_points is None:
+        max_points = DEFAULT_MAX_POINTS
+    runs = collect_runs(paths)
+    names = report_names(runs)
+    os.makedirs(output_dir, exist_ok=True)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(runs) or 1))
+
+    results = {}
+    with ProcessPoolExecutor(
+        max_workers=workers, max_tasks_per_child=RUNS_PER_WORKER
+    ) as pool:
+        futures = {
+            pool.submit(
+                write_report,
+                path,
+                os.path.join(output_dir, name),
+                cache_dir,
+                max_points,
+                cdn,
+            ): (path, name)
+            for path, name in zip(runs, names)
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            path, name = futures[future]
+            try:
+                results[path] = future.result()
+                status = f"{results[path]['seconds']:.1f} s"
+            except Exception as e:
+                results[path] = {"path": path, "error": f"{type(e).__name__}: {e}"}
+                status = "failed: " + results[path]["error"]
+            print(f"[{done}/{len(runs)}] {path} {status}", flush=True)
+
+    ordered = [(name, results[path]) for path, name in zip(runs, names)]
+    with open(os.path.join(output_dir, INDEX_FILE), "w", encoding="utf-8") as f:
+        f.write(render_index(ordered))
+    return ordered
@@ -0,0 +1,236 @@
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+
+# Memory used by one tile of XOR results; small enough to stay in cache
+BLOCK_BYTES = 4 * 1024**2
+
+# Rows of the distance matrix computed per tile
+BLOCK_ROWS = 16
+
+# Below this many trees distances are computed in the calling process
+MIN_PARALLEL_TREES = 2000
+
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def popcount(words):
+    """
+    Number of set bits in every element of a uint64 array.
+    """
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words)
+    bytes_ = words.view(np.uint8).reshape(words.shape + (8,))
+    return _POPCOUNT_TABLE[bytes_].sum(axis=-1, dtype=np.uint8)
+
+
+def pack_bitmasks(masks, n_bits):
+    """
+    Pack integer bitmasks into rows of little-endian uint64 words.
+    """
+    n_words = max(1, (n_bits + 63) // 64)
+    data = b"".join(m.to_bytes(n_words * 8, "little") for m in masks)
+    return np.frombuffer(data, dtype="<u8").reshape(len(masks), n_words)
+
+
+def tree_bitsets(split_sets, n_taxa):
+    """
+    Encode every tree as a bitset over the splits found in several trees.
+
+    Splits are packed over the taxon ordering and deduplicated, then bit s
+    of a tree's row is set when the tree contains split s, so the RF
+    distance between two trees is the popcount of their XOR. Splits shared
+    by all trees never differ and splits seen in a single tree always
+    differ, so both are left out of the bitsets; the number of single-tree
+    splits of each tree is returned alongside and added to every distance.
+    """
+    n = len(split_sets)
+    sizes = np.array([len(s) for s in split_sets], dtype=np.int64)
+    rows = np.repeat(np.arange(n), sizes)
+    splits = pack_bitmasks([m for s in split_sets for m in s], n_taxa)
+    if len(splits):
+        _, split_ids = np.unique(splits, axis=0, return_inverse=True)
+        split_ids = split_ids.ravel()
+    else:
+        split_ids = np.zeros(0, dtype=np.int64)
+
+    frequency = np.bincount(split_ids)[split_ids]
+    unique = np.bincount(rows[frequency == 1], minlength=n).astype(np.uint32)
+
+    keep = (frequency > 1) & (frequency < n)
+    rows = rows[keep]
+    _, split_ids = np.unique(split_ids[keep], return_inverse=True)
+
+    n_words = max(1, (split_ids.max(initial=-1) + 64) // 64)
+    bitsets = np.zeros((n, n_words), dtype=np.uint64)
+    np.bitwise_or.at(
+        bitsets,
+        (rows, split_ids // 64),
+        np.left_shift(np.uint64(1), (split_ids % 64).astype(np.uint64)),
+    )
+    return bitsets, unique
+
+
+def condensed_offset(i, n):
+    """
+    Position of pair (i, i + 1) in a condensed distance matrix of n items.
+    """
+    return i * n - i * (i + 1) // 2
+
+
+def row_blocks(n, n_blocks):
+    """
+    Split rows 0..n-1 into contiguous blocks holding similar numbers of pairs.
+    """
+    total = condensed_offset(n, n)
+    targets = np.linspace(0, total, n_blocks + 1)
+    rows = np.arange(n + 1)
+    edges = np.searchsorted(condensed_offset(rows, n), targets)
+    edges = np.unique(np.clip(edges, 0, n))
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def rf_block(bitsets, unique, out, start, end):
+    """
+    Write RF distances of rows start..end-1 against all later rows into the
+    condensed matrix out.
+    """
+    n, n_words = bitsets.shape
+    cols = max(1, BLOCK_BYTES // (BLOCK_ROWS * n_words * 8))
+    for a in range(start, end, BLOCK_ROWS):
+        b = min(a + BLOCK_ROWS, end)
+        dist = np.empty((b - a, n - a - 1), dtype=out.dtype)
+        for c in range(a + 1, n, cols):
+            d = min(c + cols, n)
+            xor = np.bitwise_xor(bitsets[a:b, None, :], bitsets[None, c:d, :])
+            dist[:, c - a - 1 : d - a - 1] = popcount(xor).sum(axis=-1)
+        dist += unique[a:b, None]
+        dist += unique[None, a + 1 :]
+        for i in range(a, b):
+            offset = condensed_offset(i, n)
+            out[offset : offset + n - i - 1] = dist[i - a, i - a :]
+
+
+def _rf_worker(bitsets_path, unique_path, out_path, start, end):
+    bitsets = np.load(bitsets_path, mmap_mode="r")
+    unique = np.load(unique_path, mmap_mode="r")
+    out = np.load(out_path, mmap_mode="r+")
+    rf_block(bitsets, unique, out, start, end)
+    out.flush()
+
+
+def rf_condensed(split_sets, n_taxa, path=None, workers=None):
+    """
+    Condensed Robinson-Foulds matrix of all trees, as a memory-mapped array.
+
+    Blocks of rows are computed in a process pool with workers processes
+    (all cores by default). If path is not given the matrix lives in a
+    temporary file that is removed once it is no longer mapped.
+    """
+    n = len(split_sets)
+    workers = workers or os.cpu_count() or 1
+    directory = tempfile.mkdtemp(prefix="treetracer-rf-")
+    out_path = path or os.path.join(directory, "rf.npy")
+    out = np.lib.format.open_memmap(
+        out_path, mode="w+", dtype=np.uint32, shape=(condensed_offset(n, n),)
+    )
+    bitsets, unique = tree_bitsets(split_sets, n_taxa)
+
+    if workers == 1 or n < MIN_PARALLEL_TREES:
+        rf_block(bitsets, unique, out, 0, n)
+    else:
+        bitsets_path = os.path.join(directory, "bitsets.npy")
+        unique_path = os.path.join(directory, "unique.npy")
+        np.save(bitsets_path, bitsets)
+        np.save(unique_path, unique)
+        out.flush()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(_rf_worker, bitsets_path, unique_path, out_path, start, end)
+                for start, end in row_blocks(n, workers * 4)
+            ]
+            for future in futures:
+                future.result()
+        os.remove(bitsets_path)
+        os.remove(unique_path)
+        out = np.load(out_path, mmap_mode="r")
+
+    if path is None:
+        # The mapping stays valid after the file is unlinked
+        try:
+            os.remove(out_path)
+        except OSError:
+            pass
+    try:
+        os.rmdir(directory)
+    except OSError:
+        pass
+    return out
+
+
+def squareform(condensed, n):
+    """
+    Square distance matrix from a condensed one.
+    """
+    D = np.zeros((n, n), dtype=np.float64)
+    rows, cols = np.triu_indices(n, k=1)
+    D[rows, cols] = condensed
+    D[cols, rows] = condensed
+    return D
+
+
+def rf_distance_matrix(split_sets, n_taxa, workers=None):
+    """
+    Robinson-Foulds distances between all pairs of split sets.
+    """
+    return squareform(rf_condensed(split_sets, n_taxa, workers=workers), len(split_sets))
+
+
+def rf_to_landmarks(split_sets, landmark_sets):
+    """
+    Robinson-Foulds distances from every split set to every landmark.
+
+    Trees are encoded as bitsets over the landmark splits only; splits
+    missing from all landmarks differ from each of them and are counted
+    separately, so the cost does not grow with the number of trees seen.
+    """
+    vocabulary = {}
+    for splits in landmark_sets:
+        for split in splits:
+            vocabulary.setdefault(split, len(vocabulary))
+    n_words = max(1, (len(vocabulary) + 63) // 64)
+
+    def encode(sets):
+        bitsets = np.zeros((len(sets), n_words), dtype=np.uint64)
+        outside = np.zeros(len(sets), dtype=np.uint32)
+        rows, bits = [], []
+        for i, splits in enumerate(sets):
+            for split in splits:
+                bit = vocabulary.get(split)
+                if bit is None:
+                    outside[i] += 1
+                else:
+                    rows.append(i)
+                    bits.append(bit)
+        bits = np.asarray(bits, dtype=np.int64)
+        np.bitwise_or.at(
+            bitsets,
+            (np.asarray(rows, dtype=np.int64), bits // 64),
+            np.left_shift(np.uint64(1), (bits % 64).astype(np.uint64)),
+        )
+        return bitsets, outside
+
+    trees, outside = encode(split_sets)
+    landmarks, _ = encode(landmark_sets)
+
+    D = np.empty((len(split_sets), len(landmark_sets)), dtype=np.uint32)
+    rows = max(1, BLOCK_BYTES // (len(landmark_sets) * n_words * 8 or 1))
+    for a in range(0, len(split_sets), rows):
+        b = min(a + rows, len(split_sets))
+        xor = np.bitwise_xor(trees[a:b, None, :], landmarks[None, :, :])
+        D[a:b] = popcount(xor).sum(axis=-1)
+    D += outside[:, None]
+    return D
@@ -0,0 +1,168 @@
+import numpy as np
+
+
+# Average number of rows per grid cell
+POINTS_PER_CELL = 16
+
+# Upper bound on the number of grid cells, whatever the number of rows
+MAX_CELLS = 1 << 22
+
+# Distinct trees returned by a nearest-tree query
+NEAREST_TREES = 20
+
+
+def points_in_polygon(xs, ys, polygon):
+    """
+    Mask of the points inside polygon, given as its x and y vertex lists,
+    by the even-odd rule.
+    """
+    px = np.asarray(polygon[0], dtype=np.float64)
+    py = np.asarray(polygon[1], dtype=np.float64)
+    inside = np.zeros(len(xs), dtype=bool)
+    x0, y0 = px[-1], py[-1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for x1, y1 in zip(px, py):
+            # Edges crossed by a ray from the point towards +x
+            crosses = (y1 > ys) != (y0 > ys)
+            at = (x0 - x1) * (ys - y1) / (y0 - y1) + x1
+            inside ^= crosses & (xs < at)
+            x0, y0 = x1, y1
+    return inside
+
+
+class SpatialIndex:
+    """
+    Uniform grid over the rows of a frame in a few numeric columns.
+
+    Rows are sorted once by grid cell, about POINTS_PER_CELL to a cell. A
+    box query then only tests the rows of the cells overlapping the box,
+    and a nearest query grows a box around the point until it holds
+    enough rows, so both stay interactive on millions of rows.
+    """
+
+    def __init__(self, coords):
+        self.coords = np.asarray(coords, dtype=np.float64)
+        n, d = self.coords.shape
+        if n:
+            self.lo = np.nanmin(self.coords, axis=0)
+            self.hi = np.nanmax(self.coords, axis=0)
+        else:
+            self.lo = self.hi = np.zeros(d)
+        cells = max(1, n // POINTS_PER_CELL)
+        self.bins = max(1, min(round(cells ** (1 / d)), int(MAX_CELLS ** (1 / d))))
+        self.shape = (self.bins,) * d
+        self.width = (self.hi - self.lo) / self.bins
+        self.width[~(self.width > 0)] = 1
+
+        cell_id = np.ravel_multi_index(self._cells(self.coords).T, self.shape)
+        self.order = np.argsort(cell_id, kind="stable")
+        counts = np.bincount(cell_id, minlength=self.bins**d)
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    def __len__(self):
+        return len(self.coords)
+
+    def memory_usage(self):
+        return self.coords.nbytes + self.order.nbytes + self.offsets.nbytes
+
+    def _cells(self, points):
+        # Grid cell of every point, per axis; NaN goes to the first cell
+        steps = np.nan_to_num((points - self.lo) / self.width)
+        return np.clip(steps, 0, self.bins - 1).astype(np.int64)
+
+    def _rows_in(self, cells):
+        # Rows of the given cells, cell after cell
+        starts = self.offsets[cells]
+        counts = self.offsets[cells + 1] - starts
+        shift = np.repeat(starts - np.cumsum(counts) + counts, counts)
+        return self.order[np.arange(counts.sum()) + shift]
+
+    def box(self, lo, hi, keep=None):
+        """
+        Positions of the rows with lo <= coordinates <= hi, in row order.
+        Bounds may be infinite. keep optionally masks the rows that count.
+        """
+        lo = np.maximum(np.asarray(lo, dtype=np.float64), self.lo)
+        hi = np.minimum(np.asarray(hi, dtype=np.float64), self.hi)
+        if not len(self) or (lo > hi).any():
+            return np.zeros(0, dtype=np.int64)
+        first, last = self._cells(lo), self._cells(hi)
+        axes = [np.arange(a, b + 1) for a, b in zip(first, last)]
+        cells = np.ravel_multi_index(
+            [a.ravel() for a in np.meshgrid(*axes, indexing="ij")], self.shape
+        )
+        rows = self._rows_in(cells)
+        points = self.coords[rows]
+        rows = rows[((points >= lo) & (points <= hi)).all(axis=1)]
+        if keep is not None:
+            rows = rows[keep[rows]]
+        return np.sort(rows)
+
+    def nearest(self, point, k, keep=None, labels=None):
+        """
+        Rows nearest to point covering k distinct labels (every row is its
+        own label if labels is None), ordered by distance. Axes where point
+        is NaN are ignored. Returns the positions and distances of the rows.
+        """
+        point = np.asarray(point, dtype=np.float64)
+        active = ~np.isnan(point)
+        span = np.sqrt(((self.hi - self.lo)[active] ** 2).sum())
+        radius = self.width[active].max()
+        while True:
+            lo = np.where(active, point - radius, -np.inf)
+            hi = np.where(active, point + radius, np.inf)
+            rows = self.box(lo, hi, keep)
+            offset = self.coords[rows][:, active] - point[active]
+            dist = np.sqrt((offset**2).sum(axis=1))
+            rows, dist = rows[dist <= radius], dist[dist <= radius]
+            ids = rows if labels is None else labels[rows]
+            # Every row within radius is found, so k labels within it are
+            # the k nearest; otherwise grow the box until it holds them all
+            if len(np.unique(ids)) >= k or radius > span:
+                break
+            radius *= 2
+
+        order = np.argsort(dist, kind="stable")
+        rows, dist, ids = rows[order], dist[order], ids[order]
+        _, first = np.unique(ids, return_index=True)
+        nearest_ids = ids[np.sort(first)[:k]]
+        match = np.isin(ids, nearest_ids)
+        return rows[match], dist[match]
+
+
+def selection_frame(index, query, treenum_range=None):
+    """
+    Rows of a GroupIndex matched by a graph selection query (see
+    selection_query in plot_utils), limited to treenum_range: tree, group,
+    treenum and the query's dimensions, plus the distance to the clicked
+    point for nearest-tree queries.
+    """
+    dims = query["dimensions"]
+    spatial = index.spatial_index(dims)
+    keep = None
+    if treenum_range is not None:
+        keep = (index.treenum >= treenum_range[0]) & (index.treenum <= treenum_range[1])
+
+    distance = None
+    if query["kind"] == "nearest":
+        point = [query["point"].get(c, np.nan) for c in dims]
+        rows, distance = spatial.nearest(
+            point, NEAREST_TREES, keep, index.point_codes(["tree"])
+        )
+    else:
+        bounds = query["range"]
+        lo = [bounds[c][0] if c in bounds else -np.inf for c in dims]
+        hi = [bounds[c][1] if c in bounds else np.inf for c in dims]
+        rows = spatial.box(lo, hi, keep)
+        if query["kind"] == "lasso":
+            (cx, xs), (cy, ys) = query["polygon"].items()
+            coords = spatial.coords[rows]
+            inside = points_in_polygon(
+                coords[:, dims.index(cx)], coords[:, dims.index(cy)], [xs, ys]
+            )
+            rows = rows[inside]
+
+    frame = index.df.iloc[rows][["tree", "group", "treenum", *dims]]
+    if distance is not None:
+        frame = frame.assign(distance=distance)
+    return frame.reset_index(drop=True)
@@ -0,0 +1,433 @@
+import contextlib
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+from .cache import DEFAULT_CACHE_SIZE, TraceCache, content_key
+from .index import GroupIndex
+
+
+# Memory all sessions may use for loaded frames before the oldest are evicted
+DEFAULT_MEMORY_BUDGET = 4 * 1024**3
+
+# Sessions unused for this many seconds are forgotten
+DEFAULT_SESSION_TTL = 24 * 3600
+
+# Seconds between two checks for expired sessions
+EXPIRE_INTERVAL = 60
+
+
+def frame_bytes(df):
+    return int(df.memory_usage(deep=True, index=True).sum())
+
+
+def plot_bytes(plot, counted=None):
+    """
+    Bytes held by the plot state of a session: its index with the point
+    codes and spatial indexes built on it, its diagnostics and the rows
+    read by the file watcher since the index was built.
+
+    An index or diagnostics whose id is in the set counted is left out,
+    and the ids of the others are added to it, so that an index shared by
+    several sessions or held by the figure cache is only counted once.
+    """
+    size = sum(frame_bytes(df) for df in plot.get("pending", []))
+    for key in ("index", "diagnostics"):
+        value = plot.get(key)
+        if value is None or (counted is not None and id(value) in counted):
+            continue
+        if counted is not None:
+            counted.add(id(value))
+        size += value.memory_usage()
+    return size
+
+
+class Session(MutableMapping):
+    """
+    Frames, plot state and file watchers of one browser session.
+
+    The session behaves like the dataframes dict it replaces; frames are
+    kept in the shared SessionStore, which may evict them at any time.
+    Frames preloaded for every session are visible unless the session
+    stores its own frame under the same name.
+
+    Rebuilding the plot state or merging tailed rows into it replaces the
+    plot dict as a whole under lock, so callbacks still holding the old
+    dict keep a consistent index, frame and groups.
+    """
+
+    def __init__(self, store, session_id):
+        self.store = store
+        self.id = session_id
+        self.plot = {}
+        self.lock = threading.RLock()
+        self.tails = {name: tail.copy() for name, tail in store.shared_tails.items()}
+        self.last_used = time.monotonic()
+
+    def __getitem__(self, name):
+        df = self.store.get(self.id, name)
+        if df is None:
+            raise KeyError(name)
+        return df
+
+    def __setitem__(self, name, df):
+        self.store.put(self.id, name, df)
+
+    def __delitem__(self, name):
+        self.store.remove(self.id, name)
+
+    def __iter__(self):
+        return iter(self.store.names(self.id))
+
+    def __len__(self):
+        return len(self.store.names(self.id))
+
+    def clear(self):
+        self.store.clear_session(self.id)
+        # Swapped rather than cleared, without the session lock: the store
+        # lock may be held, which plot rebuilds take inside the session lock
+        self.plot = {}
+        self.tails = {}
+
+    def memory_usage(self):
+        """
+        Bytes held by this session: its own frames plus its plot state.
+        """
+        return self.store.usage().get(self.id, 0) + plot_bytes(self.plot)
+
+
+class SessionStore:
+    """
+    Loaded frames of all sessions under one memory budget.
+
+    Frames are kept in least-recently-used order. When the total size goes
+    over max_bytes the oldest frames of any session are evicted; with a
+    spill directory they are written to an on-disk TraceCache first and
+    transparently reloaded (memory-mapped) on the next access. Plot states
+    count toward the budget as well, and sessions unused for session_ttl
+    seconds are forgotten altogether.
+    """
+
+    def __init__(
+        self,
+        max_bytes=DEFAULT_MEMORY_BUDGET,
+        spill_dir=None,
+        session_ttl=DEFAULT_SESSION_TTL,
+    ):
+        self.max_bytes = max_bytes
+        self.session_ttl = session_ttl
+        self.spill = TraceCache(spill_dir) if spill_dir else None
+        self.shared = {}
+        self.shared_tails = {}
+        self.sessions = {}
+        # FigureCache of the app, whose entries count toward its own budget
+        self.figures = None
+        self._frames = OrderedDict()
+        self._sizes = {}
+        self._spilled = {}
+        self._lock = threading.RLock()
+        self._expire_checked = time.monotonic()
+
+    def session(self, session_id):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._expire_checked >= EXPIRE_INTERVAL:
+                self._expire_checked = now
+                self.expire(now)
+            if session_id not in self.sessions:
+                self.sessions[session_id] = Session(self, session_id)
+            session = self.sessions[session_id]
+            session.last_used = now
+            return session
+
+    def expire(self, now=None):
+        """
+        Forget the sessions unused for more than session_ttl seconds.
+        """
+        if self.session_ttl is None:
+            return
+        with self._lock:
+            now = time.monotonic() if now is None else now
+            for session_id, session in list(self.sessions.items()):
+                if now - session.last_used > self.session_ttl:
+                    self.forget(session_id)
+
+    def forget(self, session_id):
+        """
+        Drop the frames, plot state and file watchers of a session.
+        """
+        with self._lock:
+            session = self.sessions.pop(session_id, None)
+            if session is not None:
+                session.clear()
+
+    def _spill_key(self, session_id, name):
+        return content_key(f"{session_id}/{name}".encode())
+
+    def put(self, session_id, name, df):
+        with self._lock:
+            key = (session_id, name)
+            spill_key = self._spilled.pop(key, None)
+            if spill_key is not None:
+                self.spill.remove(spill_key)
+            self._frames[key] = df
+            self._frames.move_to_end(key)
+            self._sizes[key] = frame_bytes(df)
+            self.evict(keep=key)
+
+    def get(self, session_id, name):
+        with self._lock:
+            key = (session_id, name)
+            if key in self._frames:
+                self._frames.move_to_end(key)
+                return self._frames[key]
+            if key in self._spilled and self.spill is not None:
+                df = self.spill.get(self._spilled[key])
+                if df is not None:
+                    self.put(session_id, name, df)
+                    return df
+            return self.shared.get(name)
+
+    def remove(self, session_id, name):
+        with self._lock:
+            key = (session_id, name)
+            self._frames.pop(key, None)
+            self._sizes.pop(key, None)
+            spill_key = self._spilled.pop(key, None)
+            if spill_key is not None:
+                self.spill.remove(spill_key)
+
+    def names(self, session_id):
+        with self._lock:
+            names = [n for s, n in list(self._frames) + list(self._spilled) if s == session_id]
+            return list(dict.fromkeys(names + list(self.shared)))
+
+    def clear_session(self, session_id):
+        with self._lock:
+            for key in list(self._frames) + list(self._spilled):
+                if key[0] == session_id:
+                    self.remove(*key)
+
+    def evict(self, keep=None, active=None):
+        """
+        Evict until the budget is met: first the plot states of the least
+        recently used sessions other than the active one (by default the
+        session of the frame keep), which are rebuilt from the frames when
+        they plot again, then the least recently used frames.
+
+        An index shared by several sessions is charged to the most recently
+        used of them, and not at all if the figure cache holds it, so that
+        dropping a plot state only counts the memory it frees.
+        """
+        with self._lock:
+            if active is None and keep is not None:
+                active = keep[0]
+            total = sum(self._sizes.values())
+            counted = self.figures.value_ids() if self.figures is not None else set()
+            plots = []
+            for session in sorted(
+                self.sessions.values(), key=lambda s: s.last_used, reverse=True
+            ):
+                size = plot_bytes(session.plot, counted)
+                total += size
+                if size and session.id != active:
+                    plots.append((session, size))
+            for session, size in reversed(plots):
+                if total <= self.max_bytes:
+                    break
+                # Swapped for an empty state rather than cleared, as callbacks
+                # of that session may still be using it; the next one rebuilds
+                session.plot = {}
+                total -= size
+            for key in list(self._frames):
+                if total <= self.max_bytes:
+                    break
+                if key == keep:
+                    continue
+                df = self._frames.pop(key)
+                total -= self._sizes.pop(key)
+                if self.spill is not None:
+                    spill_key = self._spill_key(*key)
+                    self.spill.remove(spill_key)
+                    self.spill.put(spill_key, df)
+                    self._spilled[key] = spill_key
+
+    def usage(self):
+        """
+        Bytes of frames held in memory, per session id.
+        """
+        with self._lock:
+            usage = {}
+            for (session_id, _), size in self._sizes.items():
+                usage[session_id] = usage.get(session_id, 0) + size
+            return usage
+
+    def group_index(self, session_id, names, build, cache=None, key=None):
+        """
+        GroupIndex of the frames names of a session, combined by build().
+
+        With a TraceCache, the sorted frame is kept there under key, so that
+        another process, such as the background job that drew the plot,
+        maps it instead of sorting the rows again.
+        """
+        if cache is None:
+            return GroupIndex(build())
+        df = cache.get(key)
+        if df is None:
+            index = GroupIndex(build())
+            cache.put(key, index.df)
+            df = cache.get(key)
+            if df is None:
+                return index
+        return GroupIndex(df, presorted=True)
+
+
+class SharedSessionStore(SessionStore):
+    """
+    SessionStore shared by several worker processes.
+
+    Every frame is written once to a TraceCache under directory and each
+    session's frame names are recorded in a small JSON file, so any worker
+    can serve any session. Workers memory-map the same files, so the data
+    is held once in the page cache however many workers read it. The
+    memory budget only limits how many frames a worker keeps mapped.
+    """
+
+    def __init__(
+        self,
+        directory,
+        max_bytes=DEFAULT_MEMORY_BUDGET,
+        disk_bytes=DEFAULT_CACHE_SIZE,
+        session_ttl=DEFAULT_SESSION_TTL,
+    ):
+        super().__init__(max_bytes, session_ttl=session_ttl)
+        self.frames = TraceCache(os.path.join(directory, "frames"), disk_bytes)
+        self.registry = os.path.join(directory, "sessions")
+        os.makedirs(self.registry, exist_ok=True)
+        # Keys identifying the content of the shared frames
+        self.shared_keys = {}
+        self._keys = {}
+
+    def _registry_path(self, session_id):
+        # Session ids come from the browser, so never use them as file names
+        return os.path.join(self.registry, content_key(session_id.encode()) + ".json")
+
+    @contextlib.contextmanager
+    def _locked(self, session_id):
+        # Serialize registry updates of one session across processes
+        with open(self._registry_path(session_id) + ".lock", "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def _read_keys(self, session_id):
+        try:
+            with open(self._registry_path(session_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_keys(self, session_id, keys):
+        path = self._registry_path(session_id)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(keys, f)
+        os.replace(tmp, path)
+
+    def frame_key(self, session_id, name):
+        key = self._read_keys(session_id).get(name)
+        return key if key is not None else self.shared_keys.get(name)
+
+    def put(self, session_id, name, df):
+        key = uuid.uuid4().hex
+        self.frames.put(key, df)
+        with self._locked(session_id):
+            keys = self._read_keys(session_id)
+            old = keys.get(name)
+            keys[name] = key
+            self._write_keys(session_id, keys)
+        if old is not None:
+            self.frames.remove(old)
+
+        # Keep the mapped copy instead of the frame built by this worker
+        mapped = self.frames.get(key)
+        with self._lock:
+            self._keys[(session_id, name)] = key
+            SessionStore.put(self, session_id, name, df if mapped is None else mapped)
+
+    def get(self, session_id, name):
+        key = self._read_keys(session_id).get(name)
+        if key is None:
+            return self.shared.get(name)
+        with self._lock:
+            mapped = (session_id, name)
+            if self._keys.get(mapped) == key and mapped in self._frames:
+                self._frames.move_to_end(mapped)
+                return self._frames[mapped]
+            df = self.frames.get(key)
+            if df is None:
+                return None
+            self._keys[(session_id, name)] = key
+            SessionStore.put(self, session_id, name, df)
+            return df
+
+    def remove(self, session_id, name):
+        with self._locked(session_id):
+            keys = self._read_keys(session_id)
+            key = keys.pop(name, None)
+            self._write_keys(session_id, keys)
+        if key is not None:
+            self.frames.remove(key)
+        with self._lock:
+            self._keys.pop((session_id, name), None)
+            SessionStore.remove(self, session_id, name)
+
+    def names(self, session_id):
+        return list(dict.fromkeys(list(self._read_keys(session_id)) + list(self.shared)))
+
+    def forget(self, session_id):
+        """
+        Drop what this worker holds of a session. Other workers may still
+        serve it, so its frames stay on disk, where the disk budget of the
+        TraceCache bounds them.
+        """
+        with self._lock:
+            session = self.sessions.pop(session_id, None)
+            if session is None:
+                return
+            session.plot = {}
+            session.tails = {}
+            for key in list(self._frames):
+                if key[0] == session_id:
+                    self._keys.pop(key, None)
+                    SessionStore.remove(self, *key)
+
+    def clear_session(self, session_id):
+        for name in list(self._read_keys(session_id)):
+            self.remove(session_id, name)
+        with contextlib.suppress(OSError):
+            os.remove(self._registry_path(session_id))
+
+    def group_index(self, session_id, names, build, cache=None, key=None):
+        """
+        GroupIndex of the frames names of a session, combined by build().
+
+        The sorted frame is stored with the session frames so that every
+        worker maps the same copy instead of sorting its own.
+        """
+        keys = [self.frame_key(session_id, name) for name in names]
+        if None in keys:
+            return SessionStore.group_index(self, session_id, names, build, cache, key)
+        key = content_key(("index/" + "/".join(keys)).encode())
+        df = self.frames.get(key)
+        if df is None:
+            index = GroupIndex(build())
+            self.frames.put(key, index.df)
+            df = self.frames.get(key)
+            if df is None:
+                return index
+        return GroupIndex(df, presorted=True)
@@ -0,0 +1,103 @@
+import copy
+import os
+
+import numpy as np
+import pandas as pd
+
+from .loader import BufferReader, concat_traces, header_columns, set_file, trace_dtypes
+
+
+class TraceTail:
+    """
+    Follow a trace TSV that is still being written.
+
+    The tail remembers the byte offset up to which the file was parsed and
+    how many trees each group already has, so that every read only parses
+    the rows appended since the previous one and continues treenum from
+    where it stopped. Parsed chunks are kept in pending until they are
+    merged into the full frame by flush_tails.
+    """
+
+    def __init__(self, path, df, offset):
+        self.path = path
+        self.filename = os.path.basename(path)
+        self.offset = offset
+        with open(path, "rb") as f:
+            self.columns = header_columns(f.readline())
+
+        groups = df["group"].astype(str)
+        self.counts = groups.value_counts().to_dict()
+        self.codes = dict(zip(groups, df["group_col"]))
+        self.pending = []
+
+    def copy(self):
+        """
+        Independent tail continuing from the same position.
+        """
+        tail = copy.copy(self)
+        tail.counts = dict(self.counts)
+        tail.codes = dict(self.codes)
+        tail.pending = []
+        return tail
+
+    def read_new(self):
+        """
+        Parse complete rows appended since the last read.
+        Returns a normalized DataFrame, or None if nothing new was written.
+        """
+        size = os.path.getsize(self.path)
+        if size <= self.offset:
+            return None
+
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            data = f.read(size - self.offset)
+
+        # Leave a partially written last line for the next read
+        end = data.rfind(b"\n") + 1
+        if end == 0:
+            return None
+        self.offset += end
+
+        with BufferReader(memoryview(data)[:end]) as reader:
+            df = pd.read_csv(
+                reader,
+                sep="\t",
+                header=None,
+                names=self.columns,
+                dtype=trace_dtypes(self.columns),
+            )
+        if df.empty:
+            return None
+
+        df = self._normalize(df)
+        self.pending.append(df)
+        return df
+
+    def _normalize(self, df):
+        # Same columns as loader.normalize_trace, continuing existing counts
+        df.columns = [x.replace("V", "MDS") for x in df.columns]
+        groups = df["group"].astype(str)
+
+        for gr in groups.unique():
+            self.codes.setdefault(gr, len(self.codes))
+        df["group_col"] = groups.map(self.codes).to_numpy(dtype=np.int32)
+
+        treenum = df.groupby(groups, sort=False).cumcount().to_numpy(dtype=np.int32)
+        treenum += groups.map(self.counts).fillna(0).to_numpy(dtype=np.int32) + 1
+        df["treenum"] = treenum
+        df["size"] = np.full(len(df), 6, dtype=np.int8)
+
+        for gr, count in groups.value_counts().items():
+            self.counts[gr] = self.counts.get(gr, 0) + count
+        return set_file(df, self.filename)
+
+
+def flush_tails(dataframes, tails):
+    """
+    Merge rows read by the tails into their frames in dataframes.
+    """
+    for filename, tail in tails.items():
+        if tail.pending and filename in dataframes:
+            dataframes[filename] = concat_traces([dataframes[filename], *tail.pending])
+        tail.pending = []
@@ -0,0 +1,303 @@
+import io
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from .cache import content_key
+from .loader import BufferReader, normalize_trace
+from .mds import DEFAULT_DIMENSIONS, LandmarkMDS, classical_mds
+from .rf import rf_distance_matrix, rf_to_landmarks
+
+
+# Extensions accepted as posterior tree samples
+TREE_EXTENSIONS = (".trees", ".tree", ".tre", ".t", ".nex", ".nexus", ".nwk", ".newick")
+
+# Above this many distinct topologies trees are embedded with landmark MDS
+LANDMARK_THRESHOLD = 5000
+DEFAULT_LANDMARKS = 300
+
+# Trees placed per step of landmark MDS
+EMBED_CHUNK = 10000
+
+_TOKEN = re.compile(r"\[[^\]]*\]|'(?:[^']|'')*'|[(),;:]|[^\s(),;:\[\]']+")
+_COMMENT = re.compile(r"\[[^\]]*\]")
+_TREE_STATEMENT = re.compile(r"^\s*tree\s+(\S+?)\s*=\s*(.*)$", re.IGNORECASE | re.DOTALL)
+_BEGIN_TREES = re.compile(r"^begin\s+trees\s*;$", re.IGNORECASE)
+_PUNCTUATION = ("(", ")", ",", ";", ":")
+
+
+def is_tree_file(filename):
+    return filename.lower().endswith(TREE_EXTENSIONS)
+
+
+def _unquote(label):
+    if label.startswith("'") and label.endswith("'"):
+        return label[1:-1].replace("''", "'")
+    return label
+
+
+def _statements(lines):
+    # Split text into ';'-terminated statements with [comments] removed
+    buffer = []
+    comment = []
+    for line in lines:
+        if comment:
+            # Inside a comment spanning several lines
+            if "]" not in line:
+                continue
+            comment = []
+            line = line[line.index("]") + 1 :]
+
+        line = _COMMENT.sub("", line)
+        if "[" in line:
+            line, _, rest = line.partition("[")
+            comment = [rest]
+
+        *complete, last = line.split(";")
+        for part in complete:
+            buffer.append(part)
+            yield ("".join(buffer) + ";").strip()
+            buffer = []
+        buffer.append(last)
+
+    rest = "".join(buffer).strip()
+    if rest:
+        yield rest
+
+
+def iter_trees(lines):
+    """
+    Yield (name, newick) for every tree in a Newick or NEXUS text.
+
+    lines is any iterable of text lines, so files can be streamed. Leaf
+    labels of NEXUS trees are replaced using the translate table.
+    """
+    nexus = None
+    in_trees = False
+    translate = None
+    count = 0
+
+    for statement in _statements(lines):
+        if nexus is None:
+            nexus = statement.upper().startswith("#NEXUS")
+            if nexus:
+                statement = statement[len("#NEXUS") :].strip()
+
+        if not nexus:
+            if statement.strip(";").strip():
+                count += 1
+                yield str(count), statement
+            continue
+
+        lowered = statement.lower()
+        if _BEGIN_TREES.match(lowered):
+            in_trees = True
+            continue
+        if not in_trees:
+            continue
+        if lowered.startswith("end;") or lowered.startswith("endblock;"):
+            in_trees = False
+        elif lowered.startswith("translate"):
+            entries = statement[len("translate") :].rstrip(";").split(",")
+            translate = {}
+            for entry in entries:
+                # Key and label may be separated by tabs as well as spaces
+                parts = entry.split(None, 1)
+                if len(parts) == 2:
+                    translate[parts[0]] = _unquote(parts[1].strip())
+        else:
+            match = _TREE_STATEMENT.match(statement)
+            if match:
+                newick = match.group(2)
+                if translate:
+                    newick = _translate(newick, translate)
+                yield match.group(1), newick
+
+
+def _translate(newick, translate):
+    out = []
+    previous = None
+    for token in _TOKEN.findall(newick):
+        if previous in ("(", ",", None) and token not in _PUNCTUATION:
+            token = translate.get(token, token)
+            if re.search(r"[\s(),;:\[\]']", token):
+                token = "'" + token.replace("'", "''") + "'"
+        out.append(token)
+        previous = token
+    return "".join(out)
+
+
+def leaf_labels(newick):
+    """
+    Leaf labels of a Newick tree in order of appearance.
+    """
+    labels = []
+    previous = None
+    for token in _TOKEN.findall(newick):
+        if token[0] == "[":
+            continue
+        if previous in ("(", ",", None) and token not in _PUNCTUATION:
+            labels.append(_unquote(token))
+        previous = token
+    return labels
+
+
+def newick_splits(newick, taxa):
+    """
+    Non-trivial bipartitions of an unrooted tree as integer bitmasks.
+
+    taxa maps leaf labels to bit positions. Every split is stored from the
+    side that does not contain taxon 0, so equal splits have equal masks
+    however the tree is rooted.
+    """
+    full = (1 << len(taxa)) - 1
+    stack = []
+    current = 0
+    clades = []
+    previous = None
+    for token in _TOKEN.findall(newick):
+        if token[0] == "[":
+            continue
+        if token == "(":
+            stack.append(current)
+            current = 0
+        elif token == ")":
+            clades.append(current)
+            current = stack.pop() | current
+        elif token not in _PUNCTUATION and previous in ("(", ",", None):
+            label = _unquote(token)
+            if label not in taxa:
+                raise ValueError(f"Taxon '{label}' is not present in every tree.")
+            current |= 1 << taxa[label]
+        previous = token
+
+    if current != full:
+        raise ValueError("Trees must all contain the same taxa.")
+
+    splits = set()
+    for clade in clades:
+        if clade & 1:
+            clade = full ^ clade
+        size = clade.bit_count()
+        if 1 < size < len(taxa) - 1:
+            splits.add(clade)
+    return frozenset(splits)
+
+
+def taxon_order(newick):
+    """
+    Fixed taxon ordering (label -> bit position) taken from one tree.
+    """
+    return {label: i for i, label in enumerate(sorted(leaf_labels(newick)))}
+
+
+def landmark_embedding(
+    split_sets, n_taxa, dimensions=DEFAULT_DIMENSIONS, landmarks=DEFAULT_LANDMARKS, seed=0
+):
+    """
+    Landmark MDS coordinates of split sets.
+
+    Only the landmark-to-landmark and tree-to-landmark distances are
+    computed, EMBED_CHUNK trees at a time, so memory grows linearly with
+    the number of trees.
+    """
+    n = len(split_sets)
+    rng = np.random.default_rng(seed)
+    chosen = np.sort(rng.choice(n, size=min(landmarks, n), replace=False))
+    landmark_sets = [split_sets[i] for i in chosen]
+    lmds = LandmarkMDS(rf_distance_matrix(landmark_sets, n_taxa, workers=1), dimensions)
+
+    coords = np.empty((n, dimensions), dtype=np.float32)
+    for start in range(0, n, EMBED_CHUNK):
+        chunk = split_sets[start : start + EMBED_CHUNK]
+        coords[start : start + len(chunk)] = lmds.transform(
+            rf_to_landmarks(chunk, landmark_sets)
+        )
+    return coords
+
+
+def embed_trees(
+    samples, dimensions=DEFAULT_DIMENSIONS, method="auto", landmarks=DEFAULT_LANDMARKS
+):
+    """
+    MDS embedding of posterior tree samples.
+
+    samples is a list of (group, lines) pairs, one per chain. Returns a
+    trace frame with one row per tree: tree (topology id shared by all
+    groups), state (tree name in the file), group and MDS1..MDSk.
+    Distances are only computed between distinct topologies. method is
+    "classical", "landmark" or "auto", which switches to landmark MDS
+    above LANDMARK_THRESHOLD distinct topologies.
+    """
+    taxa = None
+    topologies = {}
+    groups, states, tree_ids = [], [], []
+
+    for group, lines in samples:
+        for name, newick in iter_trees(lines):
+            if taxa is None:
+                taxa = taxon_order(newick)
+            splits = newick_splits(newick, taxa)
+            tree_ids.append(topologies.setdefault(splits, len(topologies)))
+            groups.append(group)
+            states.append(name)
+
+    if taxa is None:
+        raise ValueError("No trees found.")
+
+    topologies = list(topologies)
+    if method == "auto":
+        method = "landmark" if len(topologies) > LANDMARK_THRESHOLD else "classical"
+    if method == "landmark":
+        coords = landmark_embedding(topologies, len(taxa), dimensions, landmarks)
+    else:
+        D = rf_distance_matrix(topologies, len(taxa))
+        coords = classical_mds(D, dimensions).astype(np.float32)
+    coords = coords[np.asarray(tree_ids)]
+
+    df = pd.DataFrame(
+        {
+            "tree": np.asarray(tree_ids, dtype=np.int32) + 1,
+            "state": states,
+            "group": groups,
+        }
+    )
+    for k in range(dimensions):
+        df[f"MDS{k + 1}"] = coords[:, k]
+    return df
+
+
+def load_tree_buffers(buffers, filenames, cache=None, dimensions=DEFAULT_DIMENSIONS):
+    """
+    Embed tree files jointly, one group per file, and normalize the result
+    like a trace TSV. Returns the DataFrame and a key derived from the
+    content of all files.
+    """
+    key = content_key("".join(content_key(b) for b in buffers).encode())
+    df = cache.get(key) if cache is not None else None
+    if df is None:
+        # Decode lazily so the text of large files is never held in full
+        samples = [
+            (
+                os.path.splitext(filename)[0],
+                io.TextIOWrapper(BufferReader(buffer), encoding="utf-8"),
+            )
+            for buffer, filename in zip(buffers, filenames)
+        ]
+        try:
+            df = normalize_trace(embed_trees(samples, dimensions))
+        finally:
+            for _, lines in samples:
+                lines.close()
+        if cache is not None:
+            cache.put(key, df)
+    return df, key
+
+
+def embedded_filename(filenames):
+    """
+    Name under which jointly embedded tree files are listed.
+    """
+    return "+".join(os.path.splitext(f)[0] for f in filenames) + ".mds"
@@ -1,5 +1,7 @@
 import dash_mantine_components as dmc
 from dash import dcc, html
+from .plot_utils import make_psrf_figure
+import uuid
 
 # Header
 
@@ -63,7 +65,10 @@ def add_main_body():
                 bd="1px solid var(--mantine-color-default-border)",
             ),
             dmc.TabsPanel(html.Div(id="data-info-display"), value="data"),
-            dmc.TabsPanel(html.Div(id="plot-display"), value="traces"),
+            dmc.TabsPanel(
+                html.Div([add_job_progress("plot-progress"), html.Div(id="plot-display")]),
+                value="traces",
+            ),
             dmc.TabsPanel(add_about(), value="about"),
         ],
         color="blue.2",  # default is blue
@@ -103,17 +108,174 @@ clear_data_button = dmc.Button(
 )
 
 
-def add_navbar():
+def add_server_path():
+    return dmc.Stack(
+        [
+            dmc.TextInput(
+                id="server-path-input",
+                placeholder="/path/to/traces or trace.tsv",
+                label="Open from server path / directory",
+            ),
+            dmc.Button(
+                "Open Path",
+                justify="center",
+                fullWidth=True,
+                variant="light",
+                id="open-path-button",
+            ),
+        ],
+        gap="xs",
+    )
+
+
+def _format_number(value, digits):
+    return "-" if value is None or value != value else f"{value:.{digits}f}"
+
+
+def add_diagnostics_panel(summary, threshold):
+    # Convergence diagnostics of the selected treenum window
+    columns = summary["columns"]
+    psrf = dmc.Group(
+        [
+            dmc.Badge(
+                f"{col}: {_format_number(r, 3)}",
+                color="gray" if r != r else "green" if r < threshold else "red",
+                variant="light",
+            )
+            for col, r in zip(columns, summary["psrf"])
+        ],
+        gap=4,
+    )
+    table = dmc.Table(
+        data={
+            "head": ["Group", "Trees", "Min ESS", "Drift"],
+            "body": [
+                [
+                    group,
+                    rows,
+                    _format_number(min((e for e in ess if e == e), default=None), 0),
+                    _format_number(drift, 3),
+                ]
+                for group, rows, ess, drift in zip(
+                    summary["groups"], summary["rows"], summary["ess"], summary["drift"]
+                )
+            ],
+        },
+        fz="xs",
+        striped=True,
+    )
+    return dmc.Stack(
+        [
+            dmc.Title("Diagnostics", order=5),
+            dmc.Text("PSRF (between vs within groups)", size="xs", c="dimmed"),
+            psrf,
+            dcc.Graph(
+                figure=make_psrf_figure(
+                    summary["series_treenum"], summary["series_psrf"], threshold
+                ),
+                config={"displayModeBar": False},
+            ),
+            table,
+        ],
+        gap="xs",
+    )
+
+
+# Trees listed by the selection panel; the download has all of them
+SELECTION_TABLE_ROWS = 20
+
+
+def add_selection_panel(frame, query):
+    # Trees matched by a selection or a click on the graph
+    nearest = query["kind"] == "nearest"
+    groups = frame.groupby("group", observed=True, sort=False)["tree"].agg(
+        ["size", "nunique"]
+    )
+    trees = frame.groupby("tree", sort=False).agg(
+        rows=("group", "size"),
+        groups=("group", "nunique"),
+        **({"distance": ("distance", "min")} if nearest else {}),
+    )
+    if nearest:
+        trees = trees.sort_values("distance", kind="stable")
+        title = f"Trees nearest to tree {query['tree']}"
+    else:
+        trees = trees.sort_values("rows", ascending=False, kind="stable")
+        title = f"Trees in {query['kind']} selection"
+    trees = trees.head(SELECTION_TABLE_ROWS)
+
+    head = ["Tree", "Rows", "Groups"] + (["Distance"] if nearest else [])
+    body = [
+        [tree, row.rows, row.groups] + ([_format_number(row.distance, 3)] if nearest else [])
+        for tree, row in trees.iterrows()
+    ]
+    return dmc.Stack(
+        [
+            dmc.Title(title, order=5),
+            dmc.Text(
+                f"{len(frame):,} rows, {frame['tree'].nunique():,} distinct trees "
+                f"in {len(groups)} groups",
+                size="xs",
+                c="dimmed",
+            ),
+            dmc.Table(
+                data={
+                    "head": ["Group", "Rows", "Trees"],
+                    "body": [[str(gr), int(r), int(t)] for gr, (r, t) in groups.iterrows()],
+                },
+                fz="xs",
+                striped=True,
+            ),
+            dmc.Table(data={"head": head, "body": body}, fz="xs", striped=True),
+        ],
+        gap="xs",
+    )
+
+
+def add_job_progress(progress_id):
+    # Progress of a background job, shown while the job is running
+    return html.Div(
+        dmc.Stack(
+            [
+                dmc.Progress(id=progress_id, value=0, striped=True, animated=True),
+                dmc.Group(
+                    [
+                        dmc.Text(id=f"{progress_id}-label", size="xs"),
+                        dmc.Button(
+                            "Cancel",
+                            id=f"{progress_id}-cancel",
+                            size="compact-xs",
+                            variant="subtle",
+                            color="red",
+                        ),
+                    ],
+                    justify="space-between",
+                ),
+            ],
+            gap=4,
+        ),
+        id=f"{progress_id}-box",
+        style={"display": "none"},
+    )
+
+
+def add_navbar(stored_data=None):
     return dmc.AppShellNavbar(
         id="navbar",
         children=[
             dmc.Stack(
                 [
                     upload_button,
+                    add_job_progress("upload-progress"),
+                    add_server_path(),
                     clear_data_button,
                     html.Div(id="upload-placeholder"),
                     # Hidden div to store uploaded files data
-                    html.Div(id="uploaded-files-storage", style={"display": "none"}),
+                    html.Div(
+                        stored_data,
+                        id="uploaded-files-storage",
+                        style={"display": "none"},
+                    ),
                     # Add a div to display validation messages
                     dmc.Alert(
                         id="validation-alert",
@@ -124,6 +286,14 @@ def add_navbar():
                     ),
                     # Display selected file info
                     html.Div(id="file-info-display"),
+                    # Session id kept by the browser tab across reloads
+                    dcc.Store(
+                        id="session-id",
+                        storage_type="session",
+                        data=uuid.uuid4().hex,
+                    ),
+                    dmc.Text(id="session-memory", size="xs", c="dimmed"),
+                    dcc.Interval(id="memory-interval", interval=5000),
                 ]
             ),
         ],
@@ -0,0 +1,110 @@
+"""
+WSGI entry point for serving TreeTracer from several worker processes, e.g.
+
+    gunicorn --workers 4 --bind 0.0.0.0:8050 "treetracer.wsgi:create_server()"
+
+Settings are read from the environment when not passed to create_server:
+
+    TREETRACER_PATHS          trace files or directories to preload, separated by ':'
+    TREETRACER_ROOTS          directories the server path box may open, separated
+                              by ':' (default: TREETRACER_PATHS)
+    TREETRACER_DATA_DIR       directory shared by all workers for session data
+    TREETRACER_MEMORY_BUDGET  GiB of traces each worker keeps mapped
+    TREETRACER_FIGURE_CACHE   GiB of recent frames and figures each worker caches
+    TREETRACER_SESSION_HOURS  hours after which a worker drops an unused session
+    TREETRACER_METRICS        set to 1 to time callbacks and serve /metrics
+    TREETRACER_PROFILE_DIR    directory for cProfile dumps of slow callback requests
+    TREETRACER_PROFILE_SLOW   seconds above which a callback request is profiled
+
+Metrics are collected per worker process, so scrape each worker separately.
+"""
+
+import json
+import os
+
+from .app import create_dash_app
+from .cache import DEFAULT_CACHE_DIR, DEFAULT_FIGURE_CACHE_SIZE, FigureCache, TraceCache
+from .callbacks import load_trace_paths, register_callbacks
+from .jobs import job_manager
+from .loader import TRACE_EXTENSIONS, list_trace_files, set_file
+from .metrics import DEFAULT_SLOW_SECONDS, CallbackMetrics
+from .store import DEFAULT_MEMORY_BUDGET, DEFAULT_SESSION_TTL, SharedSessionStore
+from .trees import TREE_EXTENSIONS
+
+
+DEFAULT_DATA_DIR = os.path.join(DEFAULT_CACHE_DIR, "sessions")
+
+
+def create_app(paths=None, data_dir=None, memory_budget=None, roots=None):
+    """
+    Dash app whose traces are kept in memory-mapped files shared by all
+    worker processes started from the same data_dir. Users may only open
+    server paths inside roots.
+    """
+    if paths is None:
+        paths = [p for p in os.environ.get("TREETRACER_PATHS", "").split(os.pathsep) if p]
+    if roots is None:
+        roots = [p for p in os.environ.get("TREETRACER_ROOTS", "").split(os.pathsep) if p]
+        roots = roots or paths
+    if data_dir is None:
+        data_dir = os.environ.get("TREETRACER_DATA_DIR", DEFAULT_DATA_DIR)
+    if memory_budget is None:
+        memory_budget = float(
+            os.environ.get("TREETRACER_MEMORY_BUDGET", DEFAULT_MEMORY_BUDGET / 1024**3)
+        )
+
+    session_hours = float(
+        os.environ.get("TREETRACER_SESSION_HOURS", DEFAULT_SESSION_TTL / 3600)
+    )
+
+    cache = TraceCache()
+    store = SharedSessionStore(
+        data_dir, int(memory_budget * 1024**3), session_ttl=session_hours * 3600
+    )
+
+    # Preload traces; the first worker parses them, the others hit the cache
+    file_data = []
+    files = []
+    for path in paths:
+        files.extend(list_trace_files(path, TRACE_EXTENSIONS + TREE_EXTENSIONS))
+    load_trace_paths(files, store.shared, file_data, cache, store.shared_tails)
+
+    # Serve the memory-mapped cache entries rather than each worker's parsed copy
+    for item in file_data:
+        df = cache.get(item["hash"])
+        if df is not None:
+            set_file(df, item["filename"])
+            store.shared[item["filename"]] = df
+        store.shared_keys[item["filename"]] = item["hash"]
+
+    app = create_dash_app(
+        json.dumps(file_data) if file_data else None,
+        job_manager(os.path.join(data_dir, "jobs")),
+    )
+    figure_cache = float(
+        os.environ.get("TREETRACER_FIGURE_CACHE", DEFAULT_FIGURE_CACHE_SIZE / 1024**3)
+    )
+    register_callbacks(
+        app,
+        store,
+        cache=cache,
+        metrics=metrics_from_env(),
+        figures=FigureCache(int(figure_cache * 1024**3)),
+        path_roots=roots,
+    )
+    return app
+
+
+def metrics_from_env():
+    profile_dir = os.environ.get("TREETRACER_PROFILE_DIR")
+    if os.environ.get("TREETRACER_METRICS", "") in ("", "0") and not profile_dir:
+        return None
+    slow = float(os.environ.get("TREETRACER_PROFILE_SLOW", DEFAULT_SLOW_SECONDS))
+    return CallbackMetrics(profile_dir, slow)
+
+
+def create_server(paths=None, data_dir=None, memory_budget=None, roots=None):
+    """
+    WSGI application for gunicorn or any other WSGI server.
+    """
+    return create_app(paths, data_dir, memory_budget, roots).server